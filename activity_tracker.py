@@ -0,0 +1,113 @@
+"""
+Active chatters of one channel over a sliding time window.
+
+A viewer counts as active while their last chat message is younger than the
+window. Every message moves the author to the end of an OrderedDict keyed by
+username, so the dict stays sorted by last-message time:
+
+- record() is O(1): update the timestamp and move_to_end;
+- expired users are always at the front and are popped from there, so
+  active() costs O(active), not O(all viewers) — nobody scans the chatters list;
+- each user also has an engagement score: the number of their messages,
+  exponentially decayed with a half-life, updated in O(1) per message.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+ACTIVE_WINDOW = 600          # Зритель активен 10 минут после последнего сообщения
+ENGAGEMENT_HALF_LIFE = 300   # Вес сообщения в оценке вовлеченности падает вдвое за 5 минут
+
+
+class ActivityTracker:
+    """Last-message times and engagement scores of the chatters of one channel"""
+
+    def __init__(self, window: float = ACTIVE_WINDOW, half_life: float = ENGAGEMENT_HALF_LIFE):
+        self.window = window
+        self.half_life = half_life
+        self._lock = threading.Lock()
+        self._last: "OrderedDict[str, float]" = OrderedDict()  # имя -> время последнего сообщения, по возрастанию
+        self._scores: Dict[str, float] = {}  # Оценка на момент последнего сообщения
+
+        self.messages = 0
+        self.expired = 0
+
+    def record(self, username: str, now: Optional[float] = None):
+        """Chat message from username"""
+        username = username.lower()
+        now = now or time.time()
+        with self._lock:
+            last = self._last.get(username)
+            if last is None:
+                score = 1.0
+            else:
+                score = self._decay(self._scores[username], now - last) + 1.0
+                self._last.move_to_end(username)
+            self._last[username] = now
+            self._scores[username] = score
+            self.messages += 1
+
+    def _decay(self, score: float, elapsed: float) -> float:
+        return score * 0.5 ** (max(elapsed, 0.0) / self.half_life)
+
+    def _expire(self, now: float):
+        # Самые давние сообщения в начале словаря
+        last = self._last
+        cutoff = now - self.window
+        while last:
+            username, seen = next(iter(last.items()))
+            if seen > cutoff:
+                break
+            last.popitem(last=False)
+            del self._scores[username]
+            self.expired += 1
+
+    def active(self, now: Optional[float] = None) -> Set[str]:
+        """Users whose last message is inside the window"""
+        now = now or time.time()
+        with self._lock:
+            self._expire(now)
+            return set(self._last)
+
+    def engagement(self, username: str, now: Optional[float] = None) -> float:
+        """Decayed message count of an active user, 0 if the user is not active"""
+        username = username.lower()
+        now = now or time.time()
+        with self._lock:
+            last = self._last.get(username)
+            if last is None or last <= now - self.window:
+                return 0.0
+            return self._decay(self._scores[username], now - last)
+
+    def top(self, limit: int = 10, now: Optional[float] = None) -> List[Tuple[str, float]]:
+        """Most engaged active users, highest score first"""
+        now = now or time.time()
+        with self._lock:
+            self._expire(now)
+            scores = [(username, round(self._decay(self._scores[username], now - last), 2))
+                      for username, last in self._last.items()]
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores[:limit]
+
+    def last_message(self, username: str) -> Optional[float]:
+        return self._last.get(username.lower())
+
+    def __contains__(self, username) -> bool:
+        last = self._last.get(username.lower())
+        return last is not None and last > time.time() - self.window
+
+    def __len__(self) -> int:
+        return len(self.active())
+
+    def metrics(self) -> Dict[str, float]:
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            return {
+                'active': len(self._last),
+                'window_seconds': self.window,
+                'messages': self.messages,
+                'expired': self.expired,
+            }
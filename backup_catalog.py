@@ -0,0 +1,137 @@
+"""
+Catalog of every backup file the application writes.
+
+Command history versions, currency backups and comprehensive system backups
+are registered here when they are written and removed when they are pruned,
+so listing and cleanup are index queries instead of directory scans that
+stat and parse every file. A backup kind that is not in the catalog yet
+(first start, old installation) is indexed once from its directory.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
+
+
+KIND_HISTORY = "history"
+KIND_CURRENCY = "currency"
+KIND_COMPREHENSIVE = "comprehensive"
+
+DEFAULT_CATALOG_PATH = os.path.join("backups", "backup_catalog.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    created REAL NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    meta TEXT
+);
+CREATE INDEX IF NOT EXISTS backups_kind_created ON backups (kind, created);
+CREATE TABLE IF NOT EXISTS indexed_kinds (
+    kind TEXT PRIMARY KEY
+);
+"""
+
+# (path, created, size, meta)
+CatalogEntry = Tuple[str, float, int, Optional[Dict[str, Any]]]
+
+
+class BackupCatalog:
+    """SQLite index of backup files, one shared instance per catalog file"""
+
+    _instances: Dict[str, "BackupCatalog"] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, db_path=DEFAULT_CATALOG_PATH) -> "BackupCatalog":
+        """Shared catalog for a file path"""
+        key = os.path.abspath(str(db_path))
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(key)
+            return cls._instances[key]
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def ensure_indexed(self, kind: str, scan: Callable[[], Iterable[CatalogEntry]]):
+        """Index existing backups of a kind once, using the given directory scan"""
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM indexed_kinds WHERE kind = ?", (kind,)).fetchone():
+                return
+            entries = list(scan())
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?)",
+                    [(str(path), kind, created, size, json.dumps(meta) if meta else None)
+                     for path, created, size, meta in entries]
+                )
+                self._conn.execute("INSERT OR REPLACE INTO indexed_kinds VALUES (?)", (kind,))
+            print(f"[BACKUP CATALOG] Indexed {len(entries)} existing {kind} backups")
+
+    def add(self, kind: str, path, created: float, size: int, meta: Optional[Dict[str, Any]] = None):
+        """Register a new backup (or update an existing entry)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?)",
+                (str(path), kind, created, size, json.dumps(meta) if meta else None)
+            )
+
+    def remove(self, paths: Iterable):
+        """Forget pruned backups"""
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM backups WHERE path = ?", [(str(path),) for path in paths])
+
+    def list(self, kind: str, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        """Backups of a kind, newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, created, size, meta FROM backups WHERE kind = ? "
+                "ORDER BY created DESC, path DESC LIMIT ? OFFSET ?",
+                (kind, -1 if limit is None else limit, offset)
+            ).fetchall()
+        return [{"path": path, "created": created, "size": size, "meta": json.loads(meta) if meta else {}}
+                for path, created, size, meta in rows]
+
+    def get(self, path) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT kind, created, size, meta FROM backups WHERE path = ?", (str(path),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"path": str(path), "kind": row[0], "created": row[1], "size": row[2],
+                "meta": json.loads(row[3]) if row[3] else {}}
+
+    def count(self, kind: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM backups WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def paths_beyond(self, kind: str, keep: int) -> List[str]:
+        """Paths of all backups of a kind except the newest `keep` ones"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT path FROM backups WHERE kind = ? ORDER BY created DESC, path DESC LIMIT -1 OFFSET ?",
+                (kind, keep)
+            )]
+
+    def total_size(self, kind: Optional[str] = None) -> int:
+        with self._lock:
+            if kind is None:
+                row = self._conn.execute("SELECT SUM(size) FROM backups").fetchone()
+            else:
+                row = self._conn.execute("SELECT SUM(size) FROM backups WHERE kind = ?", (kind,)).fetchone()
+        return row[0] or 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,183 @@
+"""
+Comprehensive system backups written off the UI thread.
+
+The small sections of a backup (commands, settings, moderators, ranks) are
+copied by the caller; currency users are streamed from a UserStore snapshot.
+Everything goes through gzip into a single system_backup_*.json.gz file, one
+user record at a time, so memory use does not grow with the number of users.
+"""
+
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Callable, List, Optional
+
+from backup_catalog import KIND_COMPREHENSIVE
+
+
+BACKUP_VERSION = "1.1"
+BACKUP_PATTERNS = ("system_backup_*.json", "system_backup_*.json.gz")
+
+# Секции после currency_users, в порядке старого формата
+_TRAILING_SECTIONS = ("moderators", "config", "ranks", "command_history", "currency_settings")
+
+
+def meta_path(backup_path) -> Path:
+    """Metadata file next to a backup (system_backup_X.json[.gz].meta)"""
+    return Path(f"{backup_path}.meta")
+
+
+def backup_stem(backup_path) -> str:
+    """Backup name without .json / .json.gz"""
+    name = Path(backup_path).name
+    for suffix in (".gz", ".json"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def list_backups(backup_dir) -> List[Path]:
+    """Plain and compressed comprehensive backups in a directory"""
+    backup_dir = Path(backup_dir)
+    if not backup_dir.exists():
+        return []
+    files = []
+    for pattern in BACKUP_PATTERNS:
+        files.extend(backup_dir.glob(pattern))
+    return files
+
+
+def scan_backups(backup_dir):
+    """Catalog entries for comprehensive backups already on disk"""
+    for backup_file in list_backups(backup_dir):
+        try:
+            metadata = load_metadata(backup_file)
+            stat = backup_file.stat()
+            yield backup_file, metadata.get('backup_time', stat.st_mtime), stat.st_size, metadata
+        except Exception as e:
+            print(f"[COMPREHENSIVE BACKUP] Error reading backup {backup_file}: {e}")
+
+
+def load_backup(backup_path) -> Dict[str, Any]:
+    """Read a comprehensive backup, compressed or not"""
+    if str(backup_path).endswith(".gz"):
+        with gzip.open(backup_path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    with open(backup_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_metadata(backup_path) -> Dict[str, Any]:
+    """Read the .meta file of a backup, empty dict if there is none"""
+    path = meta_path(backup_path)
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class ComprehensiveBackupWriter:
+    """Streams one comprehensive backup into a gzip archive"""
+
+    def __init__(self, backup_dir, sections: Dict[str, Any], users_snapshot=None,
+                 progress_callback: Optional[Callable[[int, int], None]] = None,
+                 compresslevel: int = 6, catalog=None):
+        """
+        Args:
+            backup_dir: Directory for system_backup_*.json.gz files
+            sections: JSON-ready sections (commands, moderators, config, ...),
+                already copied by the caller
+            users_snapshot: UserSnapshot to stream currency users from, or None
+            progress_callback: Called as (users_written, users_total)
+            compresslevel (int): gzip compression level
+            catalog: BackupCatalog to register the finished backup in
+        """
+        self.backup_dir = Path(backup_dir)
+        self.sections = sections
+        self.users_snapshot = users_snapshot
+        self.progress_callback = progress_callback
+        self.compresslevel = compresslevel
+        self.catalog = catalog
+
+    def _progress(self, done: int, total: int):
+        if self.progress_callback:
+            self.progress_callback(done, total)
+
+    def write(self) -> Path:
+        """Write the backup and its metadata, returns the archive path"""
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+
+        now = datetime.now()
+        backup_name = f"system_backup_{now.strftime('%Y%m%d_%H%M%S')}"
+        backup_path = self.backup_dir / f"{backup_name}.json.gz"
+        tmp_path = Path(f"{backup_path}.tmp")
+
+        backup_info = {
+            "timestamp": now.isoformat(),
+            "version": BACKUP_VERSION,
+            "description": "Comprehensive system backup created during operation"
+        }
+        users_total = len(self.users_snapshot) if self.users_snapshot is not None else 0
+        users_count = 0
+        raw_size = 0
+
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=self.compresslevel) as f:
+                def emit(text):
+                    nonlocal raw_size
+                    raw_size += len(text.encode("utf-8"))
+                    f.write(text)
+
+                emit('{\n"backup_info": ' + json.dumps(backup_info, ensure_ascii=False))
+                emit(',\n"commands": ' + json.dumps(self.sections.get("commands", []), ensure_ascii=False))
+
+                # Пользователи пишутся по одному, без промежуточного словаря
+                emit(',\n"currency_users": {')
+                if self.users_snapshot is not None:
+                    for username, record in self.users_snapshot.items():
+                        emit(("," if users_count else "") + "\n" + json.dumps(username, ensure_ascii=False)
+                             + ": " + json.dumps(record, ensure_ascii=False))
+                        users_count += 1
+                        if users_count % 1000 == 0:
+                            self._progress(users_count, users_total)
+                emit("\n}")
+
+                for section in _TRAILING_SECTIONS:
+                    emit(f',\n"{section}": ' + json.dumps(self.sections.get(section, {}), ensure_ascii=False))
+                emit("\n}\n")
+            os.replace(tmp_path, backup_path)
+        except Exception:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+        finally:
+            if self.users_snapshot is not None:
+                self.users_snapshot.close()
+
+        self._progress(users_count, users_total)
+
+        metadata = {
+            "backup_time": time.time(),
+            "backup_name": backup_name,
+            "backup_info": backup_info,
+            "commands_count": len(self.sections.get("commands", [])),
+            "users_count": users_count,
+            "moderators_count": len(self.sections.get("moderators", {}).get("manual", [])),
+            "ranks_count": len(self.sections.get("ranks", [])),
+            "users_checksum": getattr(self.users_snapshot, "digest", None),
+            "total_size": backup_path.stat().st_size,
+            "uncompressed_size": raw_size,
+            "version": BACKUP_VERSION
+        }
+        with open(meta_path(backup_path), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, indent=2)
+        if self.catalog is not None:
+            self.catalog.add(KIND_COMPREHENSIVE, backup_path, metadata["backup_time"],
+                             metadata["total_size"], metadata)
+
+        print(f"[COMPREHENSIVE BACKUP] Created backup: {backup_path.name} "
+              f"({users_count} users, {metadata['total_size']} bytes)")
+        return backup_path
@@ -0,0 +1,56 @@
+"""Command dispatch: key normalization of every chat message and command
+
+Each benchmark runs the translate-table normalization of command_keys (with
+and without its memo) next to the per-character loop it replaced.
+"""
+
+import pytest
+
+import command_keys
+
+
+def _legacy_normalize(key):
+    """The per-character implementation used before command_keys"""
+    if not key:
+        return ""
+    key = key.lower()
+    normalized = ''
+    for c in key:
+        if c.isprintable() and not c.isspace():
+            normalized += c
+    normalized = normalized.replace('!', '')
+    if normalized != key and key:
+        print(f"Command key normalized: '{key}' -> '{normalized}'")
+    return normalized
+
+
+def _uncached_normalize(key):
+    # Только проход по таблице, без мемоизации
+    return key.lower().translate(command_keys._TABLE) if key else ""
+
+
+IMPLEMENTATIONS = pytest.mark.parametrize(
+    "normalize", [_legacy_normalize, _uncached_normalize, command_keys.normalize_command_key],
+    ids=["legacy", "translate", "translate+memo"])
+
+
+@IMPLEMENTATIONS
+def bench_normalize_command_keys(benchmark, commands, normalize):
+    """Normalizing the key of every command, as done when matching a message"""
+    keys = [cmd["Command"] for cmd in commands]
+    assert [normalize(key) for key in keys] == [_legacy_normalize(key) for key in keys]
+    benchmark(lambda: [normalize(key) for key in keys])
+
+
+@IMPLEMENTATIONS
+def bench_normalize_chat_words(benchmark, commands, normalize):
+    """Normalizing first words of chat messages, with invisible characters in some of them"""
+    words = []
+    for i, cmd in enumerate(commands):
+        key = cmd["Command"]
+        if i % 10 == 0:
+            key += "\u200b"  # Невидимый пробел, который добавляют некоторые клиенты
+        elif i % 10 == 1:
+            key = key.upper()
+        words.append(key)
+    benchmark(lambda: [normalize(word) for word in words])
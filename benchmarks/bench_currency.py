@@ -0,0 +1,62 @@
+"""Currency hot paths: single balance updates, the payout tick and saving"""
+
+import itertools
+import random
+import time
+
+# Доля пользователей, которые смотрят стрим во время начисления
+VIEWER_SHARE = 0.1
+MAX_VIEWERS = 20_000
+
+
+def _viewers(usernames, seed=1):
+    rng = random.Random(seed)
+    count = max(1, min(MAX_VIEWERS, int(len(usernames) * VIEWER_SHARE)))
+    viewers = rng.sample(usernames, count)
+    return viewers, viewers[:max(1, count // 5)]
+
+
+def bench_add_points(benchmark, currency_manager, usernames):
+    """One chat payout or gift to an existing user"""
+    names = itertools.cycle(random.Random(1).sample(usernames, min(len(usernames), 10_000)))
+    benchmark(lambda: currency_manager.add_points(next(names), 1.5))
+
+
+def bench_add_points_new_user(benchmark, currency_manager):
+    """First payout to a user that is not in the store yet"""
+    counter = itertools.count()
+    benchmark(lambda: currency_manager.add_points(f"newcomer{next(counter)}", 1))
+
+
+def bench_format_currency_message(benchmark, currency_manager, usernames):
+    """The !points reply of an existing user"""
+    names = itertools.cycle(random.Random(1).sample(usernames, min(len(usernames), 10_000)))
+    benchmark(lambda: currency_manager.format_currency_message(next(names)))
+
+
+def bench_process_presence_update(benchmark, currency_manager, presence_tracker, usernames):
+    """A 5-minute payout tick for 10% of the users (max 20k) watching a live stream"""
+    all_viewers, active_viewers = _viewers(usernames)
+    active_users = set(active_viewers)
+    start = time.time() - 3600
+    presence_tracker.set_live(True, now=start)
+    presence_tracker.sync(all_viewers, now=start)
+    ticks = itertools.count(1)
+
+    def setup():
+        # Каждый раунд - следующие 5 минут того же эфира
+        return (presence_tracker,), {"now": start + next(ticks) * 300, "active_users": active_users}
+
+    benchmark.pedantic(currency_manager.process_presence_update, setup=setup, rounds=5, iterations=1)
+
+
+def bench_save_users(benchmark, currency_manager, usernames):
+    """Auto-save after a payout tick changed 10% of the users"""
+    all_viewers, _ = _viewers(usernames)
+
+    def setup():
+        for name in all_viewers:
+            currency_manager.add_points(name, 1)
+
+    benchmark.pedantic(currency_manager.save_users, kwargs={"force": True},
+                       setup=setup, rounds=5, iterations=1)
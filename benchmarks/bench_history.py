@@ -0,0 +1,6 @@
+"""Command history: listing the backups for the history dialog"""
+
+
+def bench_get_backups(benchmark, history_manager, backup_count):
+    backups = benchmark(history_manager.get_backups)
+    assert len(backups) == backup_count
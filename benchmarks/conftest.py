@@ -0,0 +1,190 @@
+"""
+Fixtures for the hot-path benchmarks.
+
+Data files are generated once per size and session: users_currency.json with
+realistic balances, hours and flags, commands.json in the editor's format and
+a command_history folder with legacy full-copy backups. Every benchmark gets
+its own copy, so benchmarks that write do not affect each other.
+
+By default the small sizes run (1k/10k users, 100/1k commands, 10/100/1k
+backups). --bench-full adds 100k and 1M users, 10k commands and 10k backups.
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Модули приложения лежат в корне репозитория
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+USER_SIZES = (1_000, 10_000)
+USER_SIZES_FULL = (1_000, 10_000, 100_000, 1_000_000)
+COMMAND_SIZES = (100, 1_000)
+COMMAND_SIZES_FULL = (100, 1_000, 10_000)
+BACKUP_SIZES = (10, 100, 1_000)
+BACKUP_SIZES_FULL = (10, 100, 1_000, 10_000)
+
+DAY = 24 * 3600
+
+
+def pytest_addoption(parser):
+    parser.addoption("--bench-full", action="store_true", default=False,
+                     help="Also run the large sizes (up to 1M users, 10k commands, 10k backups)")
+
+
+def pytest_generate_tests(metafunc):
+    full = metafunc.config.getoption("--bench-full")
+    sizes = {
+        "user_count": USER_SIZES_FULL if full else USER_SIZES,
+        "command_count": COMMAND_SIZES_FULL if full else COMMAND_SIZES,
+        "backup_count": BACKUP_SIZES_FULL if full else BACKUP_SIZES,
+    }
+    for name, values in sizes.items():
+        if name in metafunc.fixturenames:
+            metafunc.parametrize(name, values, scope="session")
+
+
+# --- Генераторы данных ---
+
+def make_users(count: int, seed: int = 1):
+    """users_currency.json content: long-tailed balances, a few regulars, subs and mods"""
+    rng = random.Random(seed)
+    now = time.time()
+    users = {}
+    for i in range(count):
+        hours = round(rng.paretovariate(1.5) - 1, 2)
+        users[f"user{i}"] = {
+            "points": round(hours * rng.uniform(5, 15), 2),
+            "hours": hours,
+            "last_seen": now - rng.expovariate(1 / (30 * DAY)),
+            "is_regular": rng.random() < 0.02,
+            "is_subscriber": rng.random() < 0.05,
+            "is_mod": rng.random() < 0.001,
+        }
+    return users
+
+
+def make_commands(count: int, seed: int = 1):
+    """commands.json content with the editor's fields, some paid and some with sounds"""
+    rng = random.Random(seed)
+    groups = ["GENERAL", "SOUNDS", "MEMES", "INFO"]
+    commands = []
+    for i in range(count):
+        has_sound = rng.random() < 0.6
+        commands.append({
+            "Command": f"!cmd{i}",
+            "Permission": "Everyone" if rng.random() < 0.9 else "Moderator",
+            "Info": f"Command number {i}",
+            "Group": rng.choice(groups),
+            "Response": f"{{user}} used command {i}" if rng.random() < 0.7 else "",
+            "Cooldown": rng.choice([0, 5, 30, 60]),
+            "UserCooldown": rng.choice([0, 0, 10, 60]),
+            "Cost": rng.choice([0, 0, 0, 10, 50, 100]),
+            "Count": rng.randrange(1000),
+            "Usage": "SC",
+            "Enabled": rng.random() < 0.95,
+            "SoundFile": f"sounds/cmd{i}.mp3" if has_sound else "",
+            "Volume": rng.randrange(10, 101),
+        })
+    return commands
+
+
+# --- Сгенерированные файлы (один раз на размер) ---
+
+@pytest.fixture(scope="session")
+def users_file(tmp_path_factory, user_count):
+    path = tmp_path_factory.mktemp(f"users_{user_count}") / "users_currency.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(make_users(user_count), f)
+    return path
+
+
+@pytest.fixture(scope="session")
+def commands_file(tmp_path_factory, command_count):
+    path = tmp_path_factory.mktemp(f"commands_{command_count}") / "commands.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(make_commands(command_count), f, indent=4, ensure_ascii=False)
+    return path
+
+
+@pytest.fixture(scope="session")
+def currency_template(tmp_path_factory, users_file):
+    """Currency directory with the JSON already imported into users_currency.db"""
+    from config_manager import ConfigManager
+    from currency_manager import CurrencyManager
+
+    data_dir = tmp_path_factory.mktemp("currency_template")
+    shutil.copy2(users_file, data_dir / "users_currency.json")
+    # Свой ConfigManager: config.json и прочие файлы программы в корне репозитория не трогаем
+    config_manager = ConfigManager(program_dir=tmp_path_factory.mktemp("currency_template_config"))
+    manager = CurrencyManager(data_dir=data_dir, config_manager=config_manager)
+    manager._store.close()
+    return data_dir
+
+
+@pytest.fixture(scope="session")
+def history_template(tmp_path_factory, backup_count):
+    """command_history folder with `backup_count` legacy backups of 100 commands, one per minute"""
+    root = tmp_path_factory.mktemp(f"history_{backup_count}")
+    history = root / "command_history"
+    history.mkdir()
+    content = json.dumps(make_commands(100), indent=4, ensure_ascii=False).encode("utf-8")
+    start = time.time() - backup_count * 60
+    for i in range(backup_count):
+        created = start + i * 60
+        path = history / f"commands_{time.strftime('%Y%m%d_%H%M%S', time.localtime(created))}_{i:05d}.json"
+        path.write_bytes(content)
+        os.utime(path, (created, created))
+    return root
+
+
+# --- Экземпляры для бенчмарков ---
+
+@pytest.fixture
+def currency_manager(tmp_path, monkeypatch, currency_template):
+    from config_manager import ConfigManager
+    from currency_manager import CurrencyManager
+
+    data_dir = tmp_path / "currency"
+    shutil.copytree(currency_template, data_dir)
+    monkeypatch.chdir(tmp_path)
+    manager = CurrencyManager(data_dir=data_dir, config_manager=ConfigManager(program_dir=tmp_path))
+    yield manager
+    manager._store.close()
+
+
+@pytest.fixture
+def presence_tracker():
+    """Presence of the viewers of one channel, as kept by ChannelContext"""
+    from presence_tracker import PresenceTracker
+
+    return PresenceTracker()
+
+
+@pytest.fixture
+def usernames(user_count):
+    return [f"user{i}" for i in range(user_count)]
+
+
+@pytest.fixture
+def commands(commands_file):
+    with open(commands_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def history_manager(tmp_path, monkeypatch, history_template):
+    from history_manager import HistoryManager
+
+    shutil.copytree(history_template / "command_history", tmp_path / "command_history")
+    monkeypatch.chdir(tmp_path)
+    # Каталог бэкапов индексируется при создании, как при первом запуске
+    return HistoryManager(max_backups=100_000)
@@ -0,0 +1,336 @@
+"""
+Bulk currency operations with filter expressions.
+
+A filter selects users with a small expression language, for example
+
+    hours > 10 and last_seen > 30d and not is_mod
+    points >= 1000 or (is_subscriber and rank = 'VIP')
+    username like 'bot%'
+
+Fields: points, hours, last_seen, rank, username, is_regular, is_mod,
+is_subscriber. Flags can be used on their own (`is_mod`, `not is_regular`).
+Durations (45s, 15m, 12h, 30d, 2w) compare the time since last_seen, so
+`last_seen > 30d` means "not seen for more than 30 days". Missing values
+count as 0 / false / never seen.
+
+The expression is compiled into a parameterized SQL condition and the action
+into a single UPDATE statement, so a giveaway or a season reset is a single
+transaction in the users index instead of a Python loop over every user.
+Each operation is recorded in the bulk_log table of the index.
+
+Actions:
+    add <amount>          add points (negative amounts remove, balance stays >= 0)
+    set <amount>          set points
+    multiply <factor>     multiply points
+    reset                 set points to 0
+    decay <half-life>     halve points per half-life since last_seen, e.g. "decay 90d"
+
+Command line (works on users_currency.db of a data directory):
+    python bulk_ops.py "hours > 10 and not is_mod" add 100 --dry-run
+"""
+
+import argparse
+import re
+import sys
+import time
+from typing import Any, List, Optional, Tuple
+
+ACTIONS = ('add', 'set', 'multiply', 'reset', 'decay')
+
+# Поле фильтра -> SQL-выражение (NULL считается нулем, false или "никогда")
+FIELDS = {
+    'points': 'COALESCE(points, 0)',
+    'hours': 'COALESCE(hours, 0)',
+    'last_seen': 'COALESCE(last_seen, 0)',
+    'rank': "COALESCE(rank, '')",
+    'username': 'username',
+    'is_regular': 'COALESCE(is_regular, 0)',
+    'is_mod': 'COALESCE(is_mod, 0)',
+    'is_subscriber': 'COALESCE(is_subscriber, 0)',
+}
+NUMERIC_FIELDS = ('points', 'hours', 'last_seen')
+TEXT_FIELDS = ('rank', 'username')
+FLAG_FIELDS = ('is_regular', 'is_mod', 'is_subscriber')
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+# Сравнение "давности" переворачивает оператор над меткой времени
+_AGE_OPERATORS = {'>': '<', '>=': '<=', '<': '>', '<=': '>='}
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<duration>\d+(?:\.\d+)?[smhdw])\b |
+        (?P<number>-?\d+(?:\.\d+)?) |
+        (?P<string>'[^']*'|"[^"]*") |
+        (?P<op>>=|<=|!=|==|=|>|<) |
+        (?P<paren>[()]) |
+        (?P<word>[A-Za-z_][A-Za-z_0-9]*)
+    )""", re.VERBOSE)
+
+
+class FilterError(ValueError):
+    """Invalid filter expression or action"""
+
+
+def parse_duration(text) -> float:
+    """Seconds in '30d', '12h', ... (plain numbers are seconds)"""
+    if isinstance(text, (int, float)):
+        return float(text)
+    text = str(text).strip().lower()
+    if text and text[-1] in DURATION_UNITS:
+        try:
+            return float(text[:-1]) * DURATION_UNITS[text[-1]]
+        except ValueError:
+            pass
+    try:
+        return float(text)
+    except ValueError:
+        raise FilterError(f"Invalid duration: {text!r}")
+
+
+def _tokenize(expression: str) -> List[Tuple[str, str]]:
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN_RE.match(expression, position)
+        if not match or match.end() == position:
+            raise FilterError(f"Unexpected input at position {position}: {expression[position:position + 20]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'word':
+            value = value.lower()
+            if value in ('and', 'or', 'not', 'like', 'true', 'false'):
+                kind = value
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class _FilterCompiler:
+    """Recursive descent parser that emits SQL directly"""
+
+    def __init__(self, expression: str, now: float):
+        self.tokens = _tokenize(expression)
+        self.position = 0
+        self.now = now
+        self.params: List[Any] = []
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def _take(self, kind: Optional[str] = None) -> Tuple[str, str]:
+        if self.position >= len(self.tokens):
+            raise FilterError("Unexpected end of filter")
+        token = self.tokens[self.position]
+        if kind is not None and token[0] != kind:
+            raise FilterError(f"Expected {kind}, got {token[1]!r}")
+        self.position += 1
+        return token
+
+    def compile(self) -> str:
+        sql = self._or()
+        if self.position != len(self.tokens):
+            raise FilterError(f"Unexpected {self.tokens[self.position][1]!r}")
+        return sql
+
+    def _or(self) -> str:
+        parts = [self._and()]
+        while self._peek() == 'or':
+            self._take()
+            parts.append(self._and())
+        return parts[0] if len(parts) == 1 else "(" + " OR ".join(parts) + ")"
+
+    def _and(self) -> str:
+        parts = [self._not()]
+        while self._peek() == 'and':
+            self._take()
+            parts.append(self._not())
+        return parts[0] if len(parts) == 1 else "(" + " AND ".join(parts) + ")"
+
+    def _not(self) -> str:
+        if self._peek() == 'not':
+            self._take()
+            return f"NOT {self._not()}"
+        return self._atom()
+
+    def _atom(self) -> str:
+        if self._peek() == 'paren':
+            if self._take()[1] != '(':
+                raise FilterError("Unexpected ')'")
+            sql = self._or()
+            if self._take('paren')[1] != ')':
+                raise FilterError("Expected ')'")
+            return f"({sql})"
+
+        _, field = self._take('word')
+        if field not in FIELDS:
+            raise FilterError(f"Unknown field {field!r}, expected one of: {', '.join(FIELDS)}")
+        column = FIELDS[field]
+        if self._peek() not in ('op', 'like'):
+            if field in FLAG_FIELDS:
+                return f"{column} = 1"
+            raise FilterError(f"Field {field!r} needs a comparison")
+
+        kind, op = self._take()
+        if kind == 'like':
+            if field not in TEXT_FIELDS:
+                raise FilterError(f"'like' only works on {', '.join(TEXT_FIELDS)}")
+            self.params.append(self._value('string'))
+            return f"{column} LIKE ?"
+        op = '=' if op == '==' else op
+
+        kind = self._peek()
+        if kind == 'duration':
+            if field != 'last_seen':
+                raise FilterError("Durations only work with last_seen")
+            if op not in _AGE_OPERATORS:
+                raise FilterError("Durations need >, >=, < or <=")
+            self.params.append(self.now - parse_duration(self._take()[1]))
+            return f"{column} {_AGE_OPERATORS[op]} ?"
+
+        if field in FLAG_FIELDS:
+            if op not in ('=', '!='):
+                raise FilterError(f"Flag {field!r} only supports = and !=")
+            self.params.append(1 if self._value('true', 'false', 'number') else 0)
+        elif field in NUMERIC_FIELDS:
+            self.params.append(self._value('number'))
+        else:
+            self.params.append(self._value('string'))
+        return f"{column} {op} ?"
+
+    def _value(self, *kinds):
+        kind, value = self._take()
+        if kind not in kinds:
+            raise FilterError(f"Expected {' or '.join(kinds)}, got {value!r}")
+        if kind == 'number':
+            return float(value)
+        if kind == 'string':
+            return value[1:-1]
+        return kind == 'true'
+
+
+def compile_filter(expression: Optional[str], now: Optional[float] = None) -> Tuple[str, List[Any]]:
+    """Compile a filter expression into (SQL condition, parameters); empty matches everyone"""
+    if expression is None or not expression.strip():
+        return "1", []
+    compiler = _FilterCompiler(expression, now or time.time())
+    return compiler.compile(), compiler.params
+
+
+def _half_life_factor(age, half_life):
+    if age is None or age <= 0:
+        return 1.0
+    return 0.5 ** (age / half_life)
+
+
+def compile_action(action: str, amount=0, ranks=None, rank_type: str = 'Points',
+                   now: Optional[float] = None) -> Tuple[str, List[Any]]:
+    """(SET clause, parameters) of an action, with rank assignment in the same statement
+
+    Ranks are assigned the same way as CurrencyManager.check_rank_promotion:
+    the highest rank whose requirement is met, otherwise the rank is kept.
+    """
+    action = (action or '').lower()
+    if action not in ACTIONS:
+        raise FilterError(f"Unknown action {action!r}, expected one of: {', '.join(ACTIONS)}")
+
+    now = now or time.time()
+    if action == 'add':
+        points, params = "MAX(ROUND(COALESCE(points, 0) + ?, 2), 0)", [float(amount)]
+    elif action == 'set':
+        points, params = "MAX(ROUND(?, 2), 0)", [float(amount)]
+    elif action == 'multiply':
+        points, params = "MAX(ROUND(COALESCE(points, 0) * ?, 2), 0)", [float(amount)]
+    elif action == 'reset':
+        points, params = "0", []
+    else:
+        half_life = parse_duration(amount)
+        if half_life <= 0:
+            raise FilterError("Decay needs a positive half-life")
+        points = "ROUND(COALESCE(points, 0) * bulk_half_life(? - COALESCE(last_seen, ?), ?), 2)"
+        params = [now, now, half_life]
+
+    set_clause = f"points = {points}"
+    set_params = list(params)
+    if ranks:
+        # SET вычисляется по старой строке, поэтому ранг считается от нового значения очков явно
+        if rank_type == 'Points':
+            value, value_params = points, params
+        else:
+            value, value_params = FIELDS['hours'], []
+        cases = []
+        for rank in reversed(ranks):
+            cases.append(f"WHEN {value} >= ? THEN ?")
+            set_params += value_params + [rank['required'], rank['name']]
+        set_clause += f", rank = CASE {' '.join(cases)} ELSE COALESCE(rank, '') END"
+    return set_clause, set_params
+
+
+def describe(action: str, amount, expression: Optional[str]) -> str:
+    """Text stored in bulk_log"""
+    target = expression.strip() if expression and expression.strip() else "all users"
+    return f"{action} {amount} where {target}" if action != 'reset' else f"reset where {target}"
+
+
+def apply(store, action: str, amount=0, expression: Optional[str] = None, ranks=None,
+          rank_type: str = 'Points', dry_run: bool = False) -> dict:
+    """Run a bulk action on a UserStore
+
+    Args:
+        store: UserStore to change
+        action: add, set, multiply, reset or decay
+        amount: Points, factor or half-life, depending on the action
+        expression: Filter expression, empty for all users
+        ranks: Ranks to reassign after the change (CurrencyManager.ranks)
+        rank_type: 'Points' or 'Hours', like the currency setting
+        dry_run: Only count the matching users
+
+    Returns:
+        dict: matched users, their total points before the change, dry_run flag
+    """
+    now = time.time()
+    where, params = compile_filter(expression, now)
+    set_clause, set_params = compile_action(action, amount, ranks, rank_type, now)
+    preview = store.count_where(where, params)
+    if dry_run or not preview['matched']:
+        preview['dry_run'] = dry_run
+        return preview
+    store.register_function('bulk_half_life', 2, _half_life_factor)
+    started = time.perf_counter()
+    preview['matched'] = store.update_where(where, params, set_clause, set_params,
+                                            describe(action, amount, expression))
+    preview['dry_run'] = False
+    print(f"[BULK] {describe(action, amount, expression)}: {preview['matched']} users "
+          f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return preview
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk currency operations on a users index")
+    parser.add_argument("filter", help="Filter expression, '' for all users")
+    parser.add_argument("action", choices=ACTIONS)
+    parser.add_argument("amount", nargs="?", default="0", help="Points, factor or half-life (e.g. 90d)")
+    parser.add_argument("--data-dir", default=".", help="Directory with users_currency.db")
+    parser.add_argument("--dry-run", action="store_true", help="Only count matching users")
+    args = parser.parse_args(argv)
+
+    from currency_manager import CurrencyManager
+
+    manager = CurrencyManager(data_dir=args.data_dir)
+    try:
+        amount = args.amount if args.action == 'decay' else float(args.amount)
+        result = manager.bulk_apply(args.action, amount, args.filter, dry_run=args.dry_run)
+    except ValueError as e:
+        print(f"[BULK] {e}")
+        return 2
+    finally:
+        manager.save_users()
+        manager._store.close()
+    prefix = "would change" if result['dry_run'] else "changed"
+    print(f"[BULK] {prefix} {result['matched']} users ({result['total_points']:.2f} points before)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Per-channel state of the bot.
+
+A TwitchBot can serve several channels over one IRC connection. Everything
+that belongs to a single channel - its commands, cooldowns, currency,
+Helix ids, viewers, presence sessions, active chatters and throughput counters - lives in a
+ChannelContext.
+The context of the channel being handled is kept in a ContextVar, so
+concurrent message tasks for different channels never see each other's state.
+"""
+
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+
+from activity_tracker import ActivityTracker
+from presence_tracker import PresenceTracker
+
+# Контекст канала, который обрабатывается в текущей asyncio-задаче
+current_channel: ContextVar = ContextVar('current_channel', default=None)
+
+STATS_WINDOW = 60  # Окно для "за последнюю минуту", секунд
+
+
+class ChannelStats:
+    """Throughput counters of one channel"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.messages = 0
+        self.commands = 0
+        self.sent = 0
+        self.errors = 0
+        self._recent_messages = deque()
+        self._recent_commands = deque()
+
+    def _trim(self, recent: deque, now: float):
+        while recent and now - recent[0] > STATS_WINDOW:
+            recent.popleft()
+
+    def record_message(self):
+        now = time.time()
+        self.messages += 1
+        self._recent_messages.append(now)
+        self._trim(self._recent_messages, now)
+
+    def record_command(self):
+        now = time.time()
+        self.commands += 1
+        self._recent_commands.append(now)
+        self._trim(self._recent_commands, now)
+
+    def record_sent(self):
+        self.sent += 1
+
+    def record_error(self):
+        self.errors += 1
+
+    def snapshot(self) -> dict:
+        """Counters and rates as a plain dict"""
+        now = time.time()
+        self._trim(self._recent_messages, now)
+        self._trim(self._recent_commands, now)
+        uptime = max(now - self.started, 1e-9)
+        return {
+            'uptime': uptime,
+            'messages': self.messages,
+            'commands': self.commands,
+            'sent': self.sent,
+            'errors': self.errors,
+            'messages_per_minute': len(self._recent_messages),
+            'commands_per_minute': len(self._recent_commands),
+            'avg_messages_per_minute': self.messages * 60 / uptime,
+        }
+
+
+class ChannelContext:
+    """Commands, cooldowns and currency of one channel"""
+
+    def __init__(self, name: str, commands=None, currency_manager=None,
+                 broadcaster_id: Optional[str] = None):
+        """
+        Args:
+            name (str): Channel login
+            commands (list): Custom commands in the commands.json format
+            currency_manager: CurrencyManager of this channel's currency namespace
+            broadcaster_id (str): Helix user id, resolved later if None
+        """
+        self.name = name.lower()
+        self.commands = commands or []
+        self.currency_manager = currency_manager
+        self.broadcaster_id = broadcaster_id
+        self.moderator_id = broadcaster_id
+        self.global_cooldowns = {}  # {нормализованная_команда: время_последнего_использования}
+        self.user_cooldowns = {}    # {нормализованная_команда: {пользователь: время}}
+        self.command_index = None   # CommandIndex, строится при первом сообщении после изменения команд
+        self.command_index_key = None
+        self.commands_version = 0
+        self.last_suggestion = 0.0
+        self.presence = PresenceTracker()
+        self.is_live = False
+        self.activity = ActivityTracker()
+        self.activity.record(self.name)  # Владелец канала активен с самого начала
+        self.all_viewers = []
+        self.stats = ChannelStats()
+
+    @property
+    def is_live(self) -> bool:
+        return self._is_live
+
+    @is_live.setter
+    def is_live(self, value):
+        # Трекер присутствия считает секунды эфира и оффлайна по разным ставкам
+        self._is_live = bool(value)
+        self.presence.set_live(self._is_live)
+
+    @property
+    def active_users(self) -> set:
+        """Chatters whose last message is inside the activity window"""
+        return self.activity.active()
+
+    @active_users.setter
+    def active_users(self, users):
+        # Явно заданные пользователи считаются написавшими сейчас
+        for username in users:
+            self.activity.record(username)
+
+    def update_viewers(self, viewers):
+        """New chatters list: becomes all_viewers and opens/closes presence sessions"""
+        self.all_viewers = viewers
+        self.presence.sync(viewers)
+
+    def __repr__(self):
+        return f"ChannelContext({self.name})"
@@ -0,0 +1,355 @@
+"""
+Compact columnar snapshot of currency users (users_currency.snap).
+
+Instead of repeating key names for every user like users_currency.json, the
+snapshot stores one column per field:
+
+    header      magic, version, user count and the offset of every section
+    names       sorted UTF-8 usernames (offsets + blob), binary-searchable
+    points      float64[count]
+    hours       float64[count]
+    last_seen   float64[count]
+    flags       uint16[count]  is_regular/is_mod/is_subscriber + presence bits
+    ranks       uint32[count]  index into a small rank string table
+    extra       JSON of any other fields (offsets + blob, mostly empty)
+
+The file is memory-mapped and the columns are memoryviews over the mapping,
+so opening it does not parse or copy the data. Records are built only for
+the users that are actually looked up or iterated.
+
+Usage:
+    python columnar_snapshot.py from-json users_currency.json users_currency.snap
+    python columnar_snapshot.py to-json users_currency.snap users_currency.json
+    python columnar_snapshot.py from-db users_currency.db users_currency.snap
+    python columnar_snapshot.py info users_currency.snap
+"""
+
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Dict, Any, Iterable, Iterator, Optional, Tuple
+
+MAGIC = b"CEUSNAP1"
+VERSION = 1
+
+# magic, version, count, затем конец каждой секции (начало - следующая граница 8 байт)
+_HEADER = struct.Struct("<8sII" + "Q" * 11)
+_SECTIONS = ("name_offsets", "names", "points", "hours", "last_seen", "flags",
+             "ranks", "rank_offsets", "rank_names", "extra_offsets", "extra")
+
+# Биты uint16 флагов
+_FLAG_BITS = {'is_regular': 0, 'is_mod': 1, 'is_subscriber': 2}
+_FLAG_PRESENT = 3            # +0..2: флаг есть в записи
+_HAS_POINTS = 1 << 6
+_HAS_HOURS = 1 << 7
+_HAS_LAST_SEEN = 1 << 8
+_NUMERIC = (('points', _HAS_POINTS), ('hours', _HAS_HOURS), ('last_seen', _HAS_LAST_SEEN))
+_NO_RANK = 0xFFFFFFFF
+
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _le(values: array) -> bytes:
+    """Array bytes in little-endian order"""
+    if not _LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _pad(f, alignment: int = 8):
+    position = f.tell()
+    if position % alignment:
+        f.write(b"\0" * (alignment - position % alignment))
+
+
+def write_snapshot(path, users: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+    """Write users into a columnar snapshot
+
+    Args:
+        path: Output .snap file
+        users: (username, record) pairs in any order
+
+    Returns:
+        int: Number of users written
+    """
+    encoded = sorted(((username.encode('utf-8'), record) for username, record in users), key=lambda item: item[0])
+
+    name_offsets = array('I', [0])
+    names = bytearray()
+    points, hours, last_seen = array('d'), array('d'), array('d')
+    flags, ranks = array('H'), array('I')
+    rank_ids: Dict[str, int] = {}
+    extra_offsets = array('I', [0])
+    extra = bytearray()
+
+    for name, record in encoded:
+        names += name
+        name_offsets.append(len(names))
+
+        bits = 0
+        leftovers = {}
+        for field, has_bit in _NUMERIC:
+            value = record.get(field)
+            column = {'points': points, 'hours': hours, 'last_seen': last_seen}[field]
+            if _is_number(value):
+                column.append(float(value))
+                bits |= has_bit
+            else:
+                column.append(0.0)
+                if field in record:
+                    leftovers[field] = value  # нечисловое значение сохраняем как есть
+        for field, bit in _FLAG_BITS.items():
+            value = record.get(field)
+            if isinstance(value, bool):
+                bits |= (1 << (_FLAG_PRESENT + bit)) | (int(value) << bit)
+            elif field in record:
+                leftovers[field] = value
+        flags.append(bits)
+
+        rank = record.get('rank')
+        if isinstance(rank, str):
+            ranks.append(rank_ids.setdefault(rank, len(rank_ids)))
+        else:
+            ranks.append(_NO_RANK)
+            if 'rank' in record:
+                leftovers['rank'] = rank
+
+        for key, value in record.items():
+            if key not in ('points', 'hours', 'last_seen', 'rank') and key not in _FLAG_BITS:
+                leftovers[key] = value
+        if leftovers:
+            extra += json.dumps(leftovers, ensure_ascii=False).encode('utf-8')
+        extra_offsets.append(len(extra))
+
+    rank_offsets = array('I', [0])
+    rank_names = bytearray()
+    for rank in sorted(rank_ids, key=rank_ids.get):
+        rank_names += rank.encode('utf-8')
+        rank_offsets.append(len(rank_names))
+
+    sections = {
+        "name_offsets": _le(name_offsets), "names": bytes(names),
+        "points": _le(points), "hours": _le(hours), "last_seen": _le(last_seen),
+        "flags": _le(flags), "ranks": _le(ranks),
+        "rank_offsets": _le(rank_offsets), "rank_names": bytes(rank_names),
+        "extra_offsets": _le(extra_offsets), "extra": bytes(extra)
+    }
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(b"\0" * _HEADER.size)
+        ends = []
+        for section in _SECTIONS:
+            _pad(f)
+            f.write(sections[section])
+            ends.append(f.tell())
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, VERSION, len(encoded), *ends))
+    os.replace(tmp_path, path)
+    return len(encoded)
+
+
+class ColumnarSnapshot:
+    """Read-only, memory-mapped view of a users_currency.snap file"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._file = open(self.path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        view = memoryview(self._map) if self._map is not None else memoryview(b"")
+        if len(view) < _HEADER.size:
+            self.close()
+            raise ValueError(f"{self.path} is not a user snapshot")
+
+        header = _HEADER.unpack_from(view)
+        if header[0] != MAGIC or header[1] != VERSION:
+            self.close()
+            raise ValueError(f"{self.path} is not a version {VERSION} user snapshot")
+        self.count = header[2]
+        ends = header[3:]
+        starts = [_HEADER.size] + list(ends[:-1])
+
+        def section(index, typecode=None):
+            start = starts[index]
+            start += -start % 8  # выравнивание, как при записи
+            raw = view[start:ends[index]]
+            if typecode is None:
+                return raw
+            if _LITTLE_ENDIAN:
+                return raw.cast(typecode)
+            values = array(typecode, raw.tobytes())
+            values.byteswap()
+            return values
+
+        self._name_offsets = section(0, 'I')
+        self._names = section(1)
+        self.points = section(2, 'd')
+        self.hours = section(3, 'd')
+        self.last_seen = section(4, 'd')
+        self.flags = section(5, 'H')
+        self._ranks = section(6, 'I')
+        rank_offsets = section(7, 'I')
+        rank_blob = section(8)
+        self.rank_names = [bytes(rank_blob[rank_offsets[i]:rank_offsets[i + 1]]).decode('utf-8')
+                           for i in range(len(rank_offsets) - 1)]
+        self._extra_offsets = section(9, 'I')
+        self._extra = section(10)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _name_bytes(self, index: int) -> bytes:
+        return bytes(self._names[self._name_offsets[index]:self._name_offsets[index + 1]])
+
+    def username(self, index: int) -> str:
+        return self._name_bytes(index).decode('utf-8')
+
+    def index_of(self, username: str) -> int:
+        """Position of a user (binary search over the sorted names), -1 if absent"""
+        key = username.encode('utf-8')
+        names = _NameList(self)
+        index = bisect_left(names, key)
+        if index < self.count and names[index] == key:
+            return index
+        return -1
+
+    def record(self, index: int) -> Dict[str, Any]:
+        """Build the user record at a position, same shape as in users_currency.json"""
+        bits = self.flags[index]
+        record = {}
+        for field, has_bit in _NUMERIC:
+            if bits & has_bit:
+                value = (self.points if field == 'points' else
+                         self.hours if field == 'hours' else self.last_seen)[index]
+                if field != 'last_seen' and value.is_integer():
+                    value = int(value)
+                record[field] = value
+        rank = self._ranks[index]
+        if rank != _NO_RANK:
+            record['rank'] = self.rank_names[rank]
+        for field, bit in _FLAG_BITS.items():
+            if bits & (1 << (_FLAG_PRESENT + bit)):
+                record[field] = bool(bits & (1 << bit))
+        start, end = self._extra_offsets[index], self._extra_offsets[index + 1]
+        if end > start:
+            record.update(json.loads(bytes(self._extra[start:end]).decode('utf-8')))
+        return record
+
+    def get(self, username: str, default=None) -> Optional[Dict[str, Any]]:
+        index = self.index_of(username)
+        return self.record(index) if index >= 0 else default
+
+    def __contains__(self, username) -> bool:
+        return self.index_of(username) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self.count):
+            yield self.username(index)
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for index in range(self.count):
+            yield self.username(index), self.record(index)
+
+    def close(self):
+        # memoryview над mmap нужно освободить до закрытия отображения
+        for name in ('_name_offsets', '_names', 'points', 'hours', 'last_seen', 'flags',
+                     '_ranks', '_extra_offsets', '_extra'):
+            value = self.__dict__.pop(name, None)
+            if isinstance(value, memoryview):
+                value.release()
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _NameList:
+    """Sequence of encoded usernames for bisect, without decoding them all"""
+
+    def __init__(self, snapshot: ColumnarSnapshot):
+        self._snapshot = snapshot
+
+    def __len__(self):
+        return self._snapshot.count
+
+    def __getitem__(self, index: int) -> bytes:
+        return self._snapshot._name_bytes(index)
+
+
+# === JSON compatibility ===
+
+def snapshot_from_json(json_path, snapshot_path) -> int:
+    """Convert users_currency.json into a columnar snapshot"""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        users = json.load(f)
+    if not isinstance(users, dict):
+        raise ValueError("Currency data is not a valid dictionary")
+    return write_snapshot(snapshot_path, ((name, record) for name, record in users.items()
+                                          if isinstance(record, dict)))
+
+
+def snapshot_to_json(snapshot_path, json_path) -> int:
+    """Write a columnar snapshot back in the users_currency.json layout, one record at a time"""
+    tmp_path = f"{json_path}.tmp"
+    count = 0
+    with ColumnarSnapshot(snapshot_path) as snapshot, open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write("{")
+        for username, record in snapshot.items():
+            body = json.dumps(record, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+            f.write(("," if count else "") + "\n    " + json.dumps(username, ensure_ascii=False) + ": " + body)
+            count += 1
+        f.write("\n}" if count else "}")
+    os.replace(tmp_path, json_path)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert currency users between JSON and the columnar snapshot format")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, source, target in (("from-json", "json", "snapshot"), ("to-json", "snapshot", "json"),
+                                 ("from-db", "db", "snapshot")):
+        command = commands.add_parser(name)
+        command.add_argument(source)
+        command.add_argument(target)
+    commands.add_parser("info").add_argument("snapshot")
+    args = parser.parse_args(argv)
+
+    if args.command == "from-json":
+        count = snapshot_from_json(args.json, args.snapshot)
+    elif args.command == "to-json":
+        count = snapshot_to_json(args.snapshot, args.json)
+    elif args.command == "from-db":
+        from user_store import UserStore
+        store = UserStore(args.db)
+        with store.snapshot() as users:
+            count = write_snapshot(args.snapshot, users.items())
+        store.close()
+    else:
+        with ColumnarSnapshot(args.snapshot) as snapshot:
+            print(f"{args.snapshot}: {len(snapshot)} users, {len(snapshot.rank_names)} ranks, "
+                  f"{os.path.getsize(args.snapshot)} bytes")
+        return 0
+    print(f"Converted {count} users")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Diffs between two versions of the command list.
+
+Commands are matched by their "Command" name (duplicates get a #n suffix).
+A diff records added and removed commands, changed fields of existing ones
+and the new order when it changed, so it can be replayed with apply_diff.
+"""
+
+from typing import Dict, Any, List, Optional
+
+
+def command_keys(commands: List[Dict[str, Any]]) -> List[str]:
+    """Stable key for every command in the list"""
+    keys = []
+    seen = {}
+    for cmd in commands:
+        name = str(cmd.get("Command", ""))
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        keys.append(name if count == 0 else f"{name}#{count}")
+    return keys
+
+
+def diff_commands(old: List[Dict[str, Any]], new: List[Dict[str, Any]],
+                  include_old: bool = False) -> Dict[str, Any]:
+    """Describe how to turn the old command list into the new one
+
+    Args:
+        old: Previous command list
+        new: Current command list
+        include_old: Also keep previous values of changed fields (for display)
+    """
+    old_keys = command_keys(old)
+    new_keys = command_keys(new)
+    old_map = dict(zip(old_keys, old))
+    new_map = dict(zip(new_keys, new))
+
+    added = {key: new_map[key] for key in new_keys if key not in old_map}
+    removed = [key for key in old_keys if key not in new_map]
+
+    changed = {}
+    for key in new_keys:
+        if key not in old_map:
+            continue
+        old_cmd, new_cmd = old_map[key], new_map[key]
+        if old_cmd == new_cmd:
+            continue
+        field_set = {field: value for field, value in new_cmd.items()
+                     if field not in old_cmd or old_cmd[field] != value}
+        field_unset = [field for field in old_cmd if field not in new_cmd]
+        change = {}
+        if field_set:
+            change["set"] = field_set
+        if field_unset:
+            change["unset"] = field_unset
+        if include_old:
+            change["old"] = {field: old_cmd.get(field) for field in list(field_set) + field_unset}
+        changed[key] = change
+
+    diff = {}
+    if added:
+        diff["added"] = added
+    if removed:
+        diff["removed"] = removed
+    if changed:
+        diff["changed"] = changed
+    # Порядок сохраняем только если он не получается из старого порядка + добавленных в конец
+    expected_order = [key for key in old_keys if key in new_map] + [key for key in new_keys if key not in old_map]
+    if expected_order != new_keys:
+        diff["order"] = new_keys
+    return diff
+
+
+def apply_diff(commands: List[Dict[str, Any]], diff: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Replay a diff produced by diff_commands on top of a command list"""
+    keys = command_keys(commands)
+    current = {key: dict(cmd) for key, cmd in zip(keys, commands)}
+
+    for key in diff.get("removed", []):
+        current.pop(key, None)
+
+    for key, change in diff.get("changed", {}).items():
+        cmd = current.get(key)
+        if cmd is None:
+            continue
+        for field in change.get("unset", []):
+            cmd.pop(field, None)
+        cmd.update(change.get("set", {}))
+
+    for key, cmd in diff.get("added", {}).items():
+        current[key] = dict(cmd)
+
+    order = diff.get("order")
+    if order is None:
+        order = [key for key in keys if key in current] + list(diff.get("added", {}).keys())
+    return [current[key] for key in order if key in current]
+
+
+def summarize_diff(diff: Dict[str, Any]) -> str:
+    """Short summary like '+1 -0 ~2'"""
+    return (f"+{len(diff.get('added', {}))} "
+            f"-{len(diff.get('removed', []))} "
+            f"~{len(diff.get('changed', {}))}")
+
+
+def format_diff(diff: Dict[str, Any], max_value_length: Optional[int] = 80) -> List[str]:
+    """Human-readable lines for the diff viewer"""
+    def short(value):
+        text = repr(value)
+        if max_value_length and len(text) > max_value_length:
+            text = text[:max_value_length - 3] + "..."
+        return text
+
+    lines = []
+    for key in diff.get("added", {}):
+        lines.append(f"+ {key}")
+    for key in diff.get("removed", []):
+        lines.append(f"- {key}")
+    for key, change in diff.get("changed", {}).items():
+        lines.append(f"~ {key}")
+        old_values = change.get("old", {})
+        for field, value in change.get("set", {}).items():
+            if field in old_values:
+                lines.append(f"    {field}: {short(old_values[field])} -> {short(value)}")
+            else:
+                lines.append(f"    {field}: {short(value)}")
+        for field in change.get("unset", []):
+            lines.append(f"    {field}: (removed)")
+    if "order" in diff:
+        lines.append("* command order changed")
+    if not lines:
+        lines.append("No differences")
+    return lines
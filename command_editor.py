@@ -1,3 +1,4 @@
+from startup_timer import startup_timer
 import json
 import os
 import configparser
@@ -7,25 +8,23 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                            QHBoxLayout, QPushButton, QTableWidget, QTableWidgetItem,
                            QLabel, QLineEdit, QSpinBox, QComboBox, QCheckBox,
                            QFileDialog, QMessageBox, QSlider, QGroupBox, QTabWidget,
-                           QDialog, QHeaderView, QMenu, QScrollArea, QTextEdit)
-from PyQt5.QtCore import Qt, QTimer, QDateTime
+                           QDialog, QHeaderView, QMenu, QScrollArea, QTextEdit, QCompleter)
+from PyQt5.QtCore import Qt, QTimer, QDateTime, QThread, pyqtSignal, QStringListModel
 import PyQt5.QtCore as QtCore
 from PyQt5.QtGui import QPixmap, QFont, QTextCursor  # Add QTextCursor here
-import pygame
-from twitch_bot import TwitchBot
-from twitch_auth import TwitchAuthDialog
-from twitch_tab import TwitchTab
 from config_manager import ConfigManager
-from about_tab import AboutTab
 from history_manager import HistoryManager
+from command_keys import normalize_command_key
+from command_trie import CommandTrie
 from pathlib import Path
 import threading
 import time
-from currency_tab import CurrencyTab
-from user_currency_tab import UserCurrencyTab
-from ranks_tab import RanksTab
-from sys_commands_tab import SysCommandsTab  # Import the new system commands tab
 from currency_manager import CurrencyManager
+from backup_writer import ComprehensiveBackupWriter, scan_backups, load_backup, load_metadata, meta_path, backup_stem
+from backup_catalog import BackupCatalog, KIND_COMPREHENSIVE
+from retention_policy import RetentionPolicy, RETENTION_TOOLTIP
+# pygame, twitch_bot (twitchio/aiohttp/requests) и модули вкладок импортируются
+# лениво - при первом открытии вкладки или первом звуке, чтобы окно появлялось быстрее
 from PyQt5 import sip  # правильный импорт
 from PyQt5.QtCore import QMetaType
 import webbrowser
@@ -33,6 +32,8 @@ import webbrowser
 # Вместо sip.registerMetaType используем:
 QMetaType.type("QTextCursor")
 
+startup_timer.mark("imports")
+
 class UpdateNotificationWidget(QLabel):
     """A notification widget that appears in the top-right corner when an update is available"""
     
@@ -115,19 +116,37 @@ class UpdateNotificationWidget(QLabel):
         self.setToolTip(f"New version {self.new_version} is available!\nClick to open download page")
         super().enterEvent(event)
 
+class ComprehensiveBackupThread(QThread):
+    """Thread that writes a comprehensive backup without blocking the UI"""
+    progress = pyqtSignal(int, int)  # users_written, users_total
+    backup_finished = pyqtSignal(str)  # backup path, empty on failure
+
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+        self.writer.progress_callback = self.progress.emit
+
+    def run(self):
+        try:
+            self.backup_finished.emit(str(self.writer.write()))
+        except Exception as e:
+            print(f"Error creating comprehensive backup: {e}")
+            self.backup_finished.emit("")
+
+
 class CommandEditor(QMainWindow):
     def __init__(self):
-        # ⚠️ ПЕРЕД pygame.init() делаем pre_init с небольшим буфером
-        pygame.mixer.pre_init(frequency=44100, size=-16, channels=2, buffer=256)
-        pygame.init()
-        pygame.mixer.init()
-
         super().__init__()
         self.setWindowTitle("Command Editor")
         self.setGeometry(100, 100, 1200, 800)
+
+        # pygame инициализируется при первом воспроизведении звука (см. ensure_audio)
+        self.audio_ready = False
+        self.sound_channel = None
         
-        # Initialize config manager
-        self.config_manager = ConfigManager()
+        # Initialize config manager (один экземпляр на весь процесс)
+        self.config_manager = ConfigManager.instance()
+        startup_timer.mark("config")
         
         # Load settings BEFORE creating widgets
         self.allow_sound_interruption = self.config_manager.get_sound_interruption()
@@ -165,6 +184,11 @@ class CommandEditor(QMainWindow):
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Type to search commands...")
         self.search_input.textChanged.connect(self.filter_commands)
+        # Подсказки имен команд по префиксу из дерева команд
+        self.search_model = QStringListModel()
+        search_completer = QCompleter(self.search_model, self.search_input)
+        search_completer.setCaseSensitivity(Qt.CaseInsensitive)
+        self.search_input.setCompleter(search_completer)
         search_layout.addWidget(search_label)
         search_layout.addWidget(self.search_input)
         main_layout.addLayout(search_layout)
@@ -407,44 +431,36 @@ class CommandEditor(QMainWindow):
         main_tab.setLayout(main_layout)
         
         # Initialize history manager BEFORE creating history tab
-        self.history_manager = HistoryManager(max_backups=self.config_manager.get_max_backups())
+        self.history_manager = HistoryManager(max_backups=self.config_manager.get_max_backups(),
+                                              retention=self.config_manager.get_retention_settings(),
+                                              base_dir=str(self.config_manager.program_dir))
+        startup_timer.mark("commands tab")
         
         # Add tabs to tab widget
         self.tab_widget.addTab(main_tab, "Commands")
 
-        # Add system commands tab right after Commands
-        self.sys_commands_tab = SysCommandsTab(parent=self)
-        self.tab_widget.addTab(self.sys_commands_tab, "Sys.Commands")
-
-        self.twitch_tab = TwitchTab(parent=self, commands_data=self.commands)
-        self.tab_widget.addTab(self.twitch_tab, "Twitch")
-
-
         # Add tabs for currency management
         self.currency_manager = CurrencyManager()
         if hasattr(self.currency_manager, 'load_settings'):
             self.currency_manager.load_settings() # Загружаем настройки при запуске
             print("Currency settings loaded in CommandEditor")
-
-        self.currency_tab = CurrencyTab(parent=self)
-        self.tab_widget.addTab(self.currency_tab, "Currency Settings")
-        self.user_currency_tab = UserCurrencyTab(parent=self)
-        self.tab_widget.addTab(self.user_currency_tab, "Currency Users")
-        self.ranks_tab = RanksTab(parent=self)
-        self.tab_widget.addTab(self.ranks_tab, "Ranks")
-        self.ranks_tab.load_ranks()
-
-        self.about_tab = AboutTab(parent=self)
-        self.tab_widget.addTab(self.about_tab, "About")
-        self.history_tab = self.create_history_tab()
-        self.tab_widget.addTab(self.history_tab, "History")
-
-        # Create comprehensive backup tab
-        self.backup_tab = self.create_comprehensive_backup_tab()
-        self.tab_widget.addTab(self.backup_tab, "Backups")
+        startup_timer.mark("currency manager")
+
+        # Остальные вкладки создаются при первом открытии
+        self._lazy_tabs = {}
+        self._add_lazy_tab("Sys.Commands", 'sys_commands_tab', self._create_sys_commands_tab)
+        self._add_lazy_tab("Twitch", 'twitch_tab', self._create_twitch_tab)
+        self._add_lazy_tab("Currency Settings", 'currency_tab', self._create_currency_tab)
+        self._add_lazy_tab("Currency Users", 'user_currency_tab', self._create_user_currency_tab)
+        self._add_lazy_tab("Ranks", 'ranks_tab', self._create_ranks_tab)
+        self._add_lazy_tab("About", 'about_tab', self._create_about_tab)
+        self._add_lazy_tab("History", 'history_tab', self.create_history_tab)
+        self._add_lazy_tab("Backups", 'backup_tab', self.create_comprehensive_backup_tab)
+        self.tab_widget.currentChanged.connect(self._on_tab_changed)
         
         # Load saved commands and configuration
         self.load_saved_data()
+        startup_timer.mark("saved data")
         
         # Set sound interruption setting from config
         self.allow_interruption_check.setChecked(self.allow_sound_interruption)
@@ -462,6 +478,11 @@ class CommandEditor(QMainWindow):
         # Set up system auto-backup timer
         self.system_auto_backup_timer = QTimer()
         self.system_auto_backup_timer.timeout.connect(self.create_comprehensive_backup_auto)
+        self.system_backup_thread = None
+        # Бэкапы и их каталог - в каталоге программы, как у ConfigManager и CurrencyManager
+        self.system_backup_dir = self.config_manager.backup_dir / "comprehensive"
+        self.backup_catalog = BackupCatalog.open(self.config_manager.backup_dir / "backup_catalog.db")
+        self.backup_catalog.ensure_indexed(KIND_COMPREHENSIVE, lambda: scan_backups(self.system_backup_dir))
 
         # Set up currency auto-save timer
         self.currency_auto_backup_timer = QTimer()
@@ -509,26 +530,98 @@ class CommandEditor(QMainWindow):
             }
             """)        # Словарь загруженных звуков
         self.loaded_sounds = {}
-        # Один канал для всех воспроизведений
-        self.sound_channel = pygame.mixer.Channel(0)
         
         # Create update notification widget
         self.update_notification = UpdateNotificationWidget(self)
           # Auto-check for updates on startup (silent check)
         self.auto_check_updates()
+        startup_timer.mark("window setup")
+
+    def _add_lazy_tab(self, title, attr_name, factory):
+        """Add a tab whose content is created by factory on first activation"""
+        container = QWidget()
+        container_layout = QVBoxLayout(container)
+        container_layout.setContentsMargins(0, 0, 0, 0)
+        self.tab_widget.addTab(container, title)
+        self._lazy_tabs[container] = (attr_name, factory)
+
+    def _on_tab_changed(self, index):
+        """Build a lazy tab when it is opened for the first time"""
+        container = self.tab_widget.widget(index)
+        if container in self._lazy_tabs:
+            self._build_lazy_tab(container)
+
+    def _build_lazy_tab(self, container):
+        attr_name, factory = self._lazy_tabs.pop(container)
+        started = time.perf_counter()
+        widget = factory()
+        container.layout().addWidget(widget)
+        setattr(self, attr_name, widget)
+        print(f"[STARTUP] Tab '{attr_name}' built in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return widget
+
+    def _create_sys_commands_tab(self):
+        from sys_commands_tab import SysCommandsTab
+        return SysCommandsTab(parent=self)
+
+    def _create_twitch_tab(self):
+        from twitch_tab import TwitchTab
+        return TwitchTab(parent=self, commands_data=self.commands)
+
+    def _create_currency_tab(self):
+        from currency_tab import CurrencyTab
+        return CurrencyTab(parent=self)
+
+    def _create_user_currency_tab(self):
+        from user_currency_tab import UserCurrencyTab
+        return UserCurrencyTab(parent=self)
+
+    def _create_ranks_tab(self):
+        from ranks_tab import RanksTab
+        ranks_tab = RanksTab(parent=self)
+        ranks_tab.load_ranks()
+        return ranks_tab
+
+    def _create_about_tab(self):
+        from about_tab import AboutTab
+        about_tab = AboutTab(parent=self)
+        about_tab.update_checker.set_notification_widget(self.update_notification)
+        return about_tab
+
+    def ensure_audio(self):
+        """Initialize pygame mixer on first use"""
+        if self.audio_ready:
+            return True
+        try:
+            import pygame
+            # ⚠️ ПЕРЕД pygame.init() делаем pre_init с небольшим буфером
+            pygame.mixer.pre_init(frequency=44100, size=-16, channels=2, buffer=256)
+            pygame.init()
+            pygame.mixer.init()
+            # Один канал для всех воспроизведений
+            self.sound_channel = pygame.mixer.Channel(0)
+            self.audio_ready = True
+        except Exception as e:
+            print(f"Error initializing audio: {e}")
+        return self.audio_ready
             
     def auto_check_updates(self):
         """Automatically check for updates on startup"""
+        # Проверка запускается с задержкой, about_tab (и requests) грузятся уже после показа окна
+        QTimer.singleShot(3000, self._start_update_check)
+
+    def _start_update_check(self):
         try:
-            if hasattr(self, 'about_tab') and self.about_tab.update_checker:
-                # Set the notification widget
-                self.about_tab.update_checker.set_notification_widget(self.update_notification)
-                # Start silent update check after a short delay
-                QTimer.singleShot(3000, lambda: self.about_tab.update_checker.check_for_updates(silent=True))
+            from about_tab import UpdateChecker
+            self.update_checker = UpdateChecker(parent=self)
+            # Set the notification widget
+            self.update_checker.set_notification_widget(self.update_notification)
+            self.update_checker.check_for_updates(silent=True)
         except Exception as e:
             print(f"Error during auto update check: {e}")
             
     def show_auth_dialog(self):
+        from twitch_auth import TwitchAuthDialog
         dialog = TwitchAuthDialog(self)
         if dialog.exec_() == QDialog.Accepted:
             QMessageBox.information(self, "Success", "Twitch credentials saved successfully!")
@@ -862,6 +955,10 @@ class CommandEditor(QMainWindow):
             QMessageBox.warning(self, "Warning", f"Sound file not found: {fn}")
             return
 
+        if not self.ensure_audio():
+            QMessageBox.warning(self, "Warning", "Audio device is not available.")
+            return
+
         # Прерываем текущий звук через fadeout если включена опция прерывания
         if self.sound_channel.get_busy():
             if self.allow_sound_interruption:
@@ -874,6 +971,7 @@ class CommandEditor(QMainWindow):
         # Загружаем Sound один раз
         snd = self.loaded_sounds.get(fn)
         if snd is None:
+            import pygame
             snd = pygame.mixer.Sound(fn)
             self.loaded_sounds[fn] = snd
 
@@ -897,8 +995,10 @@ class CommandEditor(QMainWindow):
     def closeEvent(self, event):
         try:
             # First, stop any playing sounds
-            if pygame.mixer.get_busy():
-                pygame.mixer.stop()
+            if self.audio_ready:
+                import pygame
+                if pygame.mixer.get_busy():
+                    pygame.mixer.stop()
             
             # Disconnect any running Twitch bot
             if hasattr(self, 'twitch_tab') and self.twitch_tab.bot:
@@ -958,40 +1058,52 @@ class CommandEditor(QMainWindow):
                 print("Creating backup before closing...")
                 self.history_manager.save_backup(self.commands)
             
-            # Save volume setting
-            self.config_manager.set_volume(self.volume)
-            
-            # Save interruption settings
-            self.config_manager.set_sound_interruption(self.allow_sound_interruption)
-            self.config_manager.set_interruption_message(self.show_interruption_message)
-            
-            # Save auto-save settings
-            self.config_manager.set_auto_save(
-                self.auto_save_enabled,
-                self.auto_save_interval
-            )
+            # Все настройки записываются одним сохранением config.json
+            with self.config_manager.batch():
+                # Save volume setting
+                self.config_manager.set_volume(self.volume)
+                
+                # Save interruption settings
+                self.config_manager.set_sound_interruption(self.allow_sound_interruption)
+                self.config_manager.set_interruption_message(self.show_interruption_message)
+                
+                # Save auto-save settings
+                self.config_manager.set_auto_save(
+                    self.auto_save_enabled,
+                    self.auto_save_interval
+                )
 
-            # Save backup settings
-            if hasattr(self, 'history_manager'):
-                self.config_manager.set_max_backups(self.history_manager.max_backups)
-            
-            # Save currency settings
-            if hasattr(self, 'currency_tab'):
-                self.currency_tab.save_settings()
+                # Save backup settings
+                if hasattr(self, 'history_manager'):
+                    self.config_manager.set_max_backups(self.history_manager.max_backups)
+                
+                # Save currency settings
+                if hasattr(self, 'currency_tab'):
+                    self.currency_tab.save_settings()
 
-            # Save ranks settings
-            if hasattr(self, 'ranks_tab'):
-                self.ranks_tab.save_ranks()
+                # Save ranks settings
+                if hasattr(self, 'ranks_tab'):
+                    self.ranks_tab.save_ranks()
+
+                # Save currency auto-save settings
+                try:
+                    self.config_manager.set_currency_auto_save(
+                        self.currency_auto_save_enabled,
+                        self.currency_backup_interval
+                    )
+                except Exception as e:
+                    print(f"Error saving currency auto-save settings: {e}")
+
+            # Индекс валюты выгружается в users_currency.json при выходе
+            if hasattr(self, 'currency_manager'):
+                print("Saving currency users before closing...")
+                self.currency_manager.save_users(force=True, export=True)
+
+            # Не обрываем запись архива на середине
+            if self.system_backup_thread and self.system_backup_thread.isRunning():
+                print("Waiting for the comprehensive backup to finish...")
+                self.system_backup_thread.wait()
 
-            # Save currency auto-save settings
-            try:
-                self.config_manager.set_currency_auto_save(
-                    self.currency_auto_save_enabled,
-                    self.currency_backup_interval
-                )
-            except Exception as e:
-                print(f"Error saving currency auto-save settings: {e}")
-            
             print("Application shutdown complete.")
             event.accept()
         except Exception as e:
@@ -1121,66 +1233,6 @@ class CommandEditor(QMainWindow):
         if file_name:
             line_edit.setText(file_name)
 
-    def start_bot(self):
-        if not self.bot:
-            channel = self.channel_edit.text().strip()
-            if not channel:
-                QMessageBox.warning(self, "Error", "Please enter a channel name")
-                return
-
-            try:
-                # создаём бота
-                self.bot = TwitchBot(
-                    channel,
-                    message_callback=self.twitch_tab.add_to_chat_safe,  # Используем безопасный метод
-                    currency_manager=self.currency_manager
-                )
-                self.twitch_tab.bot = self.bot  # Передаем ссылку на бота в TwitchTab
-
-                self.bot.update_commands(self.commands)
-
-                # Используем значения, загруженные в __init__
-                initial_interruption = self.allow_sound_interruption
-                initial_show_message = self.show_interruption_message
-
-                # Используем обновленные логи для ясности
-                print(f"Setting initial interruption from CommandEditor attribute: {initial_interruption}")
-                print(f"Setting initial show message from CommandEditor attribute: {initial_show_message}")
-
-                self.bot.set_interruption(initial_interruption)
-                self.bot.set_show_interruption_message(initial_show_message)
-
-                # Регистрация команд бота
-                try:
-                    self.bot.register_commands()
-                    print("Bot commands registered successfully")
-                except Exception as e:
-                    print(f"Error registering bot commands: {e}")
-
-                # запускаем в потоке
-                self.bot_thread = threading.Thread(target=self.bot.run)
-                self.bot_thread.daemon = True
-                self.bot_thread.start()
-                
-                self.start_bot_btn.setEnabled(False)
-                self.stop_bot_btn.setEnabled(True)
-                QMessageBox.information(self, "Success", "Bot started successfully!")
-            except Exception as e:
-                QMessageBox.warning(self, "Error", f"Failed to start bot: {str(e)}")
-                if self.bot:
-                    self.bot = None
-                
-    def stop_bot(self):
-        if self.bot:
-            try:
-                self.bot.stop()
-                self.bot = None
-                self.start_bot_btn.setEnabled(True)
-                self.stop_bot_btn.setEnabled(False)
-                QMessageBox.information(self, "Success", "Bot stopped successfully!")
-            except Exception as e:
-                QMessageBox.warning(self, "Error", f"Error stopping bot: {str(e)}")
-                
     def update_commands(self):
         """Update commands in Twitch tab"""
         # No need to get commands from UI since self.commands is already updated
@@ -1241,22 +1293,13 @@ class CommandEditor(QMainWindow):
 
             # Save commands
             if self.commands:
-                # Get existing commands for comparison
-                existing_commands = []
-                try:
-                    if os.path.exists('commands.json'):
-                        with open('commands.json', 'r', encoding='utf-8') as f:
-                            existing_commands = json.load(f)
-                except Exception as e:
-                    print(f"Error reading existing commands for comparison: {e}")
-                    existing_commands = []
-
                 # Save the commands first
                 print("Saving commands...")
                 with open('commands.json', 'w', encoding='utf-8') as f:
                     json.dump(self.commands, f, indent=4, ensure_ascii=False)
 
-                # Always create backup on auto-save, don't check for significant changes
+                # History is content-addressed: an unchanged command list reuses
+                # the previous snapshot and only changed commands are written
                 print("Creating command backup during auto-save...")
                 backup_successful = self.history_manager.save_backup(self.commands)
 
@@ -1270,28 +1313,24 @@ class CommandEditor(QMainWindow):
 
                 # Create comprehensive system backup if enabled
                 if self.system_auto_backup_enabled:
-                    print("Creating comprehensive system backup during auto-save...")
-                    system_backup_path = self.create_comprehensive_backup()
-                    if system_backup_path:
-                        print(f"Auto-save comprehensive backup created: {system_backup_path}")
-                        # Clean up old comprehensive backups after successful creation
-                        self._cleanup_old_comprehensive_backups()
-                        self.refresh_comprehensive_backups()
-                    else:
-                        print("Failed to create auto-save comprehensive backup")
+                    # Пишется в фоне; очистка и обновление списка - в _on_comprehensive_backup_finished
+                    print("Starting comprehensive system backup during auto-save...")
+                    if not self.create_comprehensive_backup():
+                        print("Failed to start auto-save comprehensive backup")
 
                 # Update commands in Twitch tab if it exists
                 if hasattr(self, 'twitch_tab') and self.twitch_tab.bot:
                     self.twitch_tab.bot.update_commands(self.commands)
 
-            # Save other settings
-            self.config_manager.set_volume(self.volume)
-            self.config_manager.set_sound_interruption(self.allow_sound_interruption)
-            self.config_manager.set_interruption_message(self.show_interruption_message)
-            self.config_manager.set_auto_save(
-                self.auto_save_enabled,
-                self.auto_save_interval
-            )
+            # Save other settings (одна запись config.json и только при изменениях)
+            with self.config_manager.batch():
+                self.config_manager.set_volume(self.volume)
+                self.config_manager.set_sound_interruption(self.allow_sound_interruption)
+                self.config_manager.set_interruption_message(self.show_interruption_message)
+                self.config_manager.set_auto_save(
+                    self.auto_save_enabled,
+                    self.auto_save_interval
+                )
 
             print("Auto-save completed successfully")
 
@@ -1525,49 +1564,6 @@ class CommandEditor(QMainWindow):
         except Exception as e:
             print(f"Error saving commands: {e}")
 
-    def disconnect_bot(self):
-        if self.bot:
-            # Сохраняем статистику команд перед отключением
-            self.save_commands()
-            # ... остальной код отключения
-
-    def _has_significant_changes(self, old_commands, new_commands):
-        """Determine if changes are significant enough to warrant a backup
-        
-        Returns:
-            bool: True if significant changes detected, False otherwise
-        """
-        # If no previous commands, this is significant
-        if not old_commands:
-            return True
-            
-        # If command count changed by more than 1, it's significant
-        if abs(len(old_commands) - len(new_commands)) > 1:
-            return True
-        
-        # Check for changes in command names, sound files, or responses
-        old_map = {cmd["Command"]: cmd for cmd in old_commands}
-        new_map = {cmd["Command"]: cmd for cmd in new_commands}
-        
-        # If any commands were added or removed
-        if set(old_map.keys()) != set(new_map.keys()):
-            return True
-        
-        # Check for significant changes in existing commands
-        for cmd_name, new_cmd in new_map.items():
-            if cmd_name in old_map:
-                old_cmd = old_map[cmd_name]
-                
-                # Check if sound file changed
-                if old_cmd.get("SoundFile", "") != new_cmd.get("SoundFile", ""):
-                    return True
-                    
-                # Check if response changed
-                if old_cmd.get("Response", "") != new_cmd.get("Response", ""):
-                    return True
-        
-        return False
-
     def set_editing_enabled(self, enabled):
         """Enable or disable command editing buttons"""
         self.add_btn.setEnabled(enabled)
@@ -1702,24 +1698,32 @@ class CommandEditor(QMainWindow):
         try:
             print("Running automatic comprehensive backup...")
 
-            # Create the backup
-            backup_path = self.create_comprehensive_backup()
-
-            if backup_path:
-                print(f"Automatic comprehensive backup created: {backup_path}")
-                # Clean up old comprehensive backups after successful creation
-                self._cleanup_old_comprehensive_backups()
-                # Refresh the backup list
-                self.refresh_comprehensive_backups()
-            else:
-                print("Failed to create automatic comprehensive backup")
+            # The backup is written in the background, cleanup and list refresh
+            # happen in _on_comprehensive_backup_finished
+            if not self.create_comprehensive_backup():
+                print("Failed to start automatic comprehensive backup")
 
         except Exception as e:
             print(f"Error during automatic comprehensive backup: {e}")
 
+    def update_search_completions(self, text):
+        """Offer command names starting with the search text"""
+        names = tuple(cmd.get("Command", "") for cmd in self.commands)
+        if getattr(self, '_search_trie_names', None) != names:
+            # Дерево перестраивается только после изменения списка команд
+            trie = CommandTrie()
+            for name in names:
+                trie.insert(normalize_command_key(name.lstrip('!')), name)
+            self._search_trie, self._search_trie_names = trie, names
+        prefix = text.lstrip('!')
+        keys = self._search_trie.complete(prefix) if prefix else []
+        mark = '!' if text.startswith('!') else ''
+        self.search_model.setStringList([mark + key for key in keys])
+
     def filter_commands(self):
         """Filter displayed commands based on search text"""
         search_text = self.search_input.text().lower()
+        self.update_search_completions(search_text)
         
         # Show all commands if search is empty
         if not search_text:
@@ -1757,23 +1761,29 @@ class CommandEditor(QMainWindow):
         # Create backup button
         create_backup_btn = QPushButton("Create Backup Now")
         create_backup_btn.clicked.connect(self.create_backup)
+
+        # Compare two selected versions (or one version with the current commands)
+        compare_btn = QPushButton("Compare Selected")
+        compare_btn.clicked.connect(self.compare_backups)
         
         header_layout.addWidget(header_label)
         header_layout.addStretch()
+        header_layout.addWidget(compare_btn)
         header_layout.addWidget(create_backup_btn)
         layout.addLayout(header_layout)
         
         # Description
-        description = QLabel("The system automatically saves backups when you make significant changes. You can restore previous versions from here.")
+        description = QLabel("The system automatically saves backups when your commands change. You can restore previous versions from here.")
         description.setWordWrap(True)
         layout.addWidget(description)
         
         # Create table for backups
         self.backup_table = QTableWidget()
-        self.backup_table.setColumnCount(4)
-        self.backup_table.setHorizontalHeaderLabels(["Date & Time", "Size (KB)", "Actions", ""])
+        self.backup_table.setColumnCount(5)
+        self.backup_table.setHorizontalHeaderLabels(["Date & Time", "Size (KB)", "Changes", "Actions", ""])
         self.backup_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
         self.backup_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.backup_table.setSelectionMode(QTableWidget.ExtendedSelection)
         
         # Load backup list
         self.refresh_backup_list();
@@ -1788,6 +1798,7 @@ class CommandEditor(QMainWindow):
         max_backups_label = QLabel("Maximum number of backups:")
         self.max_backups_spin = QSpinBox()
         self.max_backups_spin.setMinimum(1)
+        self.max_backups_spin.setToolTip(RETENTION_TOOLTIP)
         self.max_backups_spin.setMaximum(100)
         self.max_backups_spin.setValue(self.history_manager.max_backups)
         self.max_backups_spin.valueChanged.connect(self.update_max_backups)
@@ -1804,6 +1815,9 @@ class CommandEditor(QMainWindow):
 
     def refresh_backup_list(self):
         """Refresh the list of backups in the table"""
+        # Вкладка History еще не открывалась - обновлять нечего
+        if not hasattr(self, 'backup_table'):
+            return
         self.backup_table.setRowCount(0)
         
         backups = self.history_manager.get_backups()
@@ -1812,10 +1826,15 @@ class CommandEditor(QMainWindow):
             self.backup_table.insertRow(i)
             
             # Date & Time
-            self.backup_table.setItem(i, 0, QTableWidgetItem(backup["readable_time"]))
+            time_item = QTableWidgetItem(backup["readable_time"])
+            time_item.setData(Qt.UserRole, backup["path"])
+            self.backup_table.setItem(i, 0, time_item)
             
             # Size
             self.backup_table.setItem(i, 1, QTableWidgetItem(f"{backup['size']} KB"))
+
+            # Changes relative to the previous version (+added -removed ~changed)
+            self.backup_table.setItem(i, 2, QTableWidgetItem(backup.get("summary", "")))
             
             # Restore button
             restore_btn = QPushButton("Restore")
@@ -1826,8 +1845,49 @@ class CommandEditor(QMainWindow):
             view_btn.clicked.connect(lambda checked, path=backup["path"]: self.view_backup(path))
             
             # Add buttons to table
-            self.backup_table.setCellWidget(i, 2, restore_btn)
-            self.backup_table.setCellWidget(i, 3, view_btn)
+            self.backup_table.setCellWidget(i, 3, restore_btn)
+            self.backup_table.setCellWidget(i, 4, view_btn)
+
+    def compare_backups(self):
+        """Show what changed between two selected versions, or a version and the current commands"""
+        rows = sorted({index.row() for index in self.backup_table.selectedIndexes()})
+        if len(rows) not in (1, 2):
+            QMessageBox.information(self, "Compare", "Select one version (to compare with the current commands) or two versions.")
+            return
+
+        try:
+            from command_diff import diff_commands, format_diff
+
+            # Строки отсортированы от новых к старым
+            older_path = self.backup_table.item(rows[-1], 0).data(Qt.UserRole)
+            older_time = self.backup_table.item(rows[-1], 0).text()
+            if len(rows) == 2:
+                newer_path = self.backup_table.item(rows[0], 0).data(Qt.UserRole)
+                newer_time = self.backup_table.item(rows[0], 0).text()
+                diff = self.history_manager.diff_backups(older_path, newer_path)
+            else:
+                newer_time = "current commands"
+                diff = diff_commands(self.history_manager.load_snapshot(older_path), self.commands, include_old=True)
+
+            dialog = QDialog(self)
+            dialog.setWindowTitle(f"Changes: {older_time} → {newer_time}")
+            dialog.setMinimumSize(700, 500)
+            dialog_layout = QVBoxLayout()
+
+            diff_view = QTextEdit()
+            diff_view.setReadOnly(True)
+            diff_view.setFont(QFont("Courier New", 10))
+            diff_view.setPlainText("\n".join(format_diff(diff, max_value_length=200)))
+            dialog_layout.addWidget(diff_view)
+
+            close_btn = QPushButton("Close")
+            close_btn.clicked.connect(dialog.close)
+            dialog_layout.addWidget(close_btn)
+
+            dialog.setLayout(dialog_layout)
+            dialog.exec_()
+        except Exception as e:
+            QMessageBox.warning(self, "Error", f"Failed to compare backups: {str(e)}")
 
     def create_backup(self):
         """Create a backup of current commands"""
@@ -1880,8 +1940,7 @@ class CommandEditor(QMainWindow):
             return
             
         try:
-            with open(backup_path, 'r', encoding='utf-8') as f:
-                commands = json.load(f)
+            commands = self.history_manager.load_snapshot(backup_path)
                 
             # Create a dialog to show the backup contents
             dialog = QDialog(self)
@@ -2020,6 +2079,7 @@ class CommandEditor(QMainWindow):
         max_backups_label = QLabel("Maximum Backups:")
         self.max_comprehensive_backups_spin = QSpinBox()
         self.max_comprehensive_backups_spin.setMinimum(1)
+        self.max_comprehensive_backups_spin.setToolTip(RETENTION_TOOLTIP)
         self.max_comprehensive_backups_spin.setMaximum(50)
         self.max_comprehensive_backups_spin.setValue(self.config_manager.get_max_comprehensive_backups())
         self.max_comprehensive_backups_spin.valueChanged.connect(self.update_max_comprehensive_backups)
@@ -2069,6 +2129,8 @@ class CommandEditor(QMainWindow):
 
     def refresh_comprehensive_backups(self):
         """Refresh the list of comprehensive backups"""
+        if not hasattr(self, 'system_backup_list_layout'):
+            return
         try:
             from PyQt5.QtWidgets import QFrame
 
@@ -2079,16 +2141,9 @@ class CommandEditor(QMainWindow):
                 if item.widget():
                     item.widget().deleteLater()
 
-            # Get backup directory
-            backup_dir = Path("backups") / "comprehensive"
-            if not backup_dir.exists():
-                self.system_backup_status_label.setText("No backups found")
-                self.system_backup_status_label.setStyleSheet("color: gray;")
-                return
-
-            # Get backup files
-            backup_files = list(backup_dir.glob("system_backup_*.json"))
-            backup_files.sort(key=lambda x: x.stat().st_mtime, reverse=True)
+            # Backups come from the catalog (newest first), no directory scan
+            backup_entries = self.backup_catalog.list(KIND_COMPREHENSIVE)
+            backup_files = [Path(entry["path"]) for entry in backup_entries]
 
             if not backup_files:
                 no_backups_label = QLabel("No comprehensive backups found.")
@@ -2103,14 +2158,9 @@ class CommandEditor(QMainWindow):
             self.system_backup_status_label.setStyleSheet("color: blue;")
 
             # Add each backup
-            for i, backup_file in enumerate(backup_files):
+            for i, (backup_file, entry) in enumerate(zip(backup_files, backup_entries)):
                 try:
-                    # Load metadata
-                    meta_file = backup_file.with_suffix('.json.meta')
-                    metadata = {}
-                    if meta_file.exists():
-                        with open(meta_file, 'r', encoding='utf-8') as f:
-                            metadata = json.load(f)
+                    metadata = entry["meta"]
 
                     # Create backup frame
                     frame = QFrame()
@@ -2120,14 +2170,14 @@ class CommandEditor(QMainWindow):
 
                     # Header with backup info
                     header_layout = QHBoxLayout()
-                    backup_name = backup_file.stem
+                    backup_name = backup_stem(backup_file)
 
                     time_label = QLabel(f"📦 {backup_name}")
                     time_label.setStyleSheet("font-weight: bold;")
                     header_layout.addWidget(time_label)
 
                     # Size info
-                    size_bytes = metadata.get('total_size', backup_file.stat().st_size)
+                    size_bytes = metadata.get('total_size', entry["size"])
                     if size_bytes < 1024:
                         size_str = f"{size_bytes} B"
                     elif size_bytes < 1024 * 1024:
@@ -2237,8 +2287,7 @@ class CommandEditor(QMainWindow):
                 return
 
             # Load backup data
-            with open(backup_file, 'r', encoding='utf-8') as f:
-                backup_data = json.load(f)
+            backup_data = load_backup(backup_file)
 
             # Restore commands
             if 'commands' in backup_data:
@@ -2248,9 +2297,17 @@ class CommandEditor(QMainWindow):
                 self.config_manager.save_commands(self.commands)
 
             # Restore currency users
+            checksum_warning = ""
             if 'currency_users' in backup_data and hasattr(self, 'currency_manager'):
                 self.currency_manager.users = backup_data['currency_users']
-                self.currency_manager.save_users()
+                self.currency_manager.save_users(force=True, export=True)
+
+                # Digest of the restored users must match the one recorded at backup time
+                entry = self.backup_catalog.get(backup_file)
+                expected = entry["meta"].get("users_checksum") if entry else None
+                if expected and expected != self.currency_manager._calculate_checksum():
+                    print(f"[COMPREHENSIVE BACKUP] Currency checksum mismatch after restore of {backup_file}")
+                    checksum_warning = "\n\nWarning: restored currency data does not match the backup checksum."
 
                 # Refresh currency tabs
                 if hasattr(self, 'user_currency_tab'):
@@ -2316,7 +2373,7 @@ class CommandEditor(QMainWindow):
                 self,
                 "Restoration Complete",
                 "System has been successfully restored from backup!\n\n"
-                "Please restart the application to ensure all changes take effect."
+                "Please restart the application to ensure all changes take effect." + checksum_warning
             )
 
         except Exception as e:
@@ -2332,9 +2389,23 @@ class CommandEditor(QMainWindow):
         try:
             from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QDialogButtonBox, QGroupBox
 
-            # Load backup data
-            with open(backup_file, 'r', encoding='utf-8') as f:
-                backup_data = json.load(f)
+            # Counts are taken from the metadata when possible, so a large
+            # compressed backup does not have to be unpacked just for this dialog
+            entry = self.backup_catalog.get(backup_file)
+            metadata = entry["meta"] if entry else load_metadata(backup_file)
+            if 'backup_info' in metadata and 'ranks_count' in metadata:
+                backup_info = metadata['backup_info']
+                commands_count = metadata.get('commands_count', 0)
+                users_count = metadata.get('users_count', 0)
+                moderators_count = metadata.get('moderators_count', 0)
+                ranks_count = metadata.get('ranks_count', 0)
+            else:
+                backup_data = load_backup(backup_file)
+                backup_info = backup_data.get('backup_info', {})
+                commands_count = len(backup_data.get('commands', []))
+                users_count = len(backup_data.get('currency_users', {}))
+                moderators_count = len(backup_data.get('moderators', {}).get('manual', []))
+                ranks_count = len(backup_data.get('ranks', []))
 
             dialog = QDialog(self)
             dialog.setWindowTitle("Comprehensive Backup Details")
@@ -2347,7 +2418,6 @@ class CommandEditor(QMainWindow):
             info_group = QGroupBox("Backup Information")
             info_layout = QVBoxLayout()
 
-            backup_info = backup_data.get('backup_info', {})
             info_text = f"""
             <b>Timestamp:</b> {backup_info.get('timestamp', 'Unknown')}
             <b>Version:</b> {backup_info.get('version', 'Unknown')}
@@ -2364,11 +2434,6 @@ class CommandEditor(QMainWindow):
             content_group = QGroupBox("Content Summary")
             content_layout = QVBoxLayout()
 
-            commands_count = len(backup_data.get('commands', []))
-            users_count = len(backup_data.get('currency_users', {}))
-            moderators_count = len(backup_data.get('moderators', {}).get('manual', []))
-            ranks_count = len(backup_data.get('ranks', []))
-
             content_text = f"""
             <b>Commands:</b> {commands_count}
             <b>Currency Users:</b> {users_count}
@@ -2409,25 +2474,21 @@ class CommandEditor(QMainWindow):
         return self.create_comprehensive_backup()
 
     def create_comprehensive_backup(self):
-        """Create a comprehensive backup of the entire system"""
+        """Start writing a comprehensive backup of the entire system in the background
+
+        Commands and settings are copied here, currency users are exported from
+        a consistent snapshot of the user store by the backup thread.
+
+        Returns:
+            bool: True if the backup was started
+        """
+        if self.system_backup_thread and self.system_backup_thread.isRunning():
+            print("[COMPREHENSIVE BACKUP] Previous backup is still being written, skipping")
+            return False
+
         try:
-            # Create backup directory
-            backup_dir = Path("backups") / "comprehensive"
-            backup_dir.mkdir(parents=True, exist_ok=True)
-
-            # Generate timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_name = f"system_backup_{timestamp}"
-            backup_path = backup_dir / backup_name
-
-            backup_data = {
-                "backup_info": {
-                    "timestamp": datetime.now().isoformat(),
-                    "version": "1.0",
-                    "description": "Comprehensive system backup created during operation"
-                },
-                "commands": self.commands.copy() if self.commands else [],
-                "currency_users": {},
+            sections = {
+                "commands": json.loads(json.dumps(self.commands)) if self.commands else [],
                 "moderators": {},
                 "config": {},
                 "ranks": [],
@@ -2436,123 +2497,116 @@ class CommandEditor(QMainWindow):
             }
 
             # Add currency data if available
-            if hasattr(self, 'currency_manager') and self.currency_manager.users:
-                backup_data["currency_users"] = self.currency_manager.users.copy()
-                backup_data["ranks"] = getattr(self.currency_manager, 'ranks', [])
-
-            # Add currency settings
+            users_snapshot = None
             if hasattr(self, 'currency_manager'):
-                backup_data["currency_settings"] = {
+                users_snapshot = self.currency_manager.snapshot_users()
+                sections["ranks"] = json.loads(json.dumps(getattr(self.currency_manager, 'ranks', [])))
+                sections["currency_settings"] = json.loads(json.dumps({
                     "settings": getattr(self.currency_manager, 'settings', {}),
                     "backup_dir": str(getattr(self.currency_manager, 'backup_dir', '')),
                     "max_backups": getattr(self.currency_manager, 'max_currency_backups', 10)
-                }
+                }))
 
             # Add moderator data
             try:
-                backup_data["moderators"] = {
-                    "manual": self.config_manager.get_manual_moderators() if hasattr(self.config_manager, 'get_manual_moderators') else [],
-                    "excluded": self.config_manager.get_excluded_moderators() if hasattr(self.config_manager, 'get_excluded_moderators') else []
+                sections["moderators"] = {
+                    "manual": list(self.config_manager.get_manual_moderators()) if hasattr(self.config_manager, 'get_manual_moderators') else [],
+                    "excluded": list(self.config_manager.get_excluded_moderators()) if hasattr(self.config_manager, 'get_excluded_moderators') else []
                 }
             except:
-                backup_data["moderators"] = {"manual": [], "excluded": []}
+                sections["moderators"] = {"manual": [], "excluded": []}
 
             # Add configuration
             try:
-                backup_data["config"] = {
+                sections["config"] = json.loads(json.dumps({
                     "volume": self.config_manager.get_volume(),
                     "sound_interruption": self.config_manager.get_sound_interruption(),
                     "interruption_message": self.config_manager.get_interruption_message(),
                     "auto_save": self.config_manager.get_auto_save(),
                     "max_backups": self.config_manager.get_max_backups(),
                     "twitch_config": self.config_manager.get_twitch_config() if hasattr(self.config_manager, 'get_twitch_config') else {}
-                }
+                }))
             except Exception as e:
                 print(f"Error backing up config: {e}")
-                backup_data["config"] = {}
+                sections["config"] = {}
 
             # Add command history if available
             try:
                 if hasattr(self, 'history_manager'):
-                    backup_data["command_history"] = {
+                    sections["command_history"] = {
                         "max_backups": self.history_manager.max_backups,
                         "backup_dir": str(self.history_manager.backup_dir)
                     }
             except Exception as e:
                 print(f"Error backing up command history metadata: {e}")
 
-            # Save backup data
-            with open(backup_path.with_suffix('.json'), 'w', encoding='utf-8') as f:
-                json.dump(backup_data, f, indent=2, ensure_ascii=False)
-
-            # Create metadata
-            metadata = {
-                "backup_time": time.time(),
-                "backup_name": backup_name,
-                "commands_count": len(backup_data["commands"]),
-                "users_count": len(backup_data["currency_users"]),
-                "moderators_count": len(backup_data["moderators"].get("manual", [])),
-                "total_size": backup_path.with_suffix('.json').stat().st_size,
-                "version": backup_data["backup_info"]["version"]
-            }
+            writer = ComprehensiveBackupWriter(self.system_backup_dir, sections, users_snapshot,
+                                               catalog=self.backup_catalog)
+            self.system_backup_thread = ComprehensiveBackupThread(writer)
+            self.system_backup_thread.progress.connect(self._on_comprehensive_backup_progress)
+            self.system_backup_thread.backup_finished.connect(self._on_comprehensive_backup_finished)
+            if hasattr(self, 'create_system_backup_btn'):
+                self.create_system_backup_btn.setEnabled(False)
+            self.system_backup_thread.start()
+            return True
 
-            with open(backup_path.with_suffix('.json.meta'), 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, indent=2)
+        except Exception as e:
+            print(f"Error creating comprehensive backup: {e}")
+            return False
 
-            print(f"[COMPREHENSIVE BACKUP] Created backup: {backup_path.name}")
-            
+    def _on_comprehensive_backup_progress(self, done, total):
+        """Show backup progress in the Backups tab"""
+        if hasattr(self, 'system_backup_status_label') and total:
+            self.system_backup_status_label.setText(f"Writing backup... {done * 100 // total}%")
+            self.system_backup_status_label.setStyleSheet("color: blue;")
+
+    def _on_comprehensive_backup_finished(self, backup_path):
+        """Runs on the UI thread when the backup thread is done"""
+        if hasattr(self, 'create_system_backup_btn'):
+            self.create_system_backup_btn.setEnabled(True)
+        if backup_path:
+            print(f"Comprehensive backup created: {backup_path}")
             # Clean up old comprehensive backups after successful creation
             self._cleanup_old_comprehensive_backups()
-            
-            return backup_path
-
-        except Exception as e:
-            print(f"Error creating comprehensive backup: {e}")
-            return None
+        else:
+            print("Failed to create comprehensive backup")
+        self.refresh_comprehensive_backups()
 
     def _cleanup_old_comprehensive_backups(self):
-        """Remove old comprehensive backups keeping only the most recent ones"""
+        """Thin out old comprehensive backups according to the retention tiers"""
         try:
-            from pathlib import Path
-
-            # Get backup directory
-            backup_dir = Path("backups") / "comprehensive"
-            if not backup_dir.exists():
-                return
-
-            # Get backup files
-            backup_files = list(backup_dir.glob("system_backup_*.json"))
-
-            # Get max comprehensive backups setting
-            max_backups = self.config_manager.get_max_comprehensive_backups()
-
-            if len(backup_files) <= max_backups:
-                return
-
-            # Sort by modification time (newest first)
-            backup_files.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-
-            # Remove old backups
-            for old_backup in backup_files[max_backups:]:
-                try:
-                    old_backup.unlink()
-                    # Also remove metadata file if it exists
-                    meta_file = old_backup.with_suffix('.json.meta')
-                    if meta_file.exists():
-                        meta_file.unlink()
-                    print(f"[COMPREHENSIVE BACKUP] Removed old backup: {old_backup.name}")
-                except Exception as e:
-                    print(f"[COMPREHENSIVE BACKUP] Error removing old backup {old_backup}: {e}")
-
+            policy = RetentionPolicy.from_settings(self.config_manager.get_retention_settings(),
+                                                   max_recent=self.config_manager.get_max_comprehensive_backups())
+            policy.apply(self.backup_catalog, KIND_COMPREHENSIVE, self._delete_comprehensive_backups)
         except Exception as e:
             print(f"[COMPREHENSIVE BACKUP] Error during cleanup: {e}")
 
+    def _delete_comprehensive_backups(self, paths):
+        """Delete comprehensive backups with their metadata and drop them from the catalog"""
+        removed = []
+        for old_backup in map(Path, paths):
+            try:
+                if old_backup.exists():
+                    old_backup.unlink()
+                # Also remove metadata file if it exists
+                meta_file = meta_path(old_backup)
+                if meta_file.exists():
+                    meta_file.unlink()
+                removed.append(old_backup)
+                print(f"[COMPREHENSIVE BACKUP] Removed old backup: {old_backup.name}")
+            except Exception as e:
+                print(f"[COMPREHENSIVE BACKUP] Error removing old backup {old_backup}: {e}")
+        self.backup_catalog.remove(removed)
+
     def restore_comprehensive_backup_method(self, backup_path):
         """Restore from a comprehensive backup (wrapper for the method)"""
         return self.restore_comprehensive_backup(backup_path)
 
 if __name__ == "__main__":
     app = QApplication([])
+    startup_timer.mark("qt application")
     window = CommandEditor()
     window.show()
+    # Отчет выводится, когда окно уже отрисовано и цикл событий запущен
+    QTimer.singleShot(0, startup_timer.report)
     app.exec_()  # Note: в PyQt5 используется exec_() вместо exec()
@@ -0,0 +1,56 @@
+"""
+Normalization of command keys.
+
+Chat clients and copy-pasted commands bring zero-width characters, control
+characters and odd whitespace into command names, so every key is lowercased
+and stripped of them before it is compared or used for cooldowns. The key is
+normalized several times per message and once per configured command, so the
+per-character Python loop is replaced by:
+
+- one str.translate pass over a table that deletes every character that is
+  not printable or is whitespace, and "!". The table is filled lazily: the
+  verdict for a code point is computed once, on its first appearance, with the
+  same str.isprintable()/str.isspace() checks as before, so the result is
+  identical for all of Unicode;
+- an LRU memo over recent raw keys, since chat repeats the same few commands.
+"""
+
+from functools import lru_cache
+
+MEMO_SIZE = 2048
+
+
+class _KeyTable(dict):
+    """str.translate table: code point -> None (delete) or itself (keep)"""
+
+    def __missing__(self, code):
+        char = chr(code)
+        value = code if char.isprintable() and not char.isspace() and char != '!' else None
+        self[code] = value
+        return value
+
+
+_TABLE = _KeyTable()
+for _code in range(128):
+    _TABLE[_code]  # ASCII заполняем сразу, остальное - при первой встрече
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def _normalize(key: str):
+    lowered = key.lower()
+    return lowered, lowered.translate(_TABLE)
+
+
+def normalize_command_key(key: str) -> str:
+    """Lowercase key without invisible characters, whitespace and "!" """
+    if not key:
+        return ""
+    lowered, normalized = _normalize(key)
+    if normalized != lowered:
+        print(f"Command key normalized: '{lowered}' -> '{normalized}'")
+    return normalized
+
+
+def memo_info():
+    """Hit/miss counters of the memo (functools.lru_cache cache_info)"""
+    return _normalize.cache_info()
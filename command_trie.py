@@ -0,0 +1,172 @@
+"""
+Command lookup by normalized key.
+
+Every chat message that starts with "!" used to walk the system commands and
+then the custom commands, normalizing each configured name on the way. The
+CommandIndex is built once per change of the command set instead: a prefix
+tree over the normalized keys of all enabled system and custom commands and
+of the aliases from config.json. It gives
+
+- exact matching in O(len(key)), independent of the number of commands;
+- prefix completion (the editor search box);
+- "did you mean" suggestions within a small edit distance, found by walking
+  the tree with one Levenshtein row per node and pruning branches that can no
+  longer get close enough. Suggestions are computed only for unknown commands.
+
+Precedence is the same as in the old scans: system commands before custom
+ones, the first enabled command wins, aliases never shadow a command.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from command_keys import normalize_command_key
+
+_END = ''  # Ключ значения в узле; символы ключей команд всегда непустые
+
+MAX_SUGGESTIONS = 3
+MIN_SUGGEST_LENGTH = 3   # Для "!a" и подобных подсказки бесполезны
+MAX_SUGGEST_LENGTH = 32
+
+
+class CommandTrie:
+    """Prefix tree: normalized key -> value"""
+
+    def __init__(self):
+        self._root: Dict[str, Any] = {}
+        self._size = 0
+
+    def insert(self, key: str, value, replace: bool = False) -> bool:
+        """Add key; an existing key is kept unless replace is set. Returns True if stored"""
+        if not key:
+            return False
+        node = self._root
+        for char in key:
+            node = node.setdefault(char, {})
+        if _END in node and not replace:
+            return False
+        if _END not in node:
+            self._size += 1
+        node[_END] = value
+        return True
+
+    def _node(self, key: str):
+        node = self._root
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                return None
+        return node
+
+    def get(self, key: str, default=None):
+        node = self._node(key)
+        if node is None or _END not in node:
+            return default
+        return node[_END]
+
+    def __contains__(self, key) -> bool:
+        node = self._node(key)
+        return node is not None and _END in node
+
+    def __len__(self) -> int:
+        return self._size
+
+    def complete(self, prefix: str, limit: int = 20) -> List[str]:
+        """Keys starting with prefix in alphabetical order"""
+        node = self._node(prefix)
+        if node is None:
+            return []
+        result = []
+        # Обход в глубину по отсортированным детям дает алфавитный порядок
+        stack = [(prefix, node)]
+        while stack and len(result) < limit:
+            key, node = stack.pop()
+            if _END in node:
+                result.append(key)
+            for char in sorted((c for c in node if c), reverse=True):
+                stack.append((key + char, node[char]))
+        return result
+
+    def suggest(self, key: str, max_distance: int = 2, limit: int = MAX_SUGGESTIONS) -> List[Tuple[int, str]]:
+        """Keys within max_distance edits of key, closest first, as (distance, key)"""
+        first_row = list(range(len(key) + 1))
+        found = []
+        stack = [(child, char, first_row, char) for char, child in self._root.items() if char]
+        while stack:
+            node, char, previous, word = stack.pop()
+            row = [previous[0] + 1]
+            for i in range(1, len(key) + 1):
+                row.append(min(row[i - 1] + 1,
+                               previous[i] + 1,
+                               previous[i - 1] + (key[i - 1] != char)))
+            if row[-1] <= max_distance and _END in node:
+                found.append((row[-1], word))
+            # Дальше по ветке расстояние не уменьшится ниже минимума строки
+            if min(row) <= max_distance:
+                stack.extend((child, c, row, word + c) for c, child in node.items() if c)
+        found.sort()
+        return found[:limit]
+
+
+class CommandMatch:
+    """Command found for a key: kind is "system" or "custom", key is the command's own key"""
+
+    __slots__ = ('kind', 'command', 'key')
+
+    def __init__(self, kind: str, command: Dict[str, Any], key: str):
+        self.kind = kind
+        self.command = command
+        self.key = key
+
+    def __repr__(self):
+        return f"CommandMatch({self.kind}, {self.key!r})"
+
+
+class CommandIndex:
+    """Enabled system and custom commands and their aliases of one channel"""
+
+    def __init__(self, system_commands: Iterable[Dict[str, Any]] = (),
+                 custom_commands: Iterable[Dict[str, Any]] = (),
+                 aliases: Optional[Dict[str, str]] = None, prefix: str = '!'):
+        """
+        Args:
+            system_commands: Entries of system_commands.json
+            custom_commands: Commands in the commands.json format
+            aliases: Alias -> command name, e.g. {"sr": "!songrequest"}
+            prefix: Command prefix of the bot
+        """
+        self.trie = CommandTrie()
+        self.aliases = 0
+        for sys_cmd in system_commands:
+            if sys_cmd.get("enabled", False):
+                name = sys_cmd.get("command_name", sys_cmd["command"])
+                key = normalize_command_key(name.lstrip('!'))
+                self.trie.insert(key, CommandMatch('system', sys_cmd, key))
+        for cmd in custom_commands:
+            if cmd.get("Enabled", False):
+                key = normalize_command_key(cmd["Command"].lstrip(prefix).lower())
+                self.trie.insert(key, CommandMatch('custom', cmd, key))
+        for alias, target in (aliases or {}).items():
+            match = self.trie.get(normalize_command_key(str(target).lstrip(prefix)))
+            if match is None:
+                print(f"Alias '{alias}' points to unknown or disabled command '{target}'")
+                continue
+            if self.trie.insert(normalize_command_key(str(alias).lstrip(prefix)), match):
+                self.aliases += 1
+
+    def get(self, key: str) -> Optional[CommandMatch]:
+        """Command for a normalized key, aliases resolved"""
+        return self.trie.get(key)
+
+    def complete(self, prefix: str, limit: int = 20) -> List[str]:
+        """Command keys and aliases starting with prefix"""
+        return self.trie.complete(normalize_command_key(prefix.lstrip('!')), limit)
+
+    def suggest(self, key: str, limit: int = MAX_SUGGESTIONS) -> List[str]:
+        """Known keys close to a mistyped one, one edit for short keys and two for longer"""
+        if not MIN_SUGGEST_LENGTH <= len(key) <= MAX_SUGGEST_LENGTH:
+            return []
+        max_distance = 1 if len(key) <= 4 else 2
+        return [word for _, word in self.trie.suggest(key, max_distance, limit)]
+
+    def __len__(self) -> int:
+        return len(self.trie)
@@ -5,12 +5,46 @@ from pathlib import Path
 import shutil
 from datetime import datetime
 from typing import Dict, Any
+from contextlib import contextmanager
+import threading
 import traceback
 
 class ConfigManager:
-    def __init__(self):
+    # Общий экземпляр для всего процесса (см. instance())
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """Return the process-wide ConfigManager, creating it on first use"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self, program_dir=None):
+        """
+        Args:
+            program_dir: Directory of config.json and the other files; defaults to
+                the application directory (tools like the load harness pass a
+                temporary one)
+        """
+        # Состояние батчевых (транзакционных) изменений
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self._pending_saves = set()
+        # Последнее записанное содержимое файлов - чтобы не писать и не бэкапить без изменений
+        self._saved_text = {}
+        # Вывод вызывающего метода при сохранении - только в режиме отладки
+        self.debug = os.environ.get('COMMAND_EDITOR_DEBUG', '') not in ('', '0')
+        self.config = {}
+        self.twitch_config = {}
+        self.moderators_config = {}
+
         # Определяем корневую директорию в зависимости от того, запущено ли приложение как .exe или как .py
-        if getattr(sys, 'frozen', False):
+        if program_dir is not None:
+            self.program_dir = Path(program_dir)
+        elif getattr(sys, 'frozen', False):
             # Если приложение запущено как .exe
             self.program_dir = Path(os.path.dirname(sys.executable))
         else:
@@ -56,6 +90,7 @@ class ConfigManager:
         }
           # Load or create config
         self.config = self.load_config()
+        self._saved_text['config'] = self._config_text()
         
         # Load Twitch config (отдельный вызов)
         self.twitch_config = self.load_twitch_config()
@@ -94,6 +129,7 @@ class ConfigManager:
                     loaded_twitch = json.load(f)
                     # Merge with default twitch config
                     twitch_config = {**self.default_twitch, **loaded_twitch}
+                    self._saved_text['twitch'] = json.dumps(loaded_twitch, indent=4)
                 return twitch_config
             except json.JSONDecodeError:
                 twitch_config = self.default_twitch.copy()
@@ -129,6 +165,7 @@ class ConfigManager:
                     loaded_moderators = json.load(f)
                     # Merge with default moderators config
                     moderators_config = {**self.default_moderators, **loaded_moderators}
+                    self._saved_text['moderators'] = json.dumps(loaded_moderators, indent=4, ensure_ascii=False)
                 return moderators_config
             except json.JSONDecodeError:
                 moderators_config = self.default_moderators.copy()
@@ -148,40 +185,96 @@ class ConfigManager:
             self.save_moderators_config_file(moderators_config)
             return moderators_config
     
+    @contextmanager
+    def batch(self):
+        """Group several changes into one write per file
+
+        Example:
+            with config_manager.batch():
+                config_manager.set_volume(0.5)
+                config_manager.set_auto_save(True, 300)
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    pending = self._pending_saves.copy()
+                    self._pending_saves.clear()
+                    if 'config' in pending:
+                        self._write_config()
+                    if 'twitch' in pending:
+                        self._write_twitch_config()
+                    if 'moderators' in pending:
+                        self._write_moderators_config()
+
+    def _defer_save(self, name):
+        """Remember a pending save while inside batch(); returns True if deferred"""
+        with self._lock:
+            if self._batch_depth > 0:
+                self._pending_saves.add(name)
+                return True
+        return False
+
+    def _log_caller(self, what, extra=""):
+        if not self.debug:
+            return
+        # Debug print for stack trace
+        stack_trace = traceback.extract_stack()
+        caller = stack_trace[-4]  # Метод, вызвавший save_*
+        print(f"Saving {what} from {caller.name} at {caller.filename}:{caller.lineno}{extra}")
+
+    def _config_text(self):
+        # УБЕДИМСЯ, что токены Twitch не сохраняются в основной файл
+        config_to_save = self.config.copy()
+        if 'twitch' in config_to_save:
+            config_to_save['twitch'] = {k: v for k, v in config_to_save['twitch'].items() 
+                                     if k not in ('access_token', 'client_id', 'refresh_token')}
+        return json.dumps(config_to_save, indent=4)
+
     def save_config(self, config=None):
         """Save configuration to file"""
         try:
-            if config is not None:
-                # Вместо полной замены конфигурации, обновляем только переданные поля
-                for key, value in config.items():
-                    if key in self.config:
-                        if isinstance(value, dict) and isinstance(self.config[key], dict):
-                            # Для вложенных словарей делаем рекурсивное обновление
-                            self._update_nested_dict(self.config[key], value)
+            with self._lock:
+                if config is not None:
+                    # Вместо полной замены конфигурации, обновляем только переданные поля
+                    for key, value in config.items():
+                        if key in self.config:
+                            if isinstance(value, dict) and isinstance(self.config[key], dict):
+                                # Для вложенных словарей делаем рекурсивное обновление
+                                self._update_nested_dict(self.config[key], value)
+                            else:
+                                self.config[key] = value
                         else:
                             self.config[key] = value
-                    else:
-                        self.config[key] = value
-            
-            # Create backup before saving
+
+                if self._defer_save('config'):
+                    return True
+                return self._write_config()
+        except Exception as e:
+            print(f"Error saving config: {e}")
+            return False
+
+    def _write_config(self):
+        try:
+            text = self._config_text()
+            if text == self._saved_text.get('config'):
+                return True
+
+            self._log_caller("config")
+
+            # Create backup before saving (only when the content really changed)
             self._create_backup()
             
-            # Debug print for stack trace
-            stack_trace = traceback.extract_stack()
-            caller = stack_trace[-2]  # Предпоследний элемент - это вызывающий метод
-            print(f"Saving config from {caller.name} at {caller.filename}:{caller.lineno}")
-            
             # Ensure the directory exists
             os.makedirs(os.path.dirname(self.config_file), exist_ok=True)
             
-            # Save the config - УБЕДИМСЯ, что токены Twitch не сохраняются в основной файл
-            config_to_save = self.config.copy()
-            if 'twitch' in config_to_save:
-                config_to_save['twitch'] = {k: v for k, v in config_to_save['twitch'].items() 
-                                         if k not in ('access_token', 'client_id', 'refresh_token')}
-            
             with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config_to_save, f, indent=4)
+                f.write(text)
+            self._saved_text['config'] = text
                 
             return True
         except Exception as e:
@@ -191,22 +284,34 @@ class ConfigManager:
     def save_twitch_config_file(self, twitch_config=None):
         """Save Twitch configuration to separate file"""
         try:
-            if twitch_config is not None:
-                # Update only provided fields
-                for key, value in twitch_config.items():
-                    self.twitch_config[key] = value
-            
-            # Debug print
-            stack_trace = traceback.extract_stack()
-            caller = stack_trace[-2]
-            print(f"Saving twitch config from {caller.name} at {caller.filename}:{caller.lineno}. Token present: {'Yes' if self.twitch_config.get('access_token') else 'No'}")
+            with self._lock:
+                if twitch_config is not None:
+                    # Update only provided fields
+                    for key, value in twitch_config.items():
+                        self.twitch_config[key] = value
+
+                if self._defer_save('twitch'):
+                    return True
+                return self._write_twitch_config()
+        except Exception as e:
+            print(f"Error saving twitch config: {e}")
+            return False
+
+    def _write_twitch_config(self):
+        try:
+            text = json.dumps(self.twitch_config, indent=4)
+            if text == self._saved_text.get('twitch'):
+                return True
+
+            self._log_caller("twitch config", f". Token present: {'Yes' if self.twitch_config.get('access_token') else 'No'}")
             
             # Ensure directory exists
             os.makedirs(os.path.dirname(self.twitch_file), exist_ok=True)
             
             # Save to separate file
             with open(self.twitch_file, 'w', encoding='utf-8') as f:
-                json.dump(self.twitch_config, f, indent=4)
+                f.write(text)
+            self._saved_text['twitch'] = text
                 
             return True
         except Exception as e:
@@ -216,17 +321,32 @@ class ConfigManager:
     def save_moderators_config_file(self, moderators_config=None):
         """Save moderators configuration to separate file"""
         try:
-            if moderators_config is not None:
-                # Update only provided fields
-                for key, value in moderators_config.items():
-                    self.moderators_config[key] = value
+            with self._lock:
+                if moderators_config is not None:
+                    # Update only provided fields
+                    for key, value in moderators_config.items():
+                        self.moderators_config[key] = value
+
+                if self._defer_save('moderators'):
+                    return True
+                return self._write_moderators_config()
+        except Exception as e:
+            print(f"Error saving moderators config: {e}")
+            return False
+
+    def _write_moderators_config(self):
+        try:
+            text = json.dumps(self.moderators_config, indent=4, ensure_ascii=False)
+            if text == self._saved_text.get('moderators'):
+                return True
             
             # Ensure directory exists
             os.makedirs(os.path.dirname(self.moderators_file), exist_ok=True)
             
             # Save to separate file
             with open(self.moderators_file, 'w', encoding='utf-8') as f:
-                json.dump(self.moderators_config, f, indent=4, ensure_ascii=False)
+                f.write(text)
+            self._saved_text['moderators'] = text
                 
             return True
         except Exception as e:
@@ -244,6 +364,22 @@ class ConfigManager:
             print(f"Error saving system commands: {e}")
             return False
 
+    def system_commands_version(self):
+        """Changes whenever system_commands.json is saved or edited outside the program"""
+        try:
+            return (self.program_dir / 'system_commands.json').stat().st_mtime_ns
+        except OSError:
+            return 0
+
+    def get_command_aliases(self):
+        """Aliases of commands: {"alias": "!command"}"""
+        return self.config.get('command_aliases', {})
+
+    def set_command_aliases(self, aliases):
+        """Set command aliases"""
+        self.config['command_aliases'] = dict(aliases)
+        self.save_config()
+
     def load_system_commands(self):
         """Load system commands from a separate file"""
         try:
@@ -514,6 +650,27 @@ class ConfigManager:
         self.config['backup']['max_comprehensive_backups'] = max_backups
         self.save_config()
 
+    def get_retention_settings(self):
+        """Get tiered retention settings shared by all backup types"""
+        from retention_policy import DEFAULT_RETENTION
+        return {**DEFAULT_RETENTION, **self.config.get('backup', {}).get('retention', {})}
+
+    def set_retention_settings(self, settings):
+        """Set tiered retention settings (keep_all_hours, hourly_days, daily_days, disk_budget_mb)"""
+        if 'backup' not in self.config:
+            self.config['backup'] = {}
+        self.config['backup']['retention'] = dict(settings)
+        self.save_config()
+
+    def get_chat_rate_mode(self):
+        """Chat message budget of the bot account: 'normal', 'mod' or 'verified'"""
+        return self.config.get('twitch', {}).get('rate_mode', 'normal')
+
+    def get_daemon_settings(self):
+        """Get headless daemon settings (control API address and token)"""
+        defaults = {'host': '127.0.0.1', 'port': 8765, 'api_token': ''}
+        return {**defaults, **self.config.get('daemon', {})}
+
     def get_manual_moderators(self):
         """Get manual moderators list"""
         return self.moderators_config.get('manual_moderators', [])
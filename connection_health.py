@@ -0,0 +1,122 @@
+"""
+IRC connection health tracking.
+
+The bot reports every inbound line and every PONG here. While chat traffic
+flows the connection is known to be alive and nothing is sent. Only after the
+connection has been quiet for a while is a PING probe sent, and a missing PONG
+marks the connection as dead. Reconnect delays grow exponentially with
+random jitter, so many bots that lose Twitch at the same moment do not
+reconnect in lockstep.
+"""
+
+import random
+import time
+from typing import Any, Dict, Optional
+
+IDLE_PROBE_AFTER = 60     # Тишина, после которой отправляется PING, секунд
+PONG_TIMEOUT = 10         # Сколько ждать PONG, секунд
+BACKOFF_BASE = 2          # Первая задержка переподключения, секунд
+BACKOFF_MAX = 300         # Максимальная задержка переподключения, секунд
+RTT_SMOOTHING = 0.2       # Вес нового замера в скользящем среднем RTT
+
+
+class ConnectionHealth:
+    """Liveness, round-trip time and downtime of one IRC connection"""
+
+    def __init__(self, idle_probe_after: float = IDLE_PROBE_AFTER, pong_timeout: float = PONG_TIMEOUT,
+                 backoff_base: float = BACKOFF_BASE, backoff_max: float = BACKOFF_MAX):
+        self.idle_probe_after = idle_probe_after
+        self.pong_timeout = pong_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        now = time.monotonic()
+        self.last_inbound = now
+        self.ping_sent_at: Optional[float] = None
+        self.rtt: Optional[float] = None
+        self.rtt_avg: Optional[float] = None
+        self.probes = 0
+        self.missed_pongs = 0
+        self.reconnects = 0
+        self.downtime = 0.0
+        self.down_since: Optional[float] = None
+
+    # --- События соединения ---
+
+    def on_inbound(self, now: Optional[float] = None):
+        """Any line from the server proves the connection is alive"""
+        self.last_inbound = now or time.monotonic()
+
+    def on_pong(self, now: Optional[float] = None):
+        now = now or time.monotonic()
+        self.on_inbound(now)
+        if self.ping_sent_at is None:
+            return
+        self.rtt = now - self.ping_sent_at
+        self.rtt_avg = self.rtt if self.rtt_avg is None else \
+            (1 - RTT_SMOOTHING) * self.rtt_avg + RTT_SMOOTHING * self.rtt
+        self.ping_sent_at = None
+
+    def on_ping_sent(self, now: Optional[float] = None):
+        self.ping_sent_at = now or time.monotonic()
+        self.probes += 1
+
+    def on_disconnected(self, now: Optional[float] = None):
+        """Connection found dead; downtime counts from here until on_connected"""
+        if self.down_since is None:
+            self.down_since = now or time.monotonic()
+        self.ping_sent_at = None
+
+    def on_connected(self, now: Optional[float] = None, reconnect: bool = False):
+        now = now or time.monotonic()
+        if self.down_since is not None:
+            self.downtime += now - self.down_since
+            self.down_since = None
+        if reconnect:
+            self.reconnects += 1
+        self.ping_sent_at = None
+        self.on_inbound(now)
+
+    # --- Решения ---
+
+    def probe_due(self, now: Optional[float] = None) -> bool:
+        """True if the connection was quiet long enough to send a PING"""
+        now = now or time.monotonic()
+        return self.ping_sent_at is None and now - self.last_inbound >= self.idle_probe_after
+
+    def is_dead(self, now: Optional[float] = None) -> bool:
+        """True if a PING went unanswered and nothing else arrived since"""
+        now = now or time.monotonic()
+        if self.ping_sent_at is None or self.last_inbound > self.ping_sent_at:
+            return False
+        if now - self.ping_sent_at >= self.pong_timeout:
+            self.missed_pongs += 1
+            return True
+        return False
+
+    def next_check_in(self, now: Optional[float] = None) -> float:
+        """Seconds until there is something to check (idle deadline or PONG timeout)"""
+        now = now or time.monotonic()
+        if self.ping_sent_at is not None:
+            return max(0.5, self.ping_sent_at + self.pong_timeout - now)
+        return max(0.5, self.last_inbound + self.idle_probe_after - now)
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before reconnect attempt `attempt` (1-based), exponential with jitter"""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** max(attempt - 1, 0)))
+        # Половина задержки фиксирована, половина случайна
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def metrics(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        current_down = now - self.down_since if self.down_since is not None else 0.0
+        return {
+            'connected': self.down_since is None,
+            'rtt_ms': round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            'rtt_avg_ms': round(self.rtt_avg * 1000, 1) if self.rtt_avg is not None else None,
+            'idle_seconds': round(now - self.last_inbound, 1),
+            'probes': self.probes,
+            'missed_pongs': self.missed_pongs,
+            'reconnects': self.reconnects,
+            'downtime_seconds': round(self.downtime + current_down, 1),
+        }
@@ -5,15 +5,52 @@ import threading
 from datetime import datetime
 from pathlib import Path
 import sys
-import hashlib
 import shutil
 import logging
+from contextlib import ExitStack
 from typing import Optional, Dict, Any, List
 
+import bulk_ops
+from response_templates import compile_template
+from user_store import UserStore
+from backup_catalog import BackupCatalog, KIND_CURRENCY
+from retention_policy import RetentionPolicy
+
+USER_LOCK_STRIPES = 64
+# users_currency.json - только экспорт индекса: пишется при выходе, по запросу, перед бэкапом и раз в час
+JSON_EXPORT_INTERVAL = 3600
+
+
+class CurrencyReservation:
+    """Points held for a paid command until it is committed or rolled back"""
+
+    PENDING = 'pending'
+    COMMITTED = 'committed'
+    ROLLED_BACK = 'rolled_back'
+
+    def __init__(self, reservation_id, username, amount):
+        self.id = reservation_id
+        self.username = username
+        self.amount = amount
+        self.created = time.time()
+        self.state = self.PENDING
+
+    def __repr__(self):
+        return f"CurrencyReservation({self.id}, {self.username}, {self.amount}, {self.state})"
+
 
 class CurrencyManager:
-    def __init__(self):
-        # Основные хранилища данных        self.users = {}
+    def __init__(self, data_dir=None, config_manager=None):
+        """
+        Args:
+            data_dir: Directory with this currency's users, ranks, settings and
+                backups. Defaults to the application directory; the
+                multi-channel runtime passes one directory per channel.
+            config_manager: Source of the backup settings, the shared
+                ConfigManager by default
+        """
+        self.config_manager = config_manager
+        # Основные хранилища данных
         self.ranks = []
         
         # Настройки по умолчанию
@@ -41,11 +78,18 @@ class CurrencyManager:
             'on_follow': 10,
             'on_sub': 10,
             'mass_sub_gift': 0,
-            'on_host': 0
+            'on_host': 0,
+            # Архивация неактивных зрителей с почти пустым балансом
+            'archive_enabled': True,
+            'archive_after_days': 90,
+            'archive_below_points': 1
         }
         
         # Определение корректных путей для работы и с PyInstaller
-        if getattr(sys, 'frozen', False):
+        if data_dir is not None:
+            # Отдельное пространство валюты (например, для канала)
+            self.data_dir = Path(data_dir)
+        elif getattr(sys, 'frozen', False):
             # Запущено как скомпилированный .exe
             self.data_dir = Path(os.path.dirname(sys.executable))
         else:
@@ -58,6 +102,16 @@ class CurrencyManager:
         # Пути к файлам данных
         self.users_file = self.data_dir / 'users_currency.json'
         self.currency_file = self.data_dir / 'users_currency.json'
+
+        # Индекс пользователей: активные в памяти, остальные подгружаются с диска
+        self.users_index_file = self.data_dir / 'users_currency.db'
+        # Настройки валюты по умолчанию лежат в data/, у отдельного пространства - рядом с данными
+        self.settings_file = Path('data/currency_settings.json') if data_dir is None \
+            else self.data_dir / 'currency_settings.json'
+        # Неактивные пользователи уходят в сжатый архив и возвращаются при следующем появлении
+        self.users_archive_file = self.data_dir / 'users_archive.db'
+        self._store = UserStore(self.users_index_file, archive_path=self.users_archive_file)
+        self._last_json_export = 0.0
         
         # Backup-related settings
         self.backup_dir = self.data_dir / 'backups' / 'currency'
@@ -66,11 +120,20 @@ class CurrencyManager:
 
         # Создаем директорию для бэкапов
         os.makedirs(self.backup_dir, exist_ok=True)
+        self.backup_catalog = BackupCatalog.open(self.data_dir / 'backups' / 'backup_catalog.db')
+        self.backup_catalog.ensure_indexed(KIND_CURRENCY, self._scan_backups)
 
         # Загружаем данные
         self.load_data()
 
-        self.users_lock = threading.Lock()  # Блокировка для безопасности потоков
+        # Полосатые блокировки по имени пользователя вместо одной общей
+        self._user_locks = [threading.RLock() for _ in range(USER_LOCK_STRIPES)]
+        # Незавершенные резервирования платных команд
+        self._reservations = {}
+        self._reservation_lock = threading.Lock()
+        self._next_reservation_id = 1
+        # Невыплаченные доли очков присутствия (меньше 0.01) до следующего начисления
+        self._presence_carry = {}
 
         # Initialize data integrity tracking
         self.data_checksum = None
@@ -78,6 +141,17 @@ class CurrencyManager:
         
         # Флаг для предотвращения двойного сохранения
         self._save_pending = False
+
+    @property
+    def users(self):
+        """Dict-like access to all users (hot ones in memory, cold ones on demand)"""
+        return self._store
+
+    @users.setter
+    def users(self, value):
+        if value is self._store:
+            return
+        self._store.replace_all(value or {})
         
     def _validate_points_operation(self, username, amount, operation="add"):
         """
@@ -177,8 +251,9 @@ class CurrencyManager:
     def load_data(self):
         """Reload users data from file with integrity checking and recovery"""
         try:
-            # Load users from JSON file if it exists, otherwise start empty
-            if os.path.exists(self.users_file):
+            # users_currency.json импортируется в индекс только при первом запуске
+            # или если файл был изменен снаружи (восстановление из бэкапа и т.п.)
+            if self._store.needs_import(self.users_file):
                 # First, check data integrity
                 integrity_check = self.validate_data_integrity()
 
@@ -190,10 +265,13 @@ class CurrencyManager:
                         print(f"[CURRENCY RECOVERY] Could not recover data: {integrity_check['warnings']}")
 
                 # Load the data (either original or recovered)
-                with open(self.users_file, 'r', encoding='utf-8') as f:
-                    self.users = json.load(f)
-            else:
-                self.users = {}
+                imported = self._store.import_json(self.users_file)
+                print(f"[CURRENCY LOAD] Imported {imported} users from {self.users_file} into {self.users_index_file}")
+            elif not self._store.verify_digest():
+                # Один потоковый проход по индексу вместо разбора всего JSON
+                print(f"[CURRENCY INTEGRITY] Checksum mismatch in {self.users_index_file}, re-importing {self.users_file}")
+                if os.path.exists(self.users_file):
+                    self._store.import_json(self.users_file)
 
             # Calculate initial checksum
             self._calculate_checksum()
@@ -201,30 +279,37 @@ class CurrencyManager:
             # Сбрасываем флаг отложенного сохранения после загрузки данных
             self._save_pending = False
 
-            print(f"[CURRENCY LOAD] Loaded {len(self.users)} users from {self.users_file}")
+            print(f"[CURRENCY LOAD] User index ready: {self.users_index_file} ({self._store.hot_count} users in memory)")
 
         except Exception as e:
             print(f"[CURRENCY LOAD] Error loading currency data: {e}")
             import traceback
             traceback.print_exc()
-            # Ensure users dict exists even on error
-            self.users = {}
             # Сбрасываем флаг отложенного сохранения даже в случае ошибки
             self._save_pending = False
     
-    def save_users(self, force=False):
-        """Сохранить данные о пользователях"""
+    def save_users(self, force=False, export=False):
+        """Сохранить данные о пользователях
+
+        Изменения пишутся в индекс SQLite; users_currency.json перезаписывается
+        целиком только при export=True или раз в JSON_EXPORT_INTERVAL секунд.
+        """
         # Проверяем флаг отложенного сохранения
         if not force and not self._save_pending:
             return True
             
         try:
-            # Убедимся, что директория существует
-            os.makedirs(os.path.dirname(str(self.users_file)), exist_ok=True)
-            
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump(self.users, f, indent=4, ensure_ascii=False)
-            print(f"Пользователи сохранены в {self.users_file}")
+            written = self._store.flush()
+
+            # Неактивные пользователи выгружаются из памяти, данные остаются в индексе
+            evicted = self._store.evict_idle()
+            if evicted:
+                print(f"[CURRENCY STORE] Evicted {evicted} idle users, {self._store.hot_count} in memory")
+
+            if export or time.time() - self._last_json_export >= JSON_EXPORT_INTERVAL:
+                self.export_users_json()
+            elif written:
+                print(f"[CURRENCY SAVE] {written} users written to {self.users_index_file}")
             
             # Сбрасываем флаг отложенного сохранения
             self._save_pending = False
@@ -235,6 +320,15 @@ class CurrencyManager:
             traceback.print_exc()
             return False
     
+    def export_users_json(self) -> int:
+        """Write every user from the index to users_currency.json"""
+        # Убедимся, что директория существует
+        Path(self.users_file).parent.mkdir(parents=True, exist_ok=True)
+        count = self._store.export_json(self.users_file)
+        self._last_json_export = time.time()
+        print(f"Пользователи сохранены в {self.users_file}")
+        return count
+
     # Метод для совместимости с currency_file
     def save_currency_users(self, force=False):
         """Alias для save_users() для совместимости"""
@@ -250,16 +344,28 @@ class CurrencyManager:
             print(f"Ошибка сохранения данных рангов: {e}")
             return False
     
+    def load_ranks(self):
+        """Загрузить ранги из ranks.json в каталоге данных"""
+        try:
+            ranks_file = self.data_dir / 'ranks.json'
+            if ranks_file.exists():
+                with open(ranks_file, 'r', encoding='utf-8') as f:
+                    self.ranks = sorted(json.load(f), key=lambda x: x['required'])
+            return True
+        except Exception as e:
+            print(f"Ошибка загрузки данных рангов: {e}")
+            return False
+    
     def save_settings(self):
         """Save currency settings to file"""
         try:
             # Ensure data directory exists
-            if not os.path.exists('data'):
-                os.makedirs('data')
+            os.makedirs(self.settings_file.parent, exist_ok=True)
                 
             # Save settings to file
-            with open('data/currency_settings.json', 'w', encoding='utf-8') as f:
+            with open(self.settings_file, 'w', encoding='utf-8') as f:
                 json.dump(self.settings, f, indent=4, ensure_ascii=False)
+            compile_template(self.settings.get('response', ''))
                 
             print("Currency settings saved to file")
             return True
@@ -304,8 +410,8 @@ class CurrencyManager:
             self.settings.update(defaults)
             
             # Load from file if it exists
-            if os.path.exists('data/currency_settings.json'):
-                with open('data/currency_settings.json', 'r', encoding='utf-8') as f:
+            if os.path.exists(self.settings_file):
+                with open(self.settings_file, 'r', encoding='utf-8') as f:
                     loaded = json.load(f)
                     self.settings.update(loaded)
                 print("Currency settings loaded from file")
@@ -329,41 +435,87 @@ class CurrencyManager:
             traceback.print_exc()
             return self.settings  # Возвращаем настройки по умолчанию в случае ошибки
     
+    def _user_lock(self, username):
+        """Lock of the stripe a user belongs to
+
+        Operations on different users mostly take different locks, so the bot
+        thread, Qt timers and the UI do not serialize on one global lock.
+        """
+        return self._user_locks[hash(username) % len(self._user_locks)]
+
+    def _all_user_locks(self):
+        """Every stripe lock, for operations that change many users at once"""
+        stack = ExitStack()
+        for lock in self._user_locks:
+            stack.enter_context(lock)
+        return stack
+
+    def _get_or_create_user(self, username):
+        """User record, created with zero balance if missing (call under the user lock)"""
+        user = self.users.get(username)
+        if user is None:
+            user = {
+                'points': 0,
+                'hours': 0,
+                'last_seen': time.time()
+            }
+            self.users[username] = user
+        return user
+
+    def set_user_fields(self, username, fields, create=False):
+        """Update several fields of a user atomically
+
+        Args:
+            username (str): User name
+            fields (dict): Fields to set
+            create (bool): Create the user if missing
+
+        Returns:
+            bool: False if the user does not exist and create is False
+        """
+        with self._user_lock(username):
+            user = self._get_or_create_user(username) if create else self.users.get(username)
+            if user is None:
+                return False
+            user.update(fields)
+            self.users[username] = user
+            self._save_pending = True
+            return True
+
     def add_user(self, username, points=0, hours=0):
         """Add a new user to the currency system"""
         username = username.lower()
-        
-        if not hasattr(self, 'users') or self.users is None:
-            self.users = {}
-            
-        self.users[username] = {
-            'points': points,
-            'hours': hours,
-            'last_seen': time.time()
-        }
-        
+
+        with self._user_lock(username):
+            self.users[username] = {
+                'points': points,
+                'hours': hours,
+                'last_seen': time.time()
+            }
+
         # Save changes
         self.save_users(force=True)
     
     def update_user(self, username, points=None, hours=None):
         """Update user data in the currency system"""
         username = username.lower()
-        
-        if not hasattr(self, 'users') or self.users is None:
-            self.users = {}
-            
-        if username not in self.users:
-            return False
-            
-        if points is not None:
-            self.users[username]['points'] = points
-            
-        if hours is not None:
-            self.users[username]['hours'] = hours
-            
-        # Update last seen timestamp
-        self.users[username]['last_seen'] = time.time()
-        
+
+        with self._user_lock(username):
+            user = self.users.get(username)
+            if user is None:
+                return False
+
+            if points is not None:
+                user['points'] = points
+
+            if hours is not None:
+                user['hours'] = hours
+
+            # Update last seen timestamp
+            user['last_seen'] = time.time()
+            # Запись возвращается в хранилище уже измененной
+            self.users[username] = user
+
         # Save changes
         self.save_users(force=True)
         return True
@@ -371,18 +523,15 @@ class CurrencyManager:
     def remove_user(self, username):
         """Remove a user from the currency system"""
         username = username.lower()
-        
-        if not hasattr(self, 'users') or self.users is None:
-            return False
-            
-        if username in self.users:
+
+        with self._user_lock(username):
+            if username not in self.users:
+                return False
             del self.users[username]
-            
-            # Save changes
-            self.save_users(force=True)
-            return True
-            
-        return False
+
+        # Save changes
+        self.save_users(force=True)
+        return True
     
     def add_points(self, username, amount):
         """Add points to a user"""
@@ -394,54 +543,47 @@ class CurrencyManager:
         # Парсим и валидируем количество очков
         amount = self._parse_amount(amount)
         
-        with self.users_lock:  # Блокируем доступ на время изменений
+        with self._user_lock(username):  # Блокируем только этого пользователя
             # Валидация операции
             is_valid, error_msg = self._validate_points_operation(username, amount, "add")
             if not is_valid:
                 print(f"[CURRENCY ERROR] add_points validation failed for {username}: {error_msg}")
                 return self.users.get(username, {}).get('points', 0)
             
-            if username not in self.users:
-                self.users[username] = {
-                    'points': 0,
-                    'hours': 0,
-                    'last_seen': time.time()
-                }
-                
-            # Сохраняем текущий баланс для проверки
-            old_points = self.users[username]['points']
+            user = self._get_or_create_user(username)
             
             # Добавляем очки с форматированием
-            self.users[username]['points'] = self._format_points(self.users[username]['points'] + amount)
-            self.users[username]['last_seen'] = time.time()
+            user['points'] = self._format_points(user['points'] + amount)
+            user['last_seen'] = time.time()
             
             # Применение бонуса для регуляров
-            if self.users[username].get("is_regular"):
+            if user.get("is_regular"):
                 bonus = self._parse_amount(self.settings.get("regular_bonus", 0))
-                self.users[username]['points'] = self._format_points(self.users[username]['points'] + bonus)
-                
-            current_points = self.users[username]['points']
+                user['points'] = self._format_points(user['points'] + bonus)
             
             # Проверки ранга и автоматического получения статуса регуляра внутри блокировки
             self.check_auto_regular(username)
-            self.check_rank_promotion(username)
+            promoted = self.check_rank_promotion(username)
+            
+            self.users[username] = user
+            current_points = user['points']
             
             # Устанавливаем флаг отложенного сохранения
             self._save_pending = True
             
+        # Новый ранг сохраняем сразу, но уже без блокировки пользователя
+        if promoted:
+            self.save_users()
         return current_points
     
     def set_points(self, username, amount):
         """Set points for a user to a specific amount"""
         username = username.lower()
-        if username not in self.users:
-            self.users[username] = {
-                'points': 0,
-                'hours': 0,
-                'last_seen': time.time()
-            }
-        self.users[username]['points'] = amount
-        self.users[username]['last_seen'] = time.time()
+        with self._user_lock(username):
+            user = self._get_or_create_user(username)
+            user['points'] = amount
+            user['last_seen'] = time.time()
+            self.users[username] = user
         self.save_users(force=True)
     
     def remove_points(self, username, amount):
@@ -453,39 +595,61 @@ class CurrencyManager:
         # Парсим и валидируем количество очков
         amount = self._parse_amount(amount)
 
-        with self.users_lock:  # Блокируем доступ на время изменений
-            if username not in self.users:
-                self.users[username] = {
-                    'points': 0,
-                    'hours': 0,
-                    'last_seen': time.time()
-                }
+        with self._user_lock(username):  # Блокируем только этого пользователя
+            user = self.users.get(username)
+            if user is None:
+                return 0
 
             # Валидация операции
             is_valid, error_msg = self._validate_points_operation(username, amount, "remove")
             if not is_valid:
                 print(f"[CURRENCY ERROR] remove_points validation failed for {username}: {error_msg}")
-                return self.users[username]['points']
+                return user['points']
 
             # Вычитаем очки с форматированием
-            new_points = self._format_points(self.users[username]['points'] - amount)
-            self.users[username]['points'] = max(0, new_points)
-            self.users[username]['last_seen'] = time.time()
-            current_points = self.users[username]['points']
+            new_points = self._format_points(user['points'] - amount)
+            user['points'] = max(0, new_points)
+            user['last_seen'] = time.time()
+            self.users[username] = user
+            current_points = user['points']
 
             # Устанавливаем флаг отложенного сохранения
             self._save_pending = True
 
         return current_points
+
+    def try_debit(self, username, cost):
+        """Atomically take `cost` points if the user has enough (compare-and-debit)
+
+        Returns:
+            tuple: (success, balance after the operation)
+        """
+        username = username.lower()
+        if username.startswith('@'):
+            username = username[1:]
+
+        with self._user_lock(username):
+            user = self.users.get(username)
+            if user is None:
+                # Незнакомому пользователю запись не создаем: платить ему нечем
+                return cost <= 0, 0
+            if cost <= 0:
+                return True, user['points']
+            if user['points'] < cost:
+                return False, user['points']
+            user['points'] = self._format_points(user['points'] - cost)
+            self.users[username] = user
+            self._save_pending = True
+            return True, user['points']
     
     def add_hours(self, username, hours):
         """Добавить часы пользователю"""
-        if username not in self.users:
-            self.add_user(username)
-        
-        self.users[username]['hours'] += hours
-        if self.settings.get('rank_type') == 'Hours':
-            self.check_rank_promotion(username)
+        with self._user_lock(username):
+            user = self._get_or_create_user(username)
+            user['hours'] += hours
+            self.users[username] = user
+            if self.settings.get('rank_type') == 'Hours':
+                self.check_rank_promotion(username)
         self.save_users(force=True)
         return True
     
@@ -533,26 +697,38 @@ class CurrencyManager:
         return True
     
     def check_rank_promotion(self, username):
-        """Проверить, нужно ли повысить ранг пользователя"""
-        if username not in self.users or not self.ranks:
+        """Проверить, нужно ли повысить ранг пользователя
+
+        Только помечает данные для сохранения: вызывается под блокировкой
+        пользователя, запись на диск делает вызывающий код после нее.
+        """
+        if not self.ranks:
             return False
-        
-        user = self.users[username]
-        
+
+        with self._user_lock(username):
+            user = self.users.get(username)
+            if user is None:
+                return False
+            promoted = self._apply_rank(user)
+            self.users[username] = user
+            if promoted:
+                self._save_pending = True
+        return promoted
+
+    def _apply_rank(self, user):
+        """Set the highest rank the user qualifies for, True if it changed"""
         # Проверка на существование 'rank' в данных пользователя
         if 'rank' not in user:
             user['rank'] = ""
-            
-        rank_value = user['points'] if self.settings.get('rank_type') == 'Points' else user['hours']
-        
+
+        rank_value = user.get('points', 0) if self.settings.get('rank_type') == 'Points' else user.get('hours', 0)
+
         for rank in reversed(self.ranks):
             if rank_value >= rank['required']:
                 if user['rank'] != rank['name']:
                     user['rank'] = rank['name']
-                    self.save_users(force=True)
                     return True
                 break
-        
         return False
     
     def check_auto_regular(self, username):
@@ -562,41 +738,41 @@ class CurrencyManager:
             return False
         
         required = settings.get("auto_regular_amount", 50)
-        user = self.users.get(username)
-        
-        if user and user.get("points", 0) >= required:
-            # Если пользователь еще не Regular, выводим сообщение
-            if not user.get("is_regular", False):
-                print(f"User {username} became Regular (points: {user.get('points', 0)})")
-            user["is_regular"] = True
-            return True
-        
+        with self._user_lock(username):
+            user = self.users.get(username)
+
+            if user and user.get("points", 0) >= required:
+                # Если пользователь еще не Regular, выводим сообщение
+                if not user.get("is_regular", False):
+                    print(f"User {username} became Regular (points: {user.get('points', 0)})")
+                user["is_regular"] = True
+                self.users[username] = user
+                return True
+
         return False
     
-    def format_currency_message(self, username):
-        """Форматировать сообщение о валюте для пользователя"""
+    def response_values(self, username):
+        """Values of $username, $rank, $hours, $points and $currencyname for a response"""
         user = self.users.get(username)
         if not user:
-            return "Пользователь не найден"
-        rank = user.get('rank') or ("Regular" if user.get("is_regular") else "Unranked")        # Format points to always display with 2 decimal places
-        points = user.get('points', 0)
-        formatted_points = f"{float(points):.2f}"
-        
-        message = self.settings['response']
-        # Форматируем часы в формате "1h15m"
-        hours = user.get('hours', 0)
-        formatted_hours = self.format_hours(hours)
-        
-        replacements = {
-            '$username': username,
-            '$rank': rank,
-            '$hours': formatted_hours,
-            '$points': formatted_points,
-            '$currencyname': self.settings.get('name', 'Points')
+            return {'username': username, 'currencyname': self.settings.get('name', 'Points')}
+        rank = user.get('rank') or ("Regular" if user.get("is_regular") else "Unranked")
+        return {
+            'username': username,
+            'rank': rank,
+            # Часы в формате "1h15m", очки всегда с двумя знаками
+            'hours': self.format_hours(user.get('hours', 0)),
+            'points': f"{float(user.get('points', 0)):.2f}",
+            'currencyname': self.settings.get('name', 'Points'),
         }
-        for placeholder, value in replacements.items():
-            message = message.replace(placeholder, value)
-        return message
+
+    def format_currency_message(self, username):
+        """Форматировать сообщение о валюте для пользователя"""
+        if username not in self.users:
+            return "Пользователь не найден"
+        # Шаблон разбирается один раз при сохранении настроек, здесь только подстановка
+        template = compile_template(self.settings['response'])
+        return template.render(self.response_values(username))
     
     def process_command(self, username, command, args=None):
         """Обработать команду валюты"""
@@ -611,26 +787,104 @@ class CurrencyManager:
         return True
     
     def bulk_update_points(self, action, amount, filter_func=None):
-        """Массовое обновление очков для пользователей"""
+        """Массовое обновление очков для пользователей
+
+        filter_func may be a filter expression (see bulk_ops) or None, which
+        runs as one SQL update; a callable is checked user by user.
+        """
+        if filter_func is None or isinstance(filter_func, str):
+            return self.bulk_apply(action, amount, filter_func)['matched']
+
         updated_count = 0
-        
-        for username, data in self.users.items():
-            if filter_func is None or filter_func(username, data):
+        for username in list(self.users):
+            with self._user_lock(username):
+                data = self.users.get(username)
+                if data is None or not filter_func(username, data):
+                    continue
                 if action == "add":
                     data['points'] += amount
                 elif action == "set":
                     data['points'] = amount
                 elif action == "reset":
                     data['points'] = 0
-                
+
+                if self.ranks:
+                    self._apply_rank(data)
+                self.users[username] = data
                 updated_count += 1
-                self.check_rank_promotion(username)
         
         if updated_count > 0:
             self.save_users(force=True)
         
         return updated_count
+
+    def bulk_apply(self, action, amount=0, filter_expr=None, dry_run=False):
+        """Apply add/set/multiply/reset/decay to every user matching a filter expression
+
+        Runs as one transaction in the users index (see bulk_ops for the filter
+        language). users_currency.json is rewritten by the next save.
+
+        Returns:
+            dict: matched users, their total points before the change, dry_run flag
+        """
+        if dry_run:
+            return bulk_ops.apply(self._store, action, amount, filter_expr, dry_run=True)
+        # Блокируем всех пользователей: ни одна одиночная операция не должна перезаписать результат
+        with self._all_user_locks():
+            result = bulk_ops.apply(self._store, action, amount, filter_expr, ranks=self.ranks,
+                                    rank_type=self.settings.get('rank_type', 'Points'))
+            if result['matched']:
+                self._save_pending = True
+        return result
     
+    def archive_inactive(self, inactive_days=None, below_points=None, dry_run=False):
+        """Move long-inactive users with almost no points to the cold archive
+
+        Mods, regulars and subscribers are never archived. Archived users are
+        restored automatically the next time they are looked up (chat, payout,
+        !points), so nothing is lost; they just stop taking space in memory,
+        in users_currency.json and in every backup.
+
+        Args:
+            inactive_days: Days since last_seen (default: archive_after_days setting)
+            below_points: Balance limit (default: archive_below_points setting)
+            dry_run: Only count the users that would be archived
+
+        Returns:
+            dict: matched users (archived unless dry_run) and dry_run flag
+        """
+        inactive_days = self.settings.get('archive_after_days', 90) if inactive_days is None else inactive_days
+        below_points = self.settings.get('archive_below_points', 1) if below_points is None else below_points
+        expression = (f"last_seen > {float(inactive_days)}d and points < {float(below_points)} "
+                      f"and not is_mod and not is_regular and not is_subscriber")
+        where, params = bulk_ops.compile_filter(expression)
+        if dry_run:
+            return {'matched': self._store.count_where(where, params)['matched'], 'dry_run': True}
+
+        started = time.time()
+        with self._all_user_locks():
+            archived = self._store.archive_where(where, params, f"archive where {expression}")
+        self._store.set_meta('last_archive_run', started)
+        if archived:
+            self._save_pending = True
+            print(f"[CURRENCY ARCHIVE] Archived {archived} inactive users in {time.time() - started:.1f}s, "
+                  f"{len(self._store.archive)} in archive")
+        return {'matched': archived, 'dry_run': False}
+
+    def _archive_if_due(self, interval=24 * 3600):
+        """Run archive_inactive at most once per interval (called from the periodic save)"""
+        if not self.settings.get('archive_enabled', True) or self._store.archive is None:
+            return False
+        last_run = float(self._store.get_meta('last_archive_run', 0) or 0)
+        if time.time() - last_run < interval:
+            return False
+        try:
+            self.archive_inactive()
+            return True
+        except Exception as e:
+            print(f"[CURRENCY ARCHIVE] Error archiving inactive users: {e}")
+            return False
+
     def get_currency_name(self):
         """Получить название валюты"""
         return self.settings.get('currency_name', 'Points')
@@ -639,244 +893,236 @@ class CurrencyManager:
         """Получить команду для валюты"""
         return self.settings['command']
     
+    def reserve(self, username, cost):
+        """Hold `cost` points for a paid command
+
+        The points are taken in memory only; nothing is written until the
+        reservation is committed. Rolling it back returns exactly the held
+        amount.
+
+        Returns:
+            CurrencyReservation: The reservation, or None if the balance is too low
+        """
+        username = username.lower()
+        if username.startswith('@'):
+            username = username[1:]
+        cost = max(cost, 0)
+
+        paid, _ = self.try_debit(username, cost)
+        if not paid:
+            return None
+
+        with self._reservation_lock:
+            reservation = CurrencyReservation(self._next_reservation_id, username, cost)
+            self._next_reservation_id += 1
+            self._reservations[reservation.id] = reservation
+        return reservation
+
+    def _finish_reservation(self, reservation, state):
+        """Mark a pending reservation finished, False if it was already finished"""
+        with self._reservation_lock:
+            if self._reservations.pop(reservation.id, None) is None:
+                return False
+            reservation.state = state
+            return True
+
+    def commit(self, reservation):
+        """Make a reservation permanent with a single write of the user's row"""
+        if reservation is None or not self._finish_reservation(reservation, CurrencyReservation.COMMITTED):
+            return False
+        if reservation.amount <= 0:
+            return True
+        try:
+            with self._user_lock(reservation.username):
+                self._store.flush_keys([reservation.username])
+            return True
+        except Exception as e:
+            # Списание остается в памяти и попадет в следующее сохранение
+            print(f"[CURRENCY] Error committing reservation {reservation.id}: {e}")
+            return False
+
+    def rollback(self, reservation):
+        """Return the held points exactly, without bonuses and without a write"""
+        if reservation is None or not self._finish_reservation(reservation, CurrencyReservation.ROLLED_BACK):
+            return False
+        if reservation.amount <= 0:
+            return True
+        with self._user_lock(reservation.username):
+            user = self._get_or_create_user(reservation.username)
+            user['points'] = self._format_points(user['points'] + reservation.amount)
+            self.users[reservation.username] = user
+        return True
+
+    def pending_reservations(self):
+        """Reservations that were neither committed nor rolled back"""
+        with self._reservation_lock:
+            return list(self._reservations.values())
+
     def pay_for_command(self, username, cost):
         """Снять плату за команду с пользователя"""
         if cost <= 0:
             return True
-        
-        if username not in self.users:
-            self.add_user(username)
-        
-        if self.users[username]['points'] >= cost:
-            self.users[username]['points'] -= cost
-            self.save_users(force=True)
-            return True
-        
-        return False
+
+        # Резерв и фиксация сразу - одна запись строки пользователя
+        reservation = self.reserve(username, cost)
+        if reservation is None:
+            return False
+        self.commit(reservation)
+        return True
     
     def update_last_seen(self, username):
-        """Update last_seen timestamp for a user without adding points"""
+        """Update last_seen timestamp of a known user without adding points
+
+        Unknown users are not created; a record appears once they get points.
+        """
         username = username.lower()  # Нормализация имени
-        
-        # Загрузка пользовательских данных при необходимости
-        if not hasattr(self, 'users') or self.users is None:
-            self.users = self.get_all_users()
-        
-        if username not in self.users:            self.users[username] = {
-                'points': 0,
-                'hours': 0,
-                'last_seen': time.time()
-            }
-        else:
-            self.users[username]['last_seen'] = time.time()
+
+        with self._user_lock(username):
+            user = self.users.get(username)
+            if user is None:
+                return False
+            user['last_seen'] = time.time()
+            self.users[username] = user
+            return True
     
     def get_all_users(self):
         """Метод для совместимости с обращениями к get_all_users"""
         return self.users
     
-    def process_currency_update(self, is_live=False, active_viewers=None, all_viewers=None, chat_message_callback=None):
-        """Process currency update for viewers"""
-        # Проверяем, включено ли накопление валюты
-        if not self.settings.get('accumulation_enabled', True):
-            print(f"[{datetime.now().isoformat()}] Currency accumulation disabled - skipping update")
-            if chat_message_callback and self.settings.get('show_service_messages', False):
-                chat_message_callback("Currency accumulation disabled")
-            return False
-            
-        # Добавляем защиту от двойного начисления и вычисляем интервал начисления
-        current_time = time.time()
-        
-        # Если прошло менее 5 секунд с момента последнего обновления, пропускаем
-        if hasattr(self, 'last_update_time') and current_time - self.last_update_time < 5:
-            print(f"[{datetime.now().isoformat()}] Skipping currency update - too soon after previous update")
-            return
-        
-        # Рассчитываем время, прошедшее с последнего начисления в минутах
-        elapsed_minutes = 0
-        if hasattr(self, 'last_update_time'):
-            elapsed_minutes = (current_time - self.last_update_time) / 60
-        
-        self.last_update_time = current_time
-        
-        try:
-            if active_viewers is None:
-                active_viewers = []
-            if all_viewers is None:
-                all_viewers = []
+    def process_presence_update(self, presence, chat_message_callback=None, now=None, active_users=None):
+        """Pay out points and hours for the exact time every viewer was present
 
-            if not all_viewers:
-                print(f"[{datetime.now().isoformat()}] process_currency_update: no viewers → skip")
-                return False
+        Settles the seconds recorded by a PresenceTracker since its previous
+        checkpoint instead of crediting everybody in the current chatters list
+        for the whole period: live seconds at the live rate, offline seconds at
+        the offline rate. Amounts below 0.01 are carried over to the next
+        payout instead of being lost.
 
-            # Логируем начало
-            print(f"[{datetime.now().isoformat()}] process_currency_update: is_live={is_live}, "
-                  f"active={len(active_viewers)}, all={len(all_viewers)}")
-                  
-            # Получаем базовую сумму поинтов и интервал начисления
-            if is_live:
-                base_payout = self.settings.get('live_payout', 0)
-                interval_minutes = self.settings.get('online_interval', 5)
-            else:
-                base_payout = self.settings.get('offline_payout', 0)
-                interval_minutes = self.settings.get('offline_interval', 15)            # Проратируем награду в зависимости от времени с последнего обновления
-            # Формула: (Points per interval) * (elapsed minutes) / (interval minutes)
-            if elapsed_minutes > 0:
-                points_to_award = base_payout * elapsed_minutes / interval_minutes
-            else:
-                # Первый запуск, начисляем минимальную сумму
-                points_to_award = base_payout / (interval_minutes * 2)
-              # Округляем до двух знаков после запятой
-            points_to_award = round(points_to_award, 2)
-            
-            status_message = f"Points calculation: {base_payout:.2f} per {interval_minutes} min, elapsed: {elapsed_minutes:.2f} min, awarding {points_to_award:.2f} points"
-            print(f"[{datetime.now().isoformat()}] Proration: {base_payout} points per {interval_minutes} min interval, "                  f"elapsed: {elapsed_minutes:.2f} min, awarding {points_to_award:.2f} points")
-            
-            # Отправляем сообщение в чат, если есть callback и показ служебных сообщений включен
-            if chat_message_callback and self.settings.get('show_service_messages', False):
-                chat_message_callback(status_message)
-            
-            if points_to_award <= 0:
-                print(f"[{datetime.now().isoformat()}] no points to award → skip")
-                if chat_message_callback and self.settings.get('show_service_messages', False):
-                    chat_message_callback("No points to award, skipping update")
-                return False
+        Args:
+            presence: PresenceTracker of the channel
+            chat_message_callback: Receives a summary if service messages are on
+            now: Checkpoint time (default: now)
+            active_users: Recent chatters (ActivityTracker.active()), they get the active bonus
 
-            viewers_awarded = 0
-            for user in all_viewers:
-                uname = user.lower()
-                  # Базовые очки с точностью до сотых
-                pts = points_to_award
-                
-                # Бонус для регуляров
-                is_regular = self.users.get(uname, {}).get('is_regular', False)
-                regular_bonus = 0
-                if is_regular:
-                    # Проратируем и бонус регулярам
-                    regular_bonus_rate = self.settings.get('regular_bonus', 0)
-                    if elapsed_minutes > 0:
-                        regular_bonus = round(regular_bonus_rate * elapsed_minutes / interval_minutes, 2)
-                    else:
-                        regular_bonus = round(regular_bonus_rate / (interval_minutes * 2), 2)
-                
-                # Бонус для подписчиков
-                is_subscriber = self.users.get(uname, {}).get('is_subscriber', False)
-                sub_bonus = 0
-                if is_subscriber:
-                    sub_multiplier = self.settings.get('sub_bonus', 2)
-                    sub_bonus = round(pts * (sub_multiplier - 1), 2)  # Точность до сотых
-                
-                # Бонус для модераторов
-                is_mod = self.users.get(uname, {}).get('is_mod', False)
-                mod_bonus = 0
-                if is_mod:
-                    mod_bonus_base = self.settings.get('mod_bonus', 0)
-                    if elapsed_minutes > 0:
-                        mod_bonus = round(mod_bonus_base * elapsed_minutes / interval_minutes, 2)
-                    else:
-                        mod_bonus = round(mod_bonus_base / (interval_minutes * 2), 2)
-                
-                # Применяем все бонусы и округляем итоговую сумму до сотых
-                total = round(pts + regular_bonus + sub_bonus + mod_bonus, 2)
-                
-                # Для целочисленных значений не нужна проверка на минимум 0.1
-                
-                self.add_points(uname, total)
-                  # Обновляем часы просмотра (только если stream is live или offline_hours включены)
-                hours_added = 0
-                if is_live or self.settings.get('offline_hours', False):
-                    # Конвертируем elapsed_minutes в часы, с округлением до сотых (поминутная точность)
-                    hours_added = round(elapsed_minutes / 60, 2)
-                    # Если пользователя нет в системе, добавляем его
-                    if uname not in self.users:
-                        self.users[uname] = {'points': 0, 'hours': 0, 'last_seen': time.time()}
-                    # Добавляем часы пользователю
-                    self.users[uname]['hours'] += hours_added
-                
-                # Логирование начисления (с точностью до сотых)
-                bonus_str = f"(base {pts:.2f}"
-                if regular_bonus > 0:
-                    bonus_str += f" + regular bonus {regular_bonus:.2f}"
-                if sub_bonus > 0:
-                    bonus_str += f" + sub bonus {sub_bonus:.2f}"
-                if mod_bonus > 0:
-                    bonus_str += f" + mod bonus {mod_bonus:.2f}"
-                bonus_str += ")"                # Добавляем информацию о часах в лог только если они начислены
-                if hours_added > 0:
-                    # Форматируем добавленные часы в виде минут, так как обычно они будут маленькими
-                    minutes_added = round(hours_added * 60)
-                    hours_info = f", hours +{minutes_added}m"
-                else:
-                    hours_info = ""
-                print(f"[{datetime.now().isoformat()}] awarded {total:.2f} to {uname} {bonus_str} → new total {self.users[uname]['points']:.2f}{hours_info}")
-                
-                # Добавляем специальный лог для отслеживания часов
-                if hours_added > 0:
-                    total_hours_formatted = self.format_hours(self.users[uname]['hours'])
-                    print(f"[{datetime.now().isoformat()}] Hours tracking: {uname} +{minutes_added}m → new total {total_hours_formatted}")
-                viewers_awarded += 1
-            
-            # Use enhanced save with backup creation for major currency updates
-            if not self.enhanced_save_users(force_backup=True):
-                print(f"[{datetime.now().isoformat()}] [CURRENCY SAVE] Failed to save updated currency data")
-                if chat_message_callback and self.settings.get('show_service_messages', False):
-                    chat_message_callback("Warning: Failed to save currency changes")
-
-            summary_message = f"Points update completed: {viewers_awarded} users received points"
-            print(f"[{datetime.now().isoformat()}] process_currency_update: done, "
-                  f"{viewers_awarded} users processed")
-            # Отправляем итоговое сообщение в чат, если есть callback и показ служебных сообщений включен
-            if chat_message_callback and self.settings.get('show_service_messages', False):
-                chat_message_callback(summary_message)
+        Returns:
+            int: Number of viewers that received points or hours
+        """
+        seconds = presence.checkpoint(now)
+        if not self.settings.get('accumulation_enabled', True):
+            print(f"[{datetime.now().isoformat()}] Currency accumulation disabled - presence period dropped")
+            return 0
+        if not seconds:
+            return 0
 
-            return True
+        settings = self.settings
+        online_interval = max(float(settings.get('online_interval', 5) or 5), 0.01) * 60
+        offline_interval = max(float(settings.get('offline_interval', 15) or 15), 0.01) * 60
+        live_payout = float(settings.get('live_payout', 0) or 0)
+        offline_payout = float(settings.get('offline_payout', 0) or 0)
+        regular_bonus = float(settings.get('regular_bonus', 0) or 0)
+        mod_bonus = float(settings.get('mod_bonus', 0) or 0)
+        sub_multiplier = float(settings.get('sub_bonus', 2) or 0)  # Множитель базовой суммы для сабов
+        active_bonus = float(settings.get('active_bonus', 0) or 0)
+        offline_active_bonus = settings.get('offline_active_bonus', False)
+        active_users = active_users or ()
+        count_offline_hours = settings.get('offline_hours', False)
+        awarded = 0
+        total_points = 0.0
+        for uname, (live, offline) in seconds.items():
+            # Доля интервала начисления, проведенная в эфире и вне его
+            periods = live / online_interval + offline / offline_interval
+            base = live_payout * live / online_interval + offline_payout * offline / offline_interval
+            hours = (live + (offline if count_offline_hours else 0)) / 3600
+
+            with self._user_lock(uname):
+                user = self.users.get(uname)
+                points = base
+                if active_bonus and uname in active_users:
+                    # Бонус за активность в чате; вне эфира - только если включен
+                    points += active_bonus * (live / online_interval +
+                                              (offline / offline_interval if offline_active_bonus else 0))
+                if user is not None:
+                    if user.get('is_regular'):
+                        points += regular_bonus * periods
+                    if user.get('is_mod'):
+                        points += mod_bonus * periods
+                    if user.get('is_subscriber') and sub_multiplier > 1:
+                        points += base * (sub_multiplier - 1)
+                points += self._presence_carry.pop(uname, 0.0)
+                if points < 0.01:
+                    # Копейки не теряем - доплатим при следующем начислении
+                    if points > 0:
+                        self._presence_carry[uname] = points
+                    points = 0.0
+                if points <= 0 and hours <= 0:
+                    continue
+
+                if user is None:
+                    user = self._get_or_create_user(uname)
+                points = self._format_points(points)
+                user['points'] = self._format_points(user.get('points', 0) + points)
+                user['hours'] = round(user.get('hours', 0) + hours, 4)
+                user['last_seen'] = time.time()
+                self.users[uname] = user
+                self.check_auto_regular(uname)
+                if self.ranks:
+                    self._apply_rank(user)
+                total_points += points
+                awarded += 1
+
+        if awarded and not self.enhanced_save_users(force_backup=False):
+            print(f"[{datetime.now().isoformat()}] [CURRENCY SAVE] Failed to save presence payout")
+        summary = (f"Presence payout: {awarded} viewers, {total_points:.2f} points "
+                   f"for {sum(live + offline for live, offline in seconds.values()) / 3600:.2f} viewer-hours")
+        print(f"[{datetime.now().isoformat()}] {summary}")
+        if chat_message_callback and settings.get('show_service_messages', False):
+            chat_message_callback(summary)
+        return awarded
 
-        except Exception as e:
-            print(f"[{datetime.now().isoformat()}] Error in process_currency_update: {e}")
-            import traceback; traceback.print_exc()
-            return False
-    
     def get_currency_users(self):
         """Load currency users from file or return current users"""
-        try:
-            # Если users уже загружены, просто возвращаем их 
-            if hasattr(self, 'users') and self.users is not None:
-                return self.users
-                
-            # Если нет, загружаем из файла
-            if os.path.exists(self.users_file):
-                with open(self.users_file, 'r', encoding='utf-8') as f:
-                    self.users = json.load(f)
-                    return self.users
-            
-            # Если файла нет, возвращаем пустой словарь
-            self.users = {}
-            return self.users
-        except Exception as e:
-            print(f"Error loading currency users: {e}")
-            self.users = {}
-            return self.users
-    
+        return self.users
+
+    def export_columnar_snapshot(self, snapshot_path=None) -> int:
+        """Write all users into a compact columnar snapshot (see columnar_snapshot)"""
+        from columnar_snapshot import write_snapshot
+
+        snapshot_path = snapshot_path or self.data_dir / 'users_currency.snap'
+        with self._store.snapshot() as users:
+            count = write_snapshot(snapshot_path, users.items())
+        print(f"[CURRENCY SNAPSHOT] Exported {count} users to {snapshot_path}")
+        return count
+
+    def import_columnar_snapshot(self, snapshot_path) -> int:
+        """Replace all users with the content of a columnar snapshot"""
+        from columnar_snapshot import ColumnarSnapshot
+
+        with ColumnarSnapshot(snapshot_path) as snapshot:
+            # Записи строятся по одной прямо из отображенного файла
+            self._store.replace_all(snapshot)
+            count = len(snapshot)
+        self.save_users(force=True)
+        self._calculate_checksum()
+        print(f"[CURRENCY SNAPSHOT] Imported {count} users from {snapshot_path}")
+        return count
+
+    def snapshot_users(self):
+        """Consistent snapshot of all users for background export (see UserStore.snapshot)"""
+        return self._store.snapshot()
+
     def get_points(self, username):
         """Получить количество поинтов пользователя"""
         username = username.lower()
-        if username not in self.users:
-            self.users[username] = {
-                'points': 0,
-                'hours': 0,
-                'last_seen': time.time()
-            }
-        return self.users[username]['points']
+        # Чтение не создает запись для незнакомых пользователей
+        with self._user_lock(username):
+            user = self.users.get(username)
+            return user.get('points', 0) if user else 0
         
     def get_hours(self, username):
         """Получить количество часов пользователя"""
         username = username.lower()
-        if username not in self.users:
-            self.users[username] = {
-                'points': 0,
-                'hours': 0,
-                'last_seen': time.time()
-            }
-        return self.users[username].get('hours', 0)
+        user = self.users.get(username)
+        return user.get('hours', 0) if user else 0
         
     def get_rank(self, username):
         """Получить ранг пользователя"""
@@ -935,6 +1181,8 @@ class CurrencyManager:
             if not force and current_time - self.last_backup_time < 1800:  # 30 minutes
                 return True
 
+            # Бэкап - копия JSON, поэтому сначала выгружаем в него текущий индекс
+            self.export_users_json()
             if not os.path.exists(self.users_file):
                 print("[CURRENCY BACKUP] No currency file to backup")
                 return True
@@ -947,18 +1195,19 @@ class CurrencyManager:
             # Copy the current file
             shutil.copy2(self.users_file, backup_path)
 
-            # Add metadata
+            # Add metadata (checksum of the exported file, used to verify restores)
             metadata = {
                 'backup_time': current_time,
                 'original_file': str(self.users_file),
-                'user_count': len(self.users),
-                'total_points': sum(user.get('points', 0) for user in self.users.values()),
-                'total_hours': sum(user.get('hours', 0) for user in self.users.values())
+                'checksum': self._store.get_meta('json_digest')
             }
+            metadata.update(self._store.totals())
 
             metadata_file = backup_path.with_suffix('.json.meta')
             with open(metadata_file, 'w', encoding='utf-8') as f:
                 json.dump(metadata, f, indent=2)
+            self.backup_catalog.add(KIND_CURRENCY, backup_path, current_time,
+                                    backup_path.stat().st_size, metadata)
 
             self.last_backup_time = current_time
 
@@ -975,70 +1224,75 @@ class CurrencyManager:
             return False
 
     def _cleanup_old_backups(self):
-        """Remove old backups keeping only the most recent ones"""
+        """Thin out old backups according to the retention tiers"""
         try:
-            backup_files = list(self.backup_dir.glob("users_currency_*.json"))
-
-            if len(backup_files) <= self.max_currency_backups:
-                return
-
-            # Sort by modification time (newest first)
-            backup_files.sort(key=lambda x: x.stat().st_mtime, reverse=True)
+            policy = RetentionPolicy.from_settings(self.retention_settings, max_recent=self.max_currency_backups)
+            policy.apply(self.backup_catalog, KIND_CURRENCY, self._delete_backups)
+        except Exception as e:
+            print(f"[CURRENCY BACKUP] Error during cleanup: {e}")
 
-            # Remove old backups
-            for old_backup in backup_files[self.max_currency_backups:]:
+    def _delete_backups(self, paths):
+        """Delete backup files with their metadata and drop them from the catalog"""
+        try:
+            removed = []
+            for old_backup in map(Path, paths):
                 try:
-                    old_backup.unlink()
+                    if old_backup.exists():
+                        old_backup.unlink()
                     # Also remove metadata file if it exists
                     meta_file = old_backup.with_suffix('.json.meta')
                     if meta_file.exists():
                         meta_file.unlink()
+                    removed.append(old_backup)
                 except Exception as e:
                     print(f"[CURRENCY BACKUP] Error removing old backup {old_backup}: {e}")
+            self.backup_catalog.remove(removed)
 
         except Exception as e:
             print(f"[CURRENCY BACKUP] Error during cleanup: {e}")
 
+    def _scan_backups(self):
+        """Catalog entries for currency backups already on disk"""
+        for backup_file in self.backup_dir.glob("users_currency_*.json"):
+            try:
+                metadata = {}
+                metadata_file = backup_file.with_suffix('.json.meta')
+                if metadata_file.exists():
+                    with open(metadata_file, 'r', encoding='utf-8') as f:
+                        metadata = json.load(f)
+                stat = backup_file.stat()
+                yield backup_file, metadata.get('backup_time', stat.st_mtime), stat.st_size, metadata
+            except Exception as e:
+                print(f"[CURRENCY BACKUP] Error reading backup metadata {backup_file}: {e}")
+
     def get_available_backups(self) -> List[Dict[str, Any]]:
         """Get list of available currency backups"""
         try:
             backups = []
-            backup_files = list(self.backup_dir.glob("users_currency_*.json"))
-
-            for backup_file in sorted(backup_files, key=lambda x: x.stat().st_mtime, reverse=True):
-                try:
-                    metadata_file = backup_file.with_suffix('.json.meta')
-                    metadata = {}
-
-                    if metadata_file.exists():
-                        with open(metadata_file, 'r', encoding='utf-8') as f:
-                            metadata = json.load(f)
-
-                    # Get file size
-                    size_bytes = backup_file.stat().st_size
-
-                    # Human readable size
-                    if size_bytes < 1024:
-                        size_str = f"{size_bytes} B"
-                    elif size_bytes < 1024 * 1024:
-                        size_str = f"{size_bytes / 1024:.1f} KB"
-                    else:
-                        size_str = f"{size_bytes / (1024 * 1024):.1f} MB"
-
-                    backups.append({
-                        'path': backup_file,
-                        'filename': backup_file.name,
-                        'timestamp': metadata.get('backup_time', backup_file.stat().st_mtime),
-                        'readable_time': datetime.fromtimestamp(metadata.get('backup_time', backup_file.stat().st_mtime)).strftime("%Y-%m-%d %H:%M:%S"),
-                        'size': size_bytes,
-                        'size_str': size_str,
-                        'user_count': metadata.get('user_count', 'Unknown'),
-                        'total_points': metadata.get('total_points', 'Unknown'),
-                        'total_hours': metadata.get('total_hours', 'Unknown')
-                    })
-
-                except Exception as e:
-                    print(f"[CURRENCY BACKUP] Error reading backup metadata {backup_file}: {e}")
+            for entry in self.backup_catalog.list(KIND_CURRENCY):
+                backup_file = Path(entry['path'])
+                metadata = entry['meta']
+                size_bytes = entry['size']
+
+                # Human readable size
+                if size_bytes < 1024:
+                    size_str = f"{size_bytes} B"
+                elif size_bytes < 1024 * 1024:
+                    size_str = f"{size_bytes / 1024:.1f} KB"
+                else:
+                    size_str = f"{size_bytes / (1024 * 1024):.1f} MB"
+
+                backups.append({
+                    'path': backup_file,
+                    'filename': backup_file.name,
+                    'timestamp': entry['created'],
+                    'readable_time': datetime.fromtimestamp(entry['created']).strftime("%Y-%m-%d %H:%M:%S"),
+                    'size': size_bytes,
+                    'size_str': size_str,
+                    'user_count': metadata.get('user_count', 'Unknown'),
+                    'total_points': metadata.get('total_points', 'Unknown'),
+                    'total_hours': metadata.get('total_hours', 'Unknown')
+                })
 
             return backups
 
@@ -1070,6 +1324,19 @@ class CurrencyManager:
             # Update checksum
             self._calculate_checksum()
 
+            # Сверяем с контрольной суммой, записанной при создании бэкапа
+            entry = self.backup_catalog.get(backup_path)
+            expected = entry['meta'].get('checksum') if entry else None
+            if expected and expected != self.data_checksum:
+                print(f"[CURRENCY BACKUP] Checksum mismatch after restoring {backup_path}: "
+                      f"expected {expected}, got {self.data_checksum}")
+                if os.path.exists(emergency_backup_path):
+                    shutil.copy2(emergency_backup_path, self.users_file)
+                    self.load_data()
+                    self._calculate_checksum()
+                    print("[CURRENCY BACKUP] Previous data restored")
+                return False
+
             print(f"[CURRENCY BACKUP] Successfully restored from backup: {backup_path}")
             return True
 
@@ -1156,25 +1423,35 @@ class CurrencyManager:
             }
 
     def _calculate_checksum(self) -> str:
-        """Calculate checksum of current data for integrity verification"""
+        """Calculate checksum of current data for integrity verification
+
+        The user store keeps an XOR-of-hashes digest that is updated per changed
+        user on flush, so this does not serialize the whole user set.
+        """
         try:
-            data_str = json.dumps(self.users, sort_keys=True, separators=(',', ':'))
-            checksum = hashlib.md5(data_str.encode('utf-8')).hexdigest()
+            checksum = self._store.digest()
             self.data_checksum = checksum
             return checksum
         except Exception as e:
             print(f"[CURRENCY CHECKSUM] Error calculating checksum: {e}")
             return ""
 
-    def enhanced_save_users(self, force_backup: bool = False) -> bool:
-        """Enhanced save method with automatic backups and retry logic"""
+    def enhanced_save_users(self, force_backup: bool = False, export: bool = False) -> bool:
+        """Enhanced save method with automatic backups and retry logic
+
+        export=True also rewrites users_currency.json (on shutdown).
+        """
         max_retries = 3
         retry_delay = 0.5
 
         for attempt in range(max_retries):
             try:
+                # Раз в сутки неактивные пользователи уходят в архив до записи JSON
+                if attempt == 0:
+                    self._archive_if_due()
+
                 # Try to save normally first with force flag to bypass pending check
-                success = self.save_users(force=True)
+                success = self.save_users(force=True, export=export)
 
                 if success:
                     # Create backup if needed
@@ -1211,9 +1488,11 @@ class CurrencyManager:
             # Try to import config_manager here to avoid circular imports
             from config_manager import ConfigManager
 
-            config_manager = ConfigManager()
+            config_manager = self.config_manager or ConfigManager.instance()
             self.max_currency_backups = config_manager.get_max_currency_backups()
+            self.retention_settings = config_manager.get_retention_settings()
             print(f"[CURRENCY BACKUP] Loaded max backups: {self.max_currency_backups}")
         except Exception as e:
             print(f"[CURRENCY BACKUP] Error loading backup settings: {e}")
             self.max_currency_backups = 10  # Fallback default
+            self.retention_settings = {}
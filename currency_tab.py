@@ -5,6 +5,7 @@ from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
                            QGroupBox, QSlider, QScrollArea, QSizePolicy, QGridLayout, QMessageBox)
 from PyQt5.QtCore import Qt, QTimer
 from currency_manager import CurrencyManager
+from retention_policy import RETENTION_TOOLTIP
 
 class CurrencyTab(QWidget):
     def __init__(self, parent=None):
@@ -394,6 +395,7 @@ class CurrencyTab(QWidget):
         max_backups_label = QLabel("Maximum Backups:")
         self.max_currency_backups_spin = QSpinBox()
         self.max_currency_backups_spin.setMinimum(1)
+        self.max_currency_backups_spin.setToolTip(RETENTION_TOOLTIP)
         self.max_currency_backups_spin.setMaximum(100)
         self.max_currency_backups_spin.setValue(self.currency_manager.max_currency_backups)
         self.max_currency_backups_spin.valueChanged.connect(self.update_max_currency_backups)
@@ -0,0 +1,440 @@
+"""
+Headless bot daemon.
+
+Runs the Twitch bot, currency payouts, auto-saves and backups without Qt or a
+display. Scheduling is plain asyncio on the bot's own event loop; blocking
+Helix requests and disk writes run in the default executor so chat handling
+is never held up. Sound is off unless --sound is given.
+
+A small HTTP control API listens on localhost (see "daemon" in config.json):
+
+    GET  /status                  bot, stream and store status
+    GET  /stats                   chat throughput counters
+    GET  /users/<name>            points, hours and rank of a user
+    POST /users/<name>/points     {"amount": 10} adds, {"amount": -10} removes points
+    POST /bulk                    {"filter": "hours > 10", "action": "add", "amount": 50,
+                                   "dry_run": true} bulk points change, see bulk_ops
+    POST /save                    save currency users now
+    POST /backup                  write a comprehensive backup now
+    POST /reload                  reload commands.json
+    POST /stop                    save and shut down
+
+If "api_token" is set, requests need "Authorization: Bearer <token>".
+Run with: python daemon.py [--channel name] [--port 8765] [--sound]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from backup_catalog import BackupCatalog, KIND_COMPREHENSIVE
+from backup_writer import ComprehensiveBackupWriter, meta_path, scan_backups
+from config_manager import ConfigManager
+from currency_manager import CurrencyManager
+from multi_channel import load_commands_file
+from retention_policy import RetentionPolicy
+
+VIEWER_UPDATE_INTERVAL = 30   # Как viewer_update_frequency во вкладке Twitch, секунд
+PAYOUT_INTERVAL = 300         # Начисление за присутствие, секунд
+MODERATORS_INTERVAL = 600     # Обновление списка модераторов, секунд
+COMMANDS_CHECK_INTERVAL = 5   # Проверка изменений commands.json, секунд
+
+
+class BotDaemon:
+    """Bot, payouts, saves and backups on one asyncio loop"""
+
+    def __init__(self, config_manager=None, channel=None, commands_file='commands.json',
+                 host=None, port=None, api_token=None, sound=False):
+        self.config_manager = config_manager or ConfigManager.instance()
+        settings = self.config_manager.get_daemon_settings()
+        self.channel = (channel or self.config_manager.get_twitch_config().get('channel', '')).lower()
+        self.commands_file = Path(commands_file)
+        self.host = host or settings['host']
+        self.port = int(port or settings['port'])
+        self.api_token = api_token if api_token is not None else settings.get('api_token', '')
+        self.sound = sound
+
+        self.currency_manager = None
+        self.bot = None
+        self.loop = None
+        self.started = time.time()
+        self._commands_mtime = None
+        self._tasks = []
+        self._http = None
+        self._backup_lock = threading.Lock()
+        # Бэкапы и их каталог - в каталоге программы, как у ConfigManager и CurrencyManager
+        self.backup_dir = self.config_manager.backup_dir / "comprehensive"
+        self.backup_catalog = None
+
+    # --- Запуск и остановка ---
+
+    def _create_bot(self):
+        from twitch_bot import TwitchBot
+
+        sound_channel = None
+        if self.sound:
+            try:
+                import pygame
+                pygame.mixer.init()
+                sound_channel = pygame.mixer.Channel(1)
+            except Exception as e:
+                print(f"[DAEMON] Sound is not available: {e}")
+
+        self.currency_manager = CurrencyManager()
+        self.bot = TwitchBot(self.channel, message_callback=self._on_message,
+                             commands_data=self._load_commands(), sound_channel=sound_channel,
+                             config_manager=self.config_manager, currency_manager=self.currency_manager)
+        self.bot.register_commands()
+
+    def _on_message(self, text):
+        print(f"[CHAT] {text}")
+
+    def run(self):
+        """Connect and block until stopped (Ctrl+C, SIGTERM or POST /stop)"""
+        if not self.channel:
+            print("[DAEMON] No channel configured, use --channel or set it in the GUI once")
+            return 1
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._create_bot()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, self.request_stop)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows: остается KeyboardInterrupt
+        self._start_control_api()
+        try:
+            self.loop.run_until_complete(self._main())
+        except KeyboardInterrupt:
+            print("[DAEMON] Interrupted")
+        finally:
+            self._shutdown()
+        return 0
+
+    async def _main(self):
+        self._tasks = [asyncio.ensure_future(task) for task in (
+            self._viewers_loop(), self._payout_loop(), self._moderators_loop(),
+            self._currency_save_loop(), self._system_backup_loop(), self._commands_watch_loop())]
+        try:
+            await self.bot.start()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+    def request_stop(self):
+        """Stop the daemon (safe to call from any thread)"""
+        def _stop():
+            self.bot.is_running = False
+            asyncio.ensure_future(self.bot.close())
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(_stop)
+
+    def _shutdown(self):
+        print("[DAEMON] Shutting down...")
+        if self._http:
+            self._http.shutdown()
+        try:
+            # Досчитываем присутствие с последнего начисления
+            self._payout()
+            self.currency_manager.save_users(force=True, export=True)
+        except Exception as e:
+            print(f"[DAEMON] Error saving currency on exit: {e}")
+        print("[DAEMON] Stopped")
+
+    # --- Периодические задачи ---
+
+    async def _every(self, interval, job, first_delay=0):
+        """Run a blocking job in the executor every `interval` seconds"""
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(first_delay)
+        while True:
+            try:
+                await loop.run_in_executor(None, job)
+            except Exception as e:
+                print(f"[DAEMON] Error in {getattr(job, '__name__', job)}: {e}")
+            await asyncio.sleep(interval)
+
+    def _update_viewers(self):
+        """Stream status and chatters; joins and leaves go to the presence tracker"""
+        bot = self.bot
+        status = bot.fetch_live_status([bot.broadcaster_id])
+        if bot.broadcaster_id in status:
+            bot.is_live = status[bot.broadcaster_id]
+        viewers = bot.fetch_chatters(bot.broadcaster_id, bot.moderator_id)
+        if viewers:
+            bot.primary_context.update_viewers(viewers)
+        else:
+            bot.all_viewers = list(bot.active_users)
+
+    def _payout(self):
+        """Points and hours for the presence recorded since the last payout"""
+        self.currency_manager.process_presence_update(
+            self.bot.presence, chat_message_callback=lambda message: print(f"[POINTS] {message}"),
+            active_users=self.bot.active_users)
+
+    async def _viewers_loop(self):
+        await self._every(VIEWER_UPDATE_INTERVAL, self._update_viewers, first_delay=5)
+
+    async def _payout_loop(self):
+        await self._every(PAYOUT_INTERVAL, self._payout, first_delay=PAYOUT_INTERVAL)
+
+    async def _moderators_loop(self):
+        while True:
+            await asyncio.sleep(MODERATORS_INTERVAL)
+            try:
+                await self.bot.get_channel_moderators()
+            except Exception as e:
+                print(f"[DAEMON] Error updating moderators: {e}")
+
+    async def _currency_save_loop(self):
+        settings = self.config_manager.get_currency_auto_save()
+        if not settings.get('enabled', True):
+            return
+        await self._every(settings.get('interval', 300), self.save_currency,
+                          first_delay=settings.get('interval', 300))
+
+    async def _system_backup_loop(self):
+        settings = self.config_manager.get_system_auto_backup()
+        if not settings.get('enabled', False):
+            return
+        await self._every(settings.get('interval', 3600), self.create_backup,
+                          first_delay=settings.get('interval', 3600))
+
+    async def _commands_watch_loop(self):
+        while True:
+            await asyncio.sleep(COMMANDS_CHECK_INTERVAL)
+            if self._commands_changed():
+                self.reload_commands()
+
+    # --- Действия (вызываются и из control API) ---
+
+    def _load_commands(self):
+        self._commands_mtime = self._mtime()
+        return load_commands_file(self.commands_file)
+
+    def _mtime(self):
+        try:
+            return os.path.getmtime(self.commands_file)
+        except OSError:
+            return None
+
+    def _commands_changed(self):
+        return self._mtime() != self._commands_mtime
+
+    def reload_commands(self):
+        """Re-read commands.json (edited in the GUI on another machine or by hand)"""
+        commands = self._load_commands()
+        self.bot.update_commands(commands)
+        print(f"[DAEMON] Loaded {len(commands)} commands from {self.commands_file}")
+        return len(commands)
+
+    def save_currency(self):
+        """Save currency users, with a currency backup when one is due"""
+        return self.currency_manager.enhanced_save_users(force_backup=False)
+
+    def create_backup(self):
+        """Write a comprehensive backup and prune old ones (blocking)"""
+        if not self._backup_lock.acquire(blocking=False):
+            print("[DAEMON] Backup is already being written, skipping")
+            return None
+        try:
+            if self.backup_catalog is None:
+                self.backup_catalog = BackupCatalog.open(self.config_manager.backup_dir / "backup_catalog.db")
+                self.backup_catalog.ensure_indexed(KIND_COMPREHENSIVE, lambda: scan_backups(self.backup_dir))
+            cm = self.currency_manager
+            sections = {
+                "commands": json.loads(json.dumps(self.bot.commands)),
+                "moderators": {
+                    "manual": list(self.config_manager.get_manual_moderators()),
+                    "excluded": list(self.config_manager.get_excluded_moderators())
+                },
+                "config": json.loads(json.dumps({
+                    "volume": self.config_manager.get_volume(),
+                    "sound_interruption": self.config_manager.get_sound_interruption(),
+                    "interruption_message": self.config_manager.get_interruption_message(),
+                    "auto_save": self.config_manager.get_auto_save(),
+                    "max_backups": self.config_manager.get_max_backups(),
+                    "twitch_config": self.config_manager.get_twitch_config()
+                })),
+                "ranks": json.loads(json.dumps(cm.ranks)),
+                "command_history": {},
+                "currency_settings": json.loads(json.dumps({
+                    "settings": cm.settings,
+                    "backup_dir": str(cm.backup_dir),
+                    "max_backups": getattr(cm, 'max_currency_backups', 10)
+                }))
+            }
+            path = ComprehensiveBackupWriter(self.backup_dir, sections, users_snapshot=cm.snapshot_users(),
+                                             catalog=self.backup_catalog).write()
+            print(f"[DAEMON] Comprehensive backup written: {path}")
+            policy = RetentionPolicy.from_settings(self.config_manager.get_retention_settings(),
+                                                   max_recent=self.config_manager.get_max_comprehensive_backups())
+            policy.apply(self.backup_catalog, KIND_COMPREHENSIVE, self._delete_backups)
+            return str(path)
+        finally:
+            self._backup_lock.release()
+
+    def _delete_backups(self, paths):
+        removed = []
+        for path in map(Path, paths):
+            try:
+                if path.exists():
+                    path.unlink()
+                if meta_path(path).exists():
+                    meta_path(path).unlink()
+                removed.append(path)
+            except Exception as e:
+                print(f"[DAEMON] Error removing old backup {path}: {e}")
+        self.backup_catalog.remove(removed)
+
+    def status(self):
+        bot = self.bot
+        return {
+            "channel": self.channel,
+            "connected": bool(bot and len(bot.connected_channels) > 0),
+            "is_live": bool(bot and bot.is_live),
+            "uptime": round(time.time() - self.started),
+            "commands": len(bot.commands) if bot else 0,
+            "viewers": len(bot.all_viewers) if bot else 0,
+            "active_chatters": len(bot.active_users) if bot else 0,
+            "users_in_memory": self.currency_manager._store.hot_count if self.currency_manager else 0,
+            "users_archived": len(self.currency_manager._store.archive or ()) if self.currency_manager else 0,
+            "connection_health": bot.connection_metrics() if bot else None,
+        }
+
+    def stats(self):
+        stats = self.bot.primary_context.stats.snapshot()
+        stats['send_queue'] = self.bot.send_queue.metrics()
+        return stats
+
+    def user_info(self, username):
+        cm = self.currency_manager
+        username = username.lower().lstrip('@')
+        if username not in cm.users:
+            return None
+        return {"username": username, "points": cm.get_points(username),
+                "hours": cm.get_hours(username), "rank": cm.get_rank(username)}
+
+    def adjust_points(self, username, amount):
+        """Add (amount > 0) or remove (amount < 0) points, ValueError if the change is rejected"""
+        cm = self.currency_manager
+        username = username.lower().lstrip('@')
+        amount = cm._parse_amount(amount)
+        operation = "add" if amount >= 0 else "remove"
+        if operation == "remove" and username not in cm.users:
+            return None
+        # Те же проверки, что в add_points/remove_points, но с ошибкой вместо молчаливого отказа
+        is_valid, error_msg = cm._validate_points_operation(username, abs(amount), operation)
+        if not is_valid:
+            raise ValueError(error_msg)
+        if operation == "add":
+            cm.add_points(username, amount)
+        else:
+            cm.remove_points(username, -amount)
+        return self.user_info(username)
+
+    # --- Control API ---
+
+    def _start_control_api(self):
+        try:
+            self._http = ThreadingHTTPServer((self.host, self.port), _ControlHandler)
+        except OSError as e:
+            print(f"[DAEMON] Control API disabled, cannot listen on {self.host}:{self.port}: {e}")
+            return
+        self._http.daemon_ref = self
+        self._http.daemon_threads = True
+        threading.Thread(target=self._http.serve_forever, name="daemon-control-api", daemon=True).start()
+        print(f"[DAEMON] Control API on http://{self.host}:{self.port}")
+
+
+class _ControlHandler(BaseHTTPRequestHandler):
+    """Local JSON control API of the daemon"""
+
+    def log_message(self, format, *args):
+        pass  # Без access-лога в stdout
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        token = self.server.daemon_ref.api_token
+        return not token or self.headers.get("Authorization", "") == f"Bearer {token}"
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def _route(self, method):
+        if not self._authorized():
+            return self._reply(401, {"error": "unauthorized"})
+        daemon = self.server.daemon_ref
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        try:
+            if method == "GET" and parts == ["status"]:
+                return self._reply(200, daemon.status())
+            if method == "GET" and parts == ["stats"]:
+                return self._reply(200, daemon.stats())
+            if method == "GET" and len(parts) == 2 and parts[0] == "users":
+                info = daemon.user_info(parts[1])
+                return self._reply(200, info) if info else self._reply(404, {"error": "user not found"})
+            if method == "POST" and len(parts) == 3 and parts[0] == "users" and parts[2] == "points":
+                info = daemon.adjust_points(parts[1], self._body().get("amount", 0))
+                return self._reply(200, info) if info else self._reply(404, {"error": "user not found"})
+            if method == "POST" and parts == ["bulk"]:
+                body = self._body()
+                return self._reply(200, daemon.currency_manager.bulk_apply(
+                    body.get("action", ""), body.get("amount", 0), body.get("filter"),
+                    dry_run=bool(body.get("dry_run", False))))
+            if method == "POST" and parts == ["save"]:
+                return self._reply(200, {"saved": bool(daemon.save_currency())})
+            if method == "POST" and parts == ["backup"]:
+                return self._reply(200, {"path": daemon.create_backup()})
+            if method == "POST" and parts == ["reload"]:
+                return self._reply(200, {"commands": daemon.reload_commands()})
+            if method == "POST" and parts == ["stop"]:
+                daemon.request_stop()
+                return self._reply(200, {"stopping": True})
+            return self._reply(404, {"error": "unknown endpoint"})
+        except (ValueError, TypeError) as e:
+            return self._reply(400, {"error": str(e)})
+        except Exception as e:
+            print(f"[DAEMON] Control API error: {e}")
+            return self._reply(500, {"error": str(e)})
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the bot without the GUI")
+    parser.add_argument("--channel", help="Channel to join (default: the one saved in config.json)")
+    parser.add_argument("--commands", default="commands.json", help="Commands file")
+    parser.add_argument("--host", help="Control API address (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, help="Control API port (default 8765)")
+    parser.add_argument("--sound", action="store_true", help="Play command sounds through pygame")
+    args = parser.parse_args(argv)
+    return BotDaemon(channel=args.channel, commands_file=args.commands, host=args.host,
+                     port=args.port, sound=args.sound).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,82 +1,273 @@
 import json
 import os
 import time
+import hashlib
 from datetime import datetime
 import shutil
 
+from command_diff import diff_commands, apply_diff, summarize_diff
+from backup_catalog import BackupCatalog, DEFAULT_CATALOG_PATH, KIND_HISTORY
+from retention_policy import RetentionPolicy
+
 class HistoryManager:
-    def __init__(self, max_backups=100):
+    def __init__(self, max_backups=100, keyframe_interval=20, retention=None, base_dir=None):
         """Initialize History Manager
-        
+
+        Every version is a small manifest in manifests/. Keyframes list the
+        hashes of all commands, which are stored once as content-addressed
+        blobs (objects/). The versions in between are deltas that only record
+        added, removed and changed commands relative to the previous version.
+        Old full-copy backups (commands_*.json in the history folder) are still
+        listed and restorable.
+
         Args:
-            max_backups (int): Maximum number of backup files to keep
+            max_backups (int): Maximum number of versions kept from the last hour
+            keyframe_interval (int): Write a full keyframe every N versions
+            retention (dict): Tiered retention settings, see retention_policy
+            base_dir: Program directory with command_history/ and backups/backup_catalog.db
+                (None - the current directory)
         """
         self.max_backups = max_backups
-        self.history_folder = "command_history"
-        
-        # Create history folder if it doesn't exist
-        if not os.path.exists(self.history_folder):
-            os.makedirs(self.history_folder)
-    
+        self.retention = retention or {}
+        self.keyframe_interval = keyframe_interval
+        self.history_folder = os.path.join(base_dir, "command_history") if base_dir else "command_history"
+        self.backup_dir = self.history_folder
+        self.objects_folder = os.path.join(self.history_folder, "objects")
+        self.manifests_folder = os.path.join(self.history_folder, "manifests")
+
+        # Create history folders if they don't exist
+        for folder in (self.history_folder, self.objects_folder, self.manifests_folder):
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+
+        # Latest version (manifest filename, snapshot hash, chain length, commands)
+        self._latest = None
+
+        # Listing and cleanup go through the backup catalog instead of reading every manifest
+        self.catalog = BackupCatalog.open(os.path.join(base_dir, DEFAULT_CATALOG_PATH) if base_dir
+                                          else DEFAULT_CATALOG_PATH)
+        self.catalog.ensure_indexed(KIND_HISTORY, self._scan_backups)
+
+    def _hash_command(self, command):
+        """Return (hash, text) for a single command"""
+        canonical = json.dumps(command, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        digest = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+        return digest, json.dumps(command, ensure_ascii=False)
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_folder, digest[:2], f"{digest}.json")
+
+    def _read_manifest(self, manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _manifest_names(self):
+        """Manifest filenames in chronological order"""
+        return sorted(f for f in os.listdir(self.manifests_folder)
+                      if f.startswith("commands_") and f.endswith(".json"))
+
+    def _latest_version(self):
+        """Get the newest version: (filename, snapshot, chain length, commands)"""
+        if self._latest is None:
+            names = self._manifest_names()
+            if names:
+                try:
+                    manifest = self._read_manifest(os.path.join(self.manifests_folder, names[-1]))
+                    commands = self._materialize(names[-1])
+                    self._latest = (names[-1], manifest.get("snapshot"), manifest.get("chain", 0), commands)
+                except Exception as e:
+                    print(f"Error reading latest manifest: {e}")
+        return self._latest
+
+    def _materialize(self, name):
+        """Rebuild the command list of a version by replaying deltas from the nearest keyframe"""
+        deltas = []
+        manifest = self._read_manifest(os.path.join(self.manifests_folder, name))
+        while manifest.get("type") == "delta":
+            deltas.append(manifest["diff"])
+            manifest = self._read_manifest(os.path.join(self.manifests_folder, manifest["parent"]))
+
+        commands = []
+        for digest in manifest.get("commands", []):
+            with open(self._object_path(digest), 'r', encoding='utf-8') as f:
+                commands.append(json.load(f))
+        for diff in reversed(deltas):
+            commands = apply_diff(commands, diff)
+        return commands
+
+    def _write_manifest(self, name, manifest):
+        path = os.path.join(self.manifests_folder, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        self.catalog.add(KIND_HISTORY, path, manifest.get("created") or os.path.getmtime(path),
+                         manifest.get("size", 0), self._catalog_meta(manifest))
+
+    def _catalog_meta(self, manifest):
+        return {
+            "count": manifest.get("count", 0),
+            "type": manifest.get("type", "keyframe"),
+            "summary": manifest.get("summary", "")
+        }
+
+    def _keyframe_manifest(self, commands, created, snapshot, summary=""):
+        """Store command blobs and build a keyframe manifest"""
+        hashes = []
+        size = 0
+        for command in commands:
+            digest, text = self._hash_command(command)
+            hashes.append(digest)
+            size += len(text.encode('utf-8'))
+
+            object_path = self._object_path(digest)
+            if not os.path.exists(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                with open(object_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+
+        return {
+            "format": 3,
+            "type": "keyframe",
+            "created": created,
+            "snapshot": snapshot,
+            "count": len(hashes),
+            "size": size,
+            "chain": 0,
+            "summary": summary,
+            "commands": hashes
+        }
+
     def save_backup(self, commands):
         """Save a backup of the current commands
-        
+
+        A snapshot identical to the latest one is not stored at all; otherwise
+        only the difference to the previous version is written, with a full
+        keyframe every keyframe_interval versions.
+
         Args:
             commands (list): The commands to backup
         """
-        # Generate timestamp for the filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_file = os.path.join(self.history_folder, f"commands_{timestamp}.json")
-        
-        # Save the backup
         try:
-            with open(backup_file, 'w', encoding='utf-8') as f:
-                json.dump(commands, f, indent=4, ensure_ascii=False)
-            
+            hashes = [self._hash_command(command)[0] for command in commands]
+            snapshot = hashlib.sha256("\n".join(hashes).encode('utf-8')).hexdigest()
+
+            latest = self._latest_version()
+            if latest and snapshot == latest[1]:
+                print("[HISTORY] Commands unchanged since the last backup, snapshot reused")
+                return True
+
+            # Generate timestamp for the filename
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            name = f"commands_{timestamp}.json"
+            suffix = 1
+            # Имена должны сортироваться хронологически, даже при нескольких сохранениях в секунду
+            while os.path.exists(os.path.join(self.manifests_folder, name)) or (latest and name <= latest[0]):
+                name = f"commands_{timestamp}_{suffix:03d}.json"
+                suffix += 1
+
+            commands = json.loads(json.dumps(commands))  # собственная копия для следующего диффа
+            created = time.time()
+            if latest and latest[2] + 1 < self.keyframe_interval:
+                diff = diff_commands(latest[3], commands)
+                manifest = {
+                    "format": 3,
+                    "type": "delta",
+                    "created": created,
+                    "snapshot": snapshot,
+                    "count": len(commands),
+                    "size": len(json.dumps(diff, ensure_ascii=False).encode('utf-8')),
+                    "chain": latest[2] + 1,
+                    "summary": summarize_diff(diff),
+                    "parent": latest[0],
+                    "diff": diff
+                }
+            else:
+                summary = summarize_diff(diff_commands(latest[3], commands)) if latest else ""
+                manifest = self._keyframe_manifest(commands, created, snapshot, summary)
+
+            self._write_manifest(name, manifest)
+            self._latest = (name, snapshot, manifest["chain"], commands)
+
             # Manage the number of backups
             self._cleanup_old_backups()
             return True
         except Exception as e:
             print(f"Error saving backup: {e}")
             return False
-    
+
     def get_backups(self):
         """Get list of available backups
-        
+
         Returns:
             list: List of backup files with their timestamps
         """
         backups = []
+        for entry in self.catalog.list(KIND_HISTORY):
+            filename = os.path.basename(entry["path"])
+            backup = {
+                "filename": filename,
+                "path": entry["path"],
+                "timestamp": entry["created"],
+                "readable_time": datetime.fromtimestamp(entry["created"]).strftime("%Y-%m-%d %H:%M:%S"),
+                "size": round(entry["size"] / 1024, 2),
+                "file_timestamp": filename.replace("commands_", "").replace(".json", "")
+            }
+            backup.update(entry["meta"])
+            backups.append(backup)
+        return backups
+
+    def _scan_backups(self):
+        """Catalog entries for the backups already on disk (first start with the catalog)"""
+        # Content-addressed snapshots
+        for file in self._manifest_names():
+            file_path = os.path.join(self.manifests_folder, file)
+            try:
+                manifest = self._read_manifest(file_path)
+            except Exception as e:
+                print(f"Error reading manifest {file}: {e}")
+                continue
+            yield (file_path, manifest.get("created") or os.path.getmtime(file_path),
+                   manifest.get("size", 0), self._catalog_meta(manifest))
+
+        # Legacy full-copy backups
         for file in os.listdir(self.history_folder):
             if file.startswith("commands_") and file.endswith(".json"):
                 file_path = os.path.join(self.history_folder, file)
-                timestamp = os.path.getmtime(file_path)
-                readable_time = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
-                
-                # Get file size in KB
-                size_kb = round(os.path.getsize(file_path) / 1024, 2)
-                
-                # Extract timestamp from filename for sorting
-                file_timestamp = file.replace("commands_", "").replace(".json", "")
-                
-                backups.append({
-                    "filename": file,
-                    "path": file_path,
-                    "timestamp": timestamp,
-                    "readable_time": readable_time,
-                    "size": size_kb,
-                    "file_timestamp": file_timestamp
-                })
-        
-        # Sort by timestamp (newest first)
-        return sorted(backups, key=lambda x: x["file_timestamp"], reverse=True)
-    
+                yield file_path, os.path.getmtime(file_path), os.path.getsize(file_path), None
+
+    def load_snapshot(self, backup_path):
+        """Load the command list stored in a backup (manifest or legacy file)
+
+        Args:
+            backup_path (str): Path to the manifest or legacy backup file
+
+        Returns:
+            list: The commands from the backup
+        """
+        if os.path.dirname(os.path.abspath(backup_path)) == os.path.abspath(self.manifests_folder):
+            return self._materialize(os.path.basename(backup_path))
+
+        # Legacy backups contain the command list itself
+        with open(backup_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def diff_backups(self, old_path, new_path):
+        """Diff between two backups
+
+        Args:
+            old_path (str): Path to the older backup
+            new_path (str): Path to the newer backup
+
+        Returns:
+            dict: Diff with previous values of changed fields, see command_diff.format_diff
+        """
+        return diff_commands(self.load_snapshot(old_path), self.load_snapshot(new_path), include_old=True)
+
     def restore_backup(self, backup_path):
         """Restore commands from a backup file
-        
+
         Args:
             backup_path (str): Path to the backup file
-        
+
         Returns:
             list: The restored commands, or None if failed
         """
@@ -84,22 +275,82 @@ class HistoryManager:
             # Create a backup of current commands before restoring
             if os.path.exists("commands.json"):
                 shutil.copy("commands.json", "commands_before_restore.json")
-            
+
             # Load and return the backed-up commands
-            with open(backup_path, 'r', encoding='utf-8') as f:
-                commands = json.load(f)
-            return commands
+            return self.load_snapshot(backup_path)
         except Exception as e:
             print(f"Error restoring backup: {e}")
             return None
-    
+
     def _cleanup_old_backups(self):
-        """Remove old backups if we exceed the maximum number"""
-        backups = self.get_backups()
-        if len(backups) > self.max_backups:
-            # Remove oldest backups
-            for backup in backups[self.max_backups:]:
+        """Thin out old versions according to the retention tiers"""
+        policy = RetentionPolicy.from_settings(self.retention, max_recent=self.max_backups)
+        policy.apply(self.catalog, KIND_HISTORY, self.delete_backups)
+
+    def delete_backups(self, paths):
+        """Delete backups, rewriting dependent deltas as keyframes first"""
+        doomed = {os.path.basename(path) for path in paths
+                  if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.manifests_folder)}
+
+        # Версии, чей предок удаляется, превращаем в keyframe, пока цепочка еще на диске
+        for name in self._manifest_names():
+            if name in doomed:
+                continue
+            try:
+                manifest = self._read_manifest(os.path.join(self.manifests_folder, name))
+                if manifest.get("type") == "delta" and self._chain_touches(manifest, doomed):
+                    commands = self._materialize(name)
+                    keyframe = self._keyframe_manifest(commands, manifest.get("created"),
+                                                       manifest.get("snapshot"), manifest.get("summary", ""))
+                    self._write_manifest(name, keyframe)
+                    if self._latest and self._latest[0] == name:
+                        self._latest = (name, self._latest[1], 0, self._latest[3])
+            except Exception as e:
+                print(f"Error rebasing backup {name}: {e}")
+                return
+
+        removed = []
+        for path in paths:
+            try:
+                os.remove(path)
+                removed.append(path)
+            except FileNotFoundError:
+                removed.append(path)
+            except Exception as e:
+                print(f"Error removing old backup {path}: {e}")
+        self.catalog.remove(removed)
+        if self._latest and self._latest[0] in doomed:
+            self._latest = None
+        self._remove_unreferenced_objects()
+
+    def _chain_touches(self, manifest, doomed):
+        """Check whether a delta depends (directly or not) on a doomed version"""
+        while manifest.get("type") == "delta":
+            if manifest["parent"] in doomed:
+                return True
+            manifest = self._read_manifest(os.path.join(self.manifests_folder, manifest["parent"]))
+        return False
+
+    def _remove_unreferenced_objects(self):
+        """Delete command blobs that no keyframe refers to anymore"""
+        referenced = set()
+        for file in os.listdir(self.manifests_folder):
+            if file.endswith(".json"):
                 try:
-                    os.remove(backup["path"])
+                    manifest = self._read_manifest(os.path.join(self.manifests_folder, file))
+                    referenced.update(manifest.get("commands", []))
                 except Exception as e:
-                    print(f"Error removing old backup {backup['path']}: {e}")
\ No newline at end of file
+                    # Не удаляем ничего, если хотя бы один манифест не читается
+                    print(f"Error reading manifest {file}, skipping object cleanup: {e}")
+                    return
+
+        for prefix in os.listdir(self.objects_folder):
+            prefix_dir = os.path.join(self.objects_folder, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for file in os.listdir(prefix_dir):
+                if file[:-len(".json")] not in referenced:
+                    try:
+                        os.remove(os.path.join(prefix_dir, file))
+                    except Exception as e:
+                        print(f"Error removing unreferenced object {file}: {e}")
\ No newline at end of file
@@ -0,0 +1,373 @@
+"""
+Offline load harness for the chat pipeline.
+
+Feeds recorded or synthetic chat into TwitchBot.event_message through fake
+twitchio objects - no Twitch connection, Helix requests or audio device is
+used, so it runs on a plain Linux box. Outbound messages and sound triggers
+are captured, and throughput plus latency percentiles are reported.
+
+Synthetic chat:
+    python load_harness.py --rate 200 --messages 20000 --users 5000 --command-ratio 0.3
+
+Replay of a recorded IRC log (raw PRIVMSG lines) or "user: text" lines:
+    python load_harness.py --replay chat.log --rate 0
+
+--rate 0 feeds as fast as the pipeline accepts. Currency data and the config
+files of the run live in a temporary directory that is removed afterwards.
+Users are seeded with their starting points before the clock starts.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+from config_manager import ConfigManager
+from currency_manager import CurrencyManager
+
+HARNESS_CHANNEL = "harness"
+DEFAULT_SYSTEM_COMMANDS = [
+    {"command": "!points", "enabled": True, "permission": "Everyone", "cooldown": 0, "user_cooldown": 0, "cost": 0},
+]
+
+# @tags :user!user@user.tmi.twitch.tv PRIVMSG #channel :text
+PRIVMSG_RE = re.compile(r'^(?:@(?P<tags>\S+) )?:(?P<user>[^!\s]+)!\S+ PRIVMSG #(?P<channel>\S+) :(?P<text>.*)$')
+
+
+# --- Поддельный транспорт twitchio ---
+
+class FakeChannel:
+    """Channel whose send() records the message instead of writing to IRC"""
+
+    def __init__(self, name: str, harness: "LoadHarness"):
+        self.name = name
+        self._harness = harness
+        self._ws = None
+
+    async def send(self, content: str):
+        self._harness.sent.append((time.perf_counter(), self.name, content))
+
+
+class FakeAuthor:
+    def __init__(self, name: str, is_mod: bool = False):
+        self.name = name
+        self.display_name = name
+        self.is_mod = is_mod
+        self.is_subscriber = False
+        self._ws = None  # twitchio Context берет его у автора
+
+
+class FakeMessage:
+    """The parts of twitchio.Message the bot uses"""
+
+    def __init__(self, content: str, author: FakeAuthor, channel: FakeChannel):
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.echo = False
+        self.tags = {}
+        self.timestamp = time.time()
+
+
+class HarnessConfig:
+    """Config source for the bot without touching config.json"""
+
+    def __init__(self, system_commands=None, rate_mode: str = 'verified'):
+        self.system_commands = system_commands if system_commands is not None else DEFAULT_SYSTEM_COMMANDS
+        self.rate_mode = rate_mode
+
+    def get_twitch_config(self):
+        return {'access_token': 'oauth:harness', 'client_id': 'harness', 'channel': HARNESS_CHANNEL}
+
+    def get_sound_interruption(self):
+        return False
+
+    def get_interruption_message(self):
+        return False
+
+    def get_chat_rate_mode(self):
+        return self.rate_mode
+
+    def load_system_commands(self):
+        return self.system_commands
+
+    def system_commands_version(self):
+        return 0
+
+    def get_command_aliases(self):
+        return {}
+
+    def get_manual_moderators(self):
+        return []
+
+    def get_excluded_moderators(self):
+        return []
+
+
+# --- Источники сообщений ---
+
+def synthetic_commands(count: int = 50, seed: int = 1) -> List[Dict[str, Any]]:
+    """Commands in the commands.json format: some paid, some with sounds, some multiline"""
+    rng = random.Random(seed)
+    commands = []
+    for i in range(count):
+        response = f"Response of command {i} for {{user}}"
+        if rng.random() < 0.1:
+            response += f"\n\nSecond line of command {i}"
+        commands.append({
+            "Command": f"!cmd{i}", "Permission": "Everyone", "Info": "", "Group": "GENERAL",
+            "Response": response, "Cooldown": 0, "UserCooldown": 0,
+            "Cost": 10 if rng.random() < 0.2 else 0, "Count": 0,
+            "Usage": "SC", "Enabled": True,
+            "SoundFile": f"sounds/cmd{i}.mp3" if rng.random() < 0.2 else "", "Volume": 100,
+        })
+    return commands
+
+
+def synthetic_stream(messages: int, users: int, command_keys: List[str], command_ratio: float,
+                     seed: int = 1) -> Iterable[Tuple[str, str]]:
+    """(user, text) pairs: chat lines mixed with commands, users drawn with a long tail"""
+    rng = random.Random(seed)
+    for i in range(messages):
+        # Половина сообщений от длинного хвоста: немногие пишут много
+        if rng.random() < 0.5:
+            user = f"user{min(int(rng.paretovariate(1.2)) - 1, users - 1)}"
+        else:
+            user = f"user{rng.randrange(users)}"
+        if command_keys and rng.random() < command_ratio:
+            yield user, rng.choice(command_keys)
+        else:
+            yield user, f"chat message {i} lorem ipsum"
+
+
+def replay_stream(path) -> Iterable[Tuple[str, str]]:
+    """(user, text) pairs from a raw IRC log or "user: text" lines"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            match = PRIVMSG_RE.match(line)
+            if match:
+                yield match.group('user').lower(), match.group('text')
+            elif ': ' in line and ' ' not in line.split(': ', 1)[0]:
+                user, text = line.split(': ', 1)
+                yield user.lower(), text
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+# --- Прогон ---
+
+class LoadHarness:
+    """TwitchBot with fake transport, a private currency store and captured output"""
+
+    def __init__(self, commands=None, system_commands=None, starting_points: float = 100,
+                 sound_duration: float = 2.0, rate_mode: str = 'verified', data_dir=None):
+        self.commands = commands if commands is not None else synthetic_commands()
+        self.config = HarnessConfig(system_commands, rate_mode)
+        self.starting_points = starting_points
+        self.sound_duration = sound_duration
+        self._own_data_dir = data_dir is None
+        self.data_dir = Path(data_dir or tempfile.mkdtemp(prefix="load_harness_"))
+
+        self.sent: List[Tuple[float, str, str]] = []
+        self.sounds: List[Tuple[float, str]] = []
+        self.blocked_sounds = 0
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.undelivered = 0
+        self._sound_busy_until = 0.0
+        self._known_users = set()
+        self.bot = None
+        self.channel = None
+        self.currency_manager = None
+
+    def _create_bot(self):
+        from twitch_bot import TwitchBot
+
+        # Свой ConfigManager во временном каталоге: config.json и backups/ программы не трогаем
+        self.config_manager = ConfigManager(program_dir=self.data_dir)
+        self.currency_manager = CurrencyManager(data_dir=self.data_dir, config_manager=self.config_manager)
+        self.bot = TwitchBot(HARNESS_CHANNEL, commands_data=self.commands, config_manager=self.config,
+                             currency_manager=self.currency_manager, resolve_broadcaster=False)
+        self.bot.play_sound = self._play_sound
+        self.channel = FakeChannel(HARNESS_CHANNEL, self)
+
+    def _play_sound(self, filepath, volume=100):
+        """Sound trigger: busy for sound_duration seconds, like the single pygame channel"""
+        now = time.perf_counter()
+        if now < self._sound_busy_until and not self.bot.allow_sound_interruption:
+            self.blocked_sounds += 1
+            return False
+        self._sound_busy_until = now + self.sound_duration
+        self.sounds.append((now, filepath))
+        return True
+
+    def _seed_users(self, usernames: Iterable[str]):
+        """Give new users their starting points, saved once (outside the timed run)"""
+        added = 0
+        for username in usernames:
+            if username in self._known_users:
+                continue
+            self._known_users.add(username)
+            if self.starting_points and username not in self.currency_manager.users:
+                self.currency_manager.set_user_fields(username, {'points': self.starting_points}, create=True)
+                added += 1
+        if added:
+            self.currency_manager.save_users(force=True)
+
+    async def _handle(self, message: FakeMessage):
+        started = time.perf_counter()
+        try:
+            await self.bot.event_message(message)
+        except Exception as e:
+            self.errors += 1
+            if self.errors <= 5:
+                print(f"[HARNESS] Error in event_message: {e!r}")
+        self.latencies.append(time.perf_counter() - started)
+
+    async def run_stream(self, stream: Iterable[Tuple[str, str]], rate: float = 0) -> Dict[str, Any]:
+        """Feed (user, text) pairs at `rate` messages per second (0 - unthrottled)"""
+        if self.bot is None:
+            self._create_bot()
+        messages = list(stream)
+        self._seed_users(user for user, _ in messages)
+        self.bot.send_queue.start()
+        authors = {}
+        tasks = []
+        interval = 1 / rate if rate > 0 else 0
+        started = time.perf_counter()
+
+        for index, (user, text) in enumerate(messages):
+            if interval:
+                # Держим заданный темп относительно начала прогона
+                delay = started + index * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif index % 100 == 0:
+                await asyncio.sleep(0)
+            author = authors.get(user) or authors.setdefault(user, FakeAuthor(user))
+            # Как twitchio: каждое сообщение обрабатывается в своей задаче
+            tasks.append(asyncio.ensure_future(self._handle(FakeMessage(text, author, self.channel))))
+        fed = time.perf_counter()
+        await asyncio.gather(*tasks)
+        finished = time.perf_counter()
+
+        # Даем очереди отправки дослать то, что укладывается в лимит
+        for _ in range(50):
+            if not sum(self.bot.send_queue.metrics()['depth'].values()):
+                break
+            await asyncio.sleep(0.02)
+        # Останавливаем отправку; что не ушло за это время, считаем недоставленным
+        self.undelivered = await self.bot.send_queue.close()
+        return self.report(len(tasks), finished - started, fed - started)
+
+    def report(self, count: int, elapsed: float, feed_time: float) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        ms = lambda value: round(value * 1000, 3)
+        return {
+            'messages': count,
+            'elapsed_seconds': round(elapsed, 3),
+            'feed_seconds': round(feed_time, 3),
+            'throughput_per_second': round(count / elapsed, 1) if elapsed else 0.0,
+            'latency_ms': {
+                'p50': ms(percentile(latencies, 50)),
+                'p95': ms(percentile(latencies, 95)),
+                'p99': ms(percentile(latencies, 99)),
+                'max': ms(latencies[-1]) if latencies else 0.0,
+            },
+            'errors': self.errors,
+            'sent_messages': len(self.sent),
+            'undelivered_messages': self.undelivered,
+            'sounds_played': len(self.sounds),
+            'sounds_blocked': self.blocked_sounds,
+            'unique_users': len(self._known_users),
+            'send_queue': self.bot.send_queue.metrics(),
+            'channel_stats': self.bot.primary_context.stats.snapshot(),
+        }
+
+    def close(self):
+        if self.bot is not None:
+            self.bot.send_queue.stop()
+        if self.currency_manager is not None:
+            self.currency_manager._store.close()
+        if self._own_data_dir:
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test of the chat pipeline")
+    parser.add_argument("--replay", help="IRC log or 'user: text' file to replay instead of synthetic chat")
+    parser.add_argument("--rate", type=float, default=100, help="Messages per second, 0 for unthrottled")
+    parser.add_argument("--messages", type=int, default=5000, help="Synthetic messages to send")
+    parser.add_argument("--users", type=int, default=1000, help="Unique synthetic users")
+    parser.add_argument("--command-ratio", type=float, default=0.3, help="Share of messages that are commands")
+    parser.add_argument("--commands", help="commands.json to use (default: 50 synthetic commands)")
+    parser.add_argument("--system-commands", help="system_commands.json to use")
+    parser.add_argument("--rate-mode", default="verified", help="Send queue budget: normal, mod or verified")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    commands = None
+    if args.commands:
+        with open(args.commands, 'r', encoding='utf-8') as f:
+            commands = json.load(f)
+    system_commands = None
+    if args.system_commands:
+        with open(args.system_commands, 'r', encoding='utf-8') as f:
+            system_commands = json.load(f)
+
+    harness = None
+
+    async def run():
+        nonlocal harness
+        harness = LoadHarness(commands, system_commands, rate_mode=args.rate_mode)
+        if args.replay:
+            stream = replay_stream(args.replay)
+        else:
+            keys = [cmd["Command"] for cmd in harness.commands if cmd.get("Enabled", True)]
+            keys += [cmd.get("command_name", cmd["command"]) for cmd in harness.config.system_commands
+                     if cmd.get("enabled")]
+            stream = synthetic_stream(args.messages, args.users, keys, args.command_ratio, args.seed)
+        return await harness.run_stream(stream, args.rate)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        report = loop.run_until_complete(run())
+    finally:
+        if harness is not None:
+            harness.close()
+        loop.close()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        latency = report['latency_ms']
+        print(f"[HARNESS] {report['messages']} messages in {report['elapsed_seconds']}s "
+              f"({report['throughput_per_second']} msg/s), errors: {report['errors']}")
+        print(f"[HARNESS] latency ms: p50={latency['p50']} p95={latency['p95']} "
+              f"p99={latency['p99']} max={latency['max']}")
+        print(f"[HARNESS] sent {report['sent_messages']} messages ({report['undelivered_messages']} undelivered), sounds played "
+              f"{report['sounds_played']}, blocked {report['sounds_blocked']}, "
+              f"users {report['unique_users']}")
+        queue = report['send_queue']
+        print(f"[HARNESS] send queue: depth={queue['depth']} coalesced={queue['coalesced']} "
+              f"dropped={queue['dropped']} throttled={queue['throttled_seconds']}s")
+    return 0 if report['errors'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,7 +11,7 @@ class ModeratorsManager:
     """Класс для управления списками модераторов"""
     
     def __init__(self, config_manager: ConfigManager = None):
-        self.config_manager = config_manager or ConfigManager()
+        self.config_manager = config_manager or ConfigManager.instance()
         self._api_moderators: Set[str] = set()
         self._combined_moderators: Set[str] = set()
     
@@ -0,0 +1,312 @@
+"""
+Multi-channel bot runtime.
+
+One process serves several channels. Channels are spread over a small pool
+of IRC connections (one TwitchBot per connection). Each channel has its own
+command set, cooldowns and currency namespace (a CurrencyManager with its own
+data directory). Stream status is polled for all channels at once with
+batched Helix requests. Chatter lists are fetched per channel, staggered over
+the poll interval so requests do not burst. Every channel is paid for the
+presence of its viewers every PAYOUT_INTERVAL seconds and its currency is
+auto-saved like in the daemon (currency_auto_save in config.json).
+
+Channels file (JSON):
+
+    {
+        "channels_per_connection": 20,
+        "poll_interval": 60,
+        "channels": [
+            {"name": "channel_one", "commands_file": "channel_one/commands.json"},
+            {"name": "channel_two", "data_dir": "D:/bots/channel_two"}
+        ]
+    }
+
+Relative paths are resolved against the channels file. Without "data_dir" a
+channel stores its currency in channels/<name> next to the channels file.
+Run with: python multi_channel.py channels.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from channel_context import ChannelContext, current_channel
+from config_manager import ConfigManager
+from currency_manager import CurrencyManager
+
+DEFAULT_CHANNELS_PER_CONNECTION = 20  # Каналов на одно IRC-соединение
+DEFAULT_POLL_INTERVAL = 60            # Опрос Helix, секунд
+PAYOUT_INTERVAL = 300                 # Начисление за присутствие, секунд
+STATS_INTERVAL = 300                  # Вывод статистики в лог, секунд
+
+
+def load_commands_file(path) -> List[Dict[str, Any]]:
+    """Commands of a channel in the commands.json format, [] if the file is missing"""
+    if not path or not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            commands = json.load(f)
+        for cmd in commands:
+            cmd.setdefault("Enabled", True)
+        return commands
+    except Exception as e:
+        print(f"[MULTI] Error loading commands from {path}: {e}")
+        return []
+
+
+class MultiChannelRuntime:
+    """Hosts many channels on a pool of TwitchBot connections"""
+
+    def __init__(self, channels: List[Dict[str, Any]], base_dir=None, config_manager=None,
+                 channels_per_connection: int = DEFAULT_CHANNELS_PER_CONNECTION,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, message_callback=None):
+        """
+        Args:
+            channels (list): Channel entries with "name" and optional "commands_file"/"data_dir"
+            base_dir: Directory relative paths are resolved against
+            config_manager: Shared ConfigManager (token, system commands, moderators)
+            channels_per_connection (int): How many channels share one IRC connection
+            poll_interval (float): Seconds between Helix polls of a channel
+            message_callback: Called with "#channel user: text" for every chat message
+        """
+        self.base_dir = Path(base_dir or os.getcwd())
+        self.config_manager = config_manager or ConfigManager.instance()
+        self.channels_per_connection = max(1, int(channels_per_connection))
+        self.poll_interval = max(5.0, float(poll_interval))
+        self.message_callback = message_callback
+
+        self.contexts: List[ChannelContext] = []
+        seen = set()
+        for entry in channels:
+            name = entry.get("name", "").strip().lower().lstrip('#')
+            if not name or name in seen:
+                continue
+            seen.add(name)
+            self.contexts.append(self._build_context(name, entry))
+
+        self.bots = []
+        self._bot_of = {}  # имя канала -> бот (соединение)
+        self._tasks = []
+        self.loop = None
+
+    @classmethod
+    def from_file(cls, path, **kwargs) -> "MultiChannelRuntime":
+        """Create a runtime from a channels file"""
+        path = Path(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        kwargs.setdefault('channels_per_connection',
+                          config.get('channels_per_connection', DEFAULT_CHANNELS_PER_CONNECTION))
+        kwargs.setdefault('poll_interval', config.get('poll_interval', DEFAULT_POLL_INTERVAL))
+        return cls(config.get('channels', []), base_dir=path.parent, **kwargs)
+
+    def _resolve(self, path) -> Path:
+        path = Path(path)
+        return path if path.is_absolute() else self.base_dir / path
+
+    def _build_context(self, name: str, entry: Dict[str, Any]) -> ChannelContext:
+        """Channel context with its own commands and currency namespace"""
+        data_dir = self._resolve(entry.get("data_dir") or Path("channels") / name)
+        commands_file = entry.get("commands_file")
+        commands = load_commands_file(self._resolve(commands_file)) if commands_file else []
+        currency = CurrencyManager(data_dir=data_dir)
+        currency.load_ranks()
+        print(f"[MULTI] Channel {name}: {len(commands)} commands, currency in {data_dir}")
+        return ChannelContext(name, commands, currency)
+
+    def _create_bots(self):
+        """Split channels over connections, one TwitchBot per connection"""
+        from twitch_bot import TwitchBot
+
+        sound_channel = None
+        try:
+            import pygame
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+            sound_channel = pygame.mixer.Channel(1)
+        except Exception as e:
+            # Бот работает и без звука
+            print(f"[MULTI] Sound is not available: {e}")
+
+        step = self.channels_per_connection
+        for start in range(0, len(self.contexts), step):
+            group = self.contexts[start:start + step]
+            bot = TwitchBot(None, message_callback=self._on_message, sound_channel=sound_channel,
+                            config_manager=self.config_manager, channel_contexts=group)
+            bot.register_commands()
+            self.bots.append(bot)
+            for ctx in group:
+                self._bot_of[ctx.name] = bot
+        print(f"[MULTI] {len(self.contexts)} channels on {len(self.bots)} connections")
+
+    def _on_message(self, text):
+        if self.message_callback:
+            ctx = current_channel.get()
+            self.message_callback(f"#{ctx.name} {text}" if ctx else text)
+
+    async def _poll_live_status(self):
+        """Stream status of all channels, one batched Helix request per 100 channels"""
+        loop = asyncio.get_running_loop()
+        while True:
+            for bot in self.bots:
+                ids = [ctx.broadcaster_id for ctx in bot.channel_contexts]
+                status = await loop.run_in_executor(None, bot.fetch_live_status, ids)
+                for ctx in bot.channel_contexts:
+                    if ctx.broadcaster_id in status and status[ctx.broadcaster_id] != ctx.is_live:
+                        ctx.is_live = status[ctx.broadcaster_id]
+                        print(f"[MULTI] {ctx.name} is now {'LIVE' if ctx.is_live else 'OFFLINE'}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _poll_chatters(self, ctx: ChannelContext, delay: float):
+        """Chatter list of one channel, started with an offset to spread the requests"""
+        loop = asyncio.get_running_loop()
+        bot = self._bot_of[ctx.name]
+        await asyncio.sleep(delay)
+        while True:
+            viewers = await loop.run_in_executor(None, bot.fetch_chatters,
+                                                 ctx.broadcaster_id, ctx.moderator_id)
+            if viewers:
+                ctx.update_viewers(viewers)
+            await asyncio.sleep(self.poll_interval)
+
+    async def _every(self, interval, job, first_delay=0):
+        """Run a blocking job in the executor every `interval` seconds"""
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(first_delay)
+        while True:
+            try:
+                await loop.run_in_executor(None, job)
+            except Exception as e:
+                print(f"[MULTI] Error in {getattr(job, '__name__', job)}: {e}")
+            await asyncio.sleep(interval)
+
+    def _payout(self, ctx: ChannelContext):
+        """Points and hours of one channel for the presence since its last payout"""
+        ctx.currency_manager.process_presence_update(
+            ctx.presence, chat_message_callback=lambda message: print(f"[MULTI] #{ctx.name} {message}"),
+            active_users=ctx.active_users)
+
+    def _payout_all(self):
+        for ctx in self.contexts:
+            try:
+                self._payout(ctx)
+            except Exception as e:
+                print(f"[MULTI] Error paying out {ctx.name}: {e}")
+
+    def _save_all(self):
+        """Save the currency of every channel, with a currency backup when one is due"""
+        for ctx in self.contexts:
+            try:
+                ctx.currency_manager.enhanced_save_users(force_backup=False)
+            except Exception as e:
+                print(f"[MULTI] Error saving currency of {ctx.name}: {e}")
+
+    async def _payout_loop(self):
+        await self._every(PAYOUT_INTERVAL, self._payout_all, first_delay=PAYOUT_INTERVAL)
+
+    async def _currency_save_loop(self):
+        settings = self.config_manager.get_currency_auto_save()
+        if not settings.get('enabled', True):
+            return
+        await self._every(settings.get('interval', 300), self._save_all,
+                          first_delay=settings.get('interval', 300))
+
+    async def _report_stats(self):
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            for name, stats in self.stats().items():
+                print(f"[MULTI] {name}: {stats['messages_per_minute']} msg/min, "
+                      f"{stats['commands_per_minute']} cmd/min, {stats['sent']} sent, "
+                      f"live={stats['is_live']}, viewers={stats['viewers']}")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-channel throughput counters and status"""
+        result = {}
+        for ctx in self.contexts:
+            stats = ctx.stats.snapshot()
+            stats['is_live'] = ctx.is_live
+            stats['viewers'] = len(ctx.all_viewers)
+            stats['presence'] = ctx.presence.metrics()
+            stats['activity'] = ctx.activity.metrics()
+            bot = self._bot_of.get(ctx.name)
+            stats['connection'] = self.bots.index(bot) if bot in self.bots else None
+            stats['send_queue'] = bot.send_queue.metrics() if bot in self.bots else None
+            stats['connection_health'] = bot.connection_metrics() if bot in self.bots else None
+            result[ctx.name] = stats
+        return result
+
+    def context_for(self, channel_name) -> Optional[ChannelContext]:
+        channel_name = (channel_name or "").lower()
+        return next((ctx for ctx in self.contexts if ctx.name == channel_name), None)
+
+    async def _main(self):
+        self._tasks = [asyncio.ensure_future(self._poll_live_status()),
+                       asyncio.ensure_future(self._report_stats()),
+                       asyncio.ensure_future(self._payout_loop()),
+                       asyncio.ensure_future(self._currency_save_loop())]
+        for index, ctx in enumerate(self.contexts):
+            delay = self.poll_interval * index / max(len(self.contexts), 1)
+            self._tasks.append(asyncio.ensure_future(self._poll_chatters(ctx, delay)))
+        try:
+            await asyncio.gather(*(bot.start() for bot in self.bots))
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+    def run(self):
+        """Connect all channels and block until stopped"""
+        if not self.contexts:
+            print("[MULTI] No channels configured")
+            return
+        # Боты создаются уже в своем event loop
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._create_bots()
+        try:
+            self.loop.run_until_complete(self._main())
+        except KeyboardInterrupt:
+            print("[MULTI] Stopping...")
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Pay out the remaining presence, save every channel's currency and close the connections"""
+        for ctx in self.contexts:
+            try:
+                # Досчитываем присутствие с последнего начисления
+                self._payout(ctx)
+                ctx.currency_manager.save_users(force=True, export=True)
+            except Exception as e:
+                print(f"[MULTI] Error saving currency of {ctx.name}: {e}")
+        for bot in self.bots:
+            bot.is_running = False
+            try:
+                if self.loop and not self.loop.is_closed() and not self.loop.is_running():
+                    self.loop.run_until_complete(bot.close())
+            except Exception as e:
+                print(f"[MULTI] Error closing connection: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the bot for several channels in one process")
+    parser.add_argument("channels_file", help="JSON file with the channel list")
+    parser.add_argument("--per-connection", type=int, help="Channels per IRC connection")
+    parser.add_argument("--poll-interval", type=float, help="Seconds between Helix polls")
+    args = parser.parse_args(argv)
+
+    kwargs = {'message_callback': print}
+    if args.per_connection:
+        kwargs['channels_per_connection'] = args.per_connection
+    if args.poll_interval:
+        kwargs['poll_interval'] = args.poll_interval
+    MultiChannelRuntime.from_file(args.channels_file, **kwargs).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
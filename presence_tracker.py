@@ -0,0 +1,168 @@
+"""
+Presence sessions of the viewers of one channel.
+
+Viewers join and leave between payouts; counting everybody who is in the
+chatters list at payout time as present for the whole period over-pays late
+joiners and under-pays people who left. The tracker records when each viewer
+was present instead:
+
+- IRC JOIN/PART and diffs of the Helix chatters list open and close sessions;
+- closed sessions are kept per user as a flat [start, end, start, end, ...]
+  list, short gaps (a PART/JOIN flap) are merged into one interval;
+- live/offline switches are recorded, so every second is counted at the rate
+  that applied at that moment.
+
+checkpoint() hands out the exact live and offline seconds of every viewer
+since the previous checkpoint, open sessions included, and starts a new
+period. Payouts can therefore run rarely without losing accuracy, and their
+cost depends on the number of viewers, not on how often the list is polled.
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MERGE_GAP = 60  # Разрыв короче этого (секунд) считается одним присутствием
+
+
+class PresenceTracker:
+    """Join/leave intervals and live periods of one channel between checkpoints"""
+
+    def __init__(self, merge_gap: float = MERGE_GAP, now: Optional[float] = None):
+        now = now or time.time()
+        self.merge_gap = merge_gap
+        self._lock = threading.Lock()
+        self._open: Dict[str, float] = {}         # Присутствующие: имя -> начало текущей сессии
+        self._closed: Dict[str, List[float]] = {}  # Закрытые интервалы с последнего checkpoint
+        self._period_start = now
+        self._live = False
+        self._live_since: Optional[float] = None
+        self._live_periods: List[Tuple[float, float]] = []
+
+        self.joins = 0
+        self.parts = 0
+        self.checkpoints = 0
+
+    # --- События ---
+
+    def join(self, username: str, now: Optional[float] = None):
+        """Viewer arrived (IRC JOIN or new in the chatters list)"""
+        username = username.lower()
+        with self._lock:
+            if username not in self._open:
+                self._open[username] = now or time.time()
+                self.joins += 1
+
+    def part(self, username: str, now: Optional[float] = None):
+        """Viewer left (IRC PART or gone from the chatters list)"""
+        username = username.lower()
+        with self._lock:
+            self._close(username, now or time.time())
+
+    def _close(self, username: str, now: float):
+        start = self._open.pop(username, None)
+        if start is None:
+            return
+        self.parts += 1
+        intervals = self._closed.setdefault(username, [])
+        if intervals and start - intervals[-1] <= self.merge_gap:
+            # Короткий выход и возврат - продолжаем предыдущий интервал
+            intervals[-1] = max(intervals[-1], now)
+        else:
+            intervals += [start, now]
+
+    def sync(self, viewers: Iterable[str], now: Optional[float] = None):
+        """Reconcile with a full chatters list: open sessions for new names, close missing ones"""
+        now = now or time.time()
+        current = {name.lower() for name in viewers}
+        with self._lock:
+            for username in current.difference(self._open):
+                self._open[username] = now
+                self.joins += 1
+            for username in set(self._open).difference(current):
+                self._close(username, now)
+
+    def set_live(self, is_live: bool, now: Optional[float] = None):
+        """Stream went live or offline; seconds are counted at the matching rate"""
+        is_live = bool(is_live)
+        now = now or time.time()
+        with self._lock:
+            if is_live == self._live:
+                return
+            if is_live:
+                self._live_since = now
+            elif self._live_since is not None:
+                self._live_periods.append((self._live_since, now))
+                self._live_since = None
+            self._live = is_live
+
+    # --- Расчет ---
+
+    def _live_overlap(self, start: float, end: float, periods) -> float:
+        overlap = 0.0
+        for live_start, live_end in periods:
+            overlap += max(0.0, min(end, live_end) - max(start, live_start))
+        return overlap
+
+    def checkpoint(self, now: Optional[float] = None) -> Dict[str, Tuple[float, float]]:
+        """Seconds present since the previous checkpoint and start a new period
+
+        Returns:
+            dict: username -> (live seconds, offline seconds)
+        """
+        now = now or time.time()
+        with self._lock:
+            periods = list(self._live_periods)
+            if self._live_since is not None:
+                periods.append((self._live_since, now))
+
+            result = {}
+            for username, intervals in self._closed.items():
+                result[username] = list(intervals)
+            for username, start in self._open.items():
+                intervals = result.setdefault(username, [])
+                if intervals and start - intervals[-1] <= self.merge_gap:
+                    intervals[-1] = now
+                else:
+                    intervals += [start, now]
+
+            seconds = {}
+            for username, intervals in result.items():
+                total = live = 0.0
+                for i in range(0, len(intervals), 2):
+                    start, end = intervals[i], intervals[i + 1]
+                    total += end - start
+                    live += self._live_overlap(start, end, periods)
+                seconds[username] = (live, total - live)
+
+            # Новый период: открытые сессии продолжаются с этого момента
+            self._closed.clear()
+            for username in self._open:
+                self._open[username] = now
+            self._live_periods.clear()
+            if self._live:
+                self._live_since = now
+            self._period_start = now
+            self.checkpoints += 1
+            return seconds
+
+    # --- Состояние ---
+
+    @property
+    def present(self) -> List[str]:
+        with self._lock:
+            return list(self._open)
+
+    def __contains__(self, username) -> bool:
+        return username.lower() in self._open
+
+    def metrics(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'present': len(self._open),
+                'pending_users': len(set(self._closed) | set(self._open)),
+                'period_seconds': round(time.time() - self._period_start, 1),
+                'joins': self.joins,
+                'parts': self.parts,
+                'checkpoints': self.checkpoints,
+            }
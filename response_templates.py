@@ -0,0 +1,164 @@
+"""
+Compiled chat response templates.
+
+A response such as "$username [$rank] - $currencyname: $points" used to be
+formatted with a chain of str.replace calls on every use. Here a template is
+parsed once into literal parts and placeholder slots; rendering only fills
+the slots and joins the list. Compiled templates are cached by their text, so
+a template is parsed when a command is loaded or settings are saved and every
+later use is a dict lookup.
+
+Variables (Streamlabs style):
+
+    $username, {user}  name of the user who used the command
+    $points, $rank, $hours, $currencyname  currency of that user
+    $target            first word after the command without "@", or the user
+    $count             how many times the command was used, this use included
+    $random            random viewer from the chatters list
+
+Unknown variables and variables without a value are left as they are.
+"""
+
+import random
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CACHE_SIZE = 4096
+
+# Имя поля для каждого варианта записи переменной
+VARIABLES = {
+    '$username': 'username',
+    '{user}': 'username',
+    '$points': 'points',
+    '$rank': 'rank',
+    '$hours': 'hours',
+    '$currencyname': 'currencyname',
+    '$target': 'target',
+    '$count': 'count',
+    '$random': 'random',
+}
+CURRENCY_FIELDS = frozenset(('points', 'rank', 'hours', 'currencyname'))
+
+# Длинные варианты раньше коротких, как при последовательных replace
+_PLACEHOLDER = re.compile('|'.join(re.escape(token) for token in sorted(VARIABLES, key=len, reverse=True)))
+
+
+class ResponseTemplate:
+    """Response text split into literals and placeholder slots"""
+
+    __slots__ = ('source', 'fields', '_parts', '_slots')
+
+    def __init__(self, source: str):
+        self.source = source
+        self._parts: List[str] = []
+        self._slots: List[Tuple[int, str, str]] = []  # (позиция в _parts, поле, исходный текст)
+        pos = 0
+        for match in _PLACEHOLDER.finditer(source):
+            if match.start() > pos:
+                self._parts.append(source[pos:match.start()])
+            token = match.group()
+            self._slots.append((len(self._parts), VARIABLES[token], token))
+            self._parts.append(token)
+            pos = match.end()
+        if pos < len(source):
+            self._parts.append(source[pos:])
+        self.fields = frozenset(field for _, field, _ in self._slots)
+
+    def render(self, values: Dict[str, str]) -> str:
+        """Fill the placeholders from values (field name -> text)"""
+        if not self._slots:
+            return self.source
+        parts = list(self._parts)
+        for index, field, token in self._slots:
+            value = values.get(field)
+            if value is not None:
+                parts[index] = value
+        return ''.join(parts)
+
+    def __repr__(self):
+        return f"ResponseTemplate({self.source!r})"
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_template(text: str) -> ResponseTemplate:
+    """Parsed template for a single-line response (cached by text)"""
+    return ResponseTemplate(text or '')
+
+
+class ResponseLines:
+    """Multi-line command response: every non-empty line is a separate chat message
+
+    Each empty or whitespace-only line adds 0.2 seconds of delay before the
+    next message.
+    """
+
+    __slots__ = ('source', 'lines', 'fields')
+
+    def __init__(self, source: str):
+        self.source = source
+        lines = []
+        delay = 0.0
+        for line in source.split('\n'):
+            if line.isspace() or line == '':
+                delay += 0.2
+                continue
+            lines.append((delay, compile_template(line)))
+            delay = 0.0
+        self.lines: Tuple[Tuple[float, ResponseTemplate], ...] = tuple(lines)
+        self.fields = frozenset().union(*(template.fields for _, template in lines))
+
+    def render(self, values: Dict[str, str]) -> List[Tuple[float, str]]:
+        """(delay, message) pairs; lines that render to whitespace only are skipped"""
+        messages = []
+        delay = 0.0
+        for line_delay, template in self.lines:
+            delay += line_delay
+            text = template.render(values)
+            if text.strip():
+                messages.append((delay, text))
+                delay = 0.0
+        return messages
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_lines(text: str) -> ResponseLines:
+    """Parsed multi-line response (cached by text)"""
+    return ResponseLines(text or '')
+
+
+def precompile(texts: Iterable[str]) -> int:
+    """Compile the responses of a command set in advance, returns the number of templates"""
+    count = 0
+    for text in texts:
+        if text and text.strip():
+            count += len(compile_lines(text).lines)
+    return count
+
+
+def command_values(fields, username: str, currency_manager=None, content: str = '',
+                   count: Optional[int] = None, viewers=None) -> Dict[str, str]:
+    """Values of the variables used by a template, only the fields it needs are computed
+
+    Args:
+        fields: ResponseTemplate.fields (or a union of them)
+        username: User who used the command
+        currency_manager: Source of $points, $rank, $hours and $currencyname
+        content: Full chat message, its second word is $target
+        count: Uses of the command before this one
+        viewers: Chatters list for $random
+    """
+    if currency_manager is not None and not CURRENCY_FIELDS.isdisjoint(fields):
+        values = currency_manager.response_values(username.lower())
+        values['username'] = username
+    else:
+        values = {'username': username}
+    if 'target' in fields:
+        words = content.split(maxsplit=2)
+        target = words[1].lstrip('@') if len(words) > 1 else ''
+        values['target'] = target or username
+    if 'count' in fields and count is not None:
+        values['count'] = str(int(count) + 1)
+    if 'random' in fields:
+        values['random'] = random.choice(viewers) if viewers else username
+    return values
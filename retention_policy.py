@@ -0,0 +1,132 @@
+"""
+Grandfather-father-son retention for all backup types.
+
+Every backup from the last hour is kept, then one per hour for a day, one per
+day for a month and one per week after that. On top of the tiers a total disk
+budget is enforced across all backup kinds in the catalog. The policy runs
+after every backup write; since it only looks at backups that survived the
+previous pass, each run touches a bounded number of catalog rows.
+"""
+
+from datetime import datetime
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+DEFAULT_RETENTION = {
+    'keep_all_hours': 1,     # Все сохранения за последний час
+    'hourly_days': 1,        # Одно в час за последние сутки
+    'daily_days': 30,        # Одно в день за последний месяц
+    'disk_budget_mb': 2048   # Общий лимит для всех бэкапов, 0 - без лимита
+}
+
+RETENTION_TOOLTIP = ("Number of backups kept from the last hour. Older backups are thinned out "
+                     "to one per hour for a day, one per day for 30 days and one per week after that.")
+
+
+class RetentionPolicy:
+    """Decides which backups of one kind to keep"""
+
+    def __init__(self, keep_all_for: float = HOUR, hourly_for: float = DAY, daily_for: float = 30 * DAY,
+                 max_recent: Optional[int] = None, disk_budget: Optional[int] = None):
+        """
+        Args:
+            keep_all_for (float): Seconds during which every backup is kept
+            hourly_for (float): Age up to which one backup per hour is kept
+            daily_for (float): Age up to which one backup per day is kept, weekly after that
+            max_recent (int): Cap on the number of backups in the keep-all tier
+            disk_budget (int): Total bytes for all backups in the catalog, None for no limit
+        """
+        self.keep_all_for = keep_all_for
+        self.hourly_for = hourly_for
+        self.daily_for = daily_for
+        self.max_recent = max_recent
+        self.disk_budget = disk_budget
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any], max_recent: Optional[int] = None) -> "RetentionPolicy":
+        """Build a policy from the 'retention' config section"""
+        settings = {**DEFAULT_RETENTION, **(settings or {})}
+        budget_mb = settings.get('disk_budget_mb') or 0
+        return cls(keep_all_for=settings['keep_all_hours'] * HOUR,
+                   hourly_for=settings['hourly_days'] * DAY,
+                   daily_for=settings['daily_days'] * DAY,
+                   max_recent=max_recent,
+                   disk_budget=int(budget_mb * 1024 * 1024) if budget_mb > 0 else None)
+
+    def _bucket(self, created: float, age: float):
+        """Tier bucket of a backup, None for the keep-all tier"""
+        moment = datetime.fromtimestamp(created)
+        if age < self.keep_all_for:
+            return None
+        if age < self.hourly_for:
+            return ('hour', moment.date().toordinal(), moment.hour)
+        if age < self.daily_for:
+            return ('day', moment.date().toordinal())
+        year, week, _ = moment.isocalendar()
+        return ('week', year, week)
+
+    def select(self, entries: List[Dict[str, Any]], now: float,
+               budget: Optional[int] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Split catalog entries (newest first) into (keep, drop)
+
+        Within each hour/day/week bucket the newest backup is kept. The newest
+        backup overall is never dropped, not even to fit the disk budget.
+        """
+        keep, drop = [], []
+        seen_buckets = set()
+        recent = 0
+        for index, entry in enumerate(entries):
+            if index == 0:
+                keep.append(entry)
+                recent += 1
+                continue
+            bucket = self._bucket(entry["created"], now - entry["created"])
+            if bucket is None:
+                if self.max_recent is None or recent < self.max_recent:
+                    keep.append(entry)
+                    recent += 1
+                else:
+                    drop.append(entry)
+            elif bucket in seen_buckets:
+                drop.append(entry)
+            else:
+                seen_buckets.add(bucket)
+                keep.append(entry)
+
+        if budget is not None:
+            # Самые старые точки уходят первыми
+            used = sum(entry["size"] for entry in keep)
+            while used > budget and len(keep) > 1:
+                entry = keep.pop()
+                used -= entry["size"]
+                drop.append(entry)
+        return keep, drop
+
+    def apply(self, catalog, kind: str, delete: Callable[[List[str]], Iterable],
+              now: Optional[float] = None) -> int:
+        """Prune backups of a kind in the catalog
+
+        Args:
+            catalog: BackupCatalog with the backups
+            kind: Backup kind to prune
+            delete: Called with the paths to remove; it deletes the files and
+                updates the catalog
+            now (float): Reference time, defaults to the current time
+
+        Returns:
+            int: Number of backups selected for removal
+        """
+        now = now or datetime.now().timestamp()
+        entries = catalog.list(kind)
+        budget = None
+        if self.disk_budget is not None:
+            # Остальные типы бэкапов занимают часть общего лимита
+            budget = self.disk_budget - (catalog.total_size() - sum(entry["size"] for entry in entries))
+            budget = max(budget, 0)
+        _, drop = self.select(entries, now, budget)
+        if drop:
+            delete([entry["path"] for entry in drop])
+            print(f"[RETENTION] {kind}: removed {len(drop)} of {len(entries)} backups")
+        return len(drop)
@@ -0,0 +1,269 @@
+"""
+Outbound chat scheduler.
+
+All bot messages go through one SendQueue per connection instead of calling
+channel.send directly. The queue:
+
+- keeps the account inside Twitch's message budget with a token bucket
+  (20, 100 or 7500 messages per 30 s for normal, mod and verified bots);
+- has two priority lanes, so command responses go out before notices
+  (cooldown, permission and error messages);
+- coalesces notices with the same key while they wait: forty "command is on
+  cooldown" replies become one message that mentions everybody;
+- drops notices that waited too long to still be useful;
+- reports queue depth, waits, throttling and drops via metrics().
+
+enqueue() is thread-safe, so Qt timers and executor jobs can post messages
+without run_coroutine_threadsafe.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Hashable, Optional
+
+# Лимиты Twitch: (сообщений, окно в секундах)
+RATE_LIMITS = {
+    'normal': (20, 30),
+    'mod': (100, 30),
+    'verified': (7500, 30),
+}
+
+PRIORITY_RESPONSE = 0  # Ответы команд, благодарности за события
+PRIORITY_NOTICE = 1    # Кулдауны, права, ошибки
+LANES = (PRIORITY_RESPONSE, PRIORITY_NOTICE)
+
+MAX_MESSAGE_LENGTH = 500  # Лимит длины сообщения в чате Twitch
+NOTICE_TTL = 30           # Уведомление старше этого уже неактуально, секунд
+MAX_LANE_DEPTH = {PRIORITY_RESPONSE: 1000, PRIORITY_NOTICE: 200}
+
+
+class TokenBucket:
+    """Token bucket that never exceeds `limit` messages in any `window`
+
+    With a burst of B tokens and a refill of (limit - B) / window per second,
+    at most B + (limit - B) = limit messages fit into one window, matching
+    Twitch's sliding 30 second budget.
+    """
+
+    def __init__(self, limit: int, window: float, burst: Optional[int] = None):
+        self.limit = limit
+        self.window = window
+        self.capacity = max(1, burst if burst is not None else limit // 2)
+        self.rate = max(limit - self.capacity, 1) / window
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+
+class _Outgoing:
+    __slots__ = ('channel', 'text', 'priority', 'coalesce_key', 'mentions', 'queued')
+
+    def __init__(self, channel, text, priority, coalesce_key, mention):
+        self.channel = channel
+        self.text = text
+        self.priority = priority
+        self.coalesce_key = coalesce_key
+        self.mentions = [mention] if mention else []
+        self.queued = time.monotonic()
+
+    def render(self) -> str:
+        if not self.mentions:
+            return self.text
+        return f"{' '.join('@' + name for name in self.mentions)}: {self.text}"
+
+
+class SendQueue:
+    """Rate-limited, prioritized outbound message queue of one connection"""
+
+    def __init__(self, mode: str = 'normal'):
+        self._lanes = {lane: deque() for lane in LANES}
+        self._pending: Dict[Hashable, _Outgoing] = {}  # coalesce_key -> сообщение в очереди
+        self._lock = threading.Lock()
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+        self._current = None  # Сообщение, которое ждет токен или отправляется
+        self.set_mode(mode)
+
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.expired = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.throttled_seconds = 0.0
+        self._wait_total = 0.0
+
+    def set_mode(self, mode: str):
+        """Switch the budget: 'normal', 'mod' or 'verified'"""
+        if mode not in RATE_LIMITS:
+            print(f"[SEND QUEUE] Unknown rate mode '{mode}', using 'normal'")
+            mode = 'normal'
+        self.mode = mode
+        self.bucket = TokenBucket(*RATE_LIMITS[mode])
+
+    # --- Очередь ---
+
+    def enqueue(self, channel, text: str, priority: int = PRIORITY_RESPONSE,
+                coalesce_key: Optional[Hashable] = None, mention: Optional[str] = None) -> bool:
+        """Queue a message for a channel (thread-safe)
+
+        Args:
+            channel: Object with an async send(text), e.g. a twitchio Channel
+            text: Message text (without the mention)
+            priority: PRIORITY_RESPONSE or PRIORITY_NOTICE
+            coalesce_key: Messages with the same key that are still waiting are
+                merged into one; their mentions are combined
+            mention: User to mention in front of the text
+
+        Returns:
+            bool: False if the message was merged into a waiting one or dropped
+        """
+        if not text or not text.strip():
+            return False
+        with self._lock:
+            if coalesce_key is not None:
+                waiting = self._pending.get(coalesce_key)
+                if waiting is not None:
+                    self.coalesced += 1
+                    if mention and mention not in waiting.mentions and \
+                            len(waiting.render()) + len(mention) + 2 <= MAX_MESSAGE_LENGTH:
+                        waiting.mentions.append(mention)
+                    return False
+
+            lane = self._lanes[priority]
+            if len(lane) >= MAX_LANE_DEPTH[priority]:
+                # Вытесняем самое старое сообщение этой полосы
+                self._forget(lane.popleft())
+                self.dropped += 1
+
+            item = _Outgoing(channel, text, priority, coalesce_key, mention)
+            lane.append(item)
+            if coalesce_key is not None:
+                self._pending[coalesce_key] = item
+            self.max_depth = max(self.max_depth, self._depth())
+        self._wake()
+        return True
+
+    def _forget(self, item: _Outgoing):
+        if item.coalesce_key is not None and self._pending.get(item.coalesce_key) is item:
+            del self._pending[item.coalesce_key]
+
+    def _depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def _wake(self):
+        loop, wakeup = self._loop, self._wakeup
+        if loop is not None and wakeup is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def _next(self) -> Optional[_Outgoing]:
+        """Oldest message of the highest non-empty lane, stale notices are dropped"""
+        now = time.monotonic()
+        with self._lock:
+            for priority in LANES:
+                lane = self._lanes[priority]
+                while lane:
+                    item = lane.popleft()
+                    self._forget(item)
+                    if priority == PRIORITY_NOTICE and now - item.queued > NOTICE_TTL:
+                        self.expired += 1
+                        continue
+                    return item
+        return None
+
+    # --- Отправка ---
+
+    def start(self, loop=None):
+        """Start the sender task on the bot's loop (call from that loop's thread)"""
+        loop = loop or asyncio.get_event_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    def stop(self):
+        """Cancel the sender task (thread-safe), waiting messages are discarded"""
+        task, loop = self._task, self._loop
+        if task is not None and not task.done() and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(task.cancel)
+        self._task = None
+
+    async def close(self) -> int:
+        """Cancel the sender task and wait for it to finish (call from the bot's loop)
+
+        Returns:
+            int: Messages that were still waiting and are discarded
+        """
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        with self._lock:
+            return self._depth() + (self._current is not None)
+
+    async def _run(self):
+        try:
+            while True:
+                item = self._current = self._next()
+                if item is None:
+                    self._wakeup.clear()
+                    if self._depth() == 0:
+                        await self._wakeup.wait()
+                    continue
+
+                # Только лимит Twitch; паузы ответов выдерживает задача команды до enqueue
+                wait = self.bucket.delay()
+                if wait > 0:
+                    self.throttled_seconds += wait
+                    await asyncio.sleep(wait)
+                self.bucket.take()
+
+                waited = time.monotonic() - item.queued
+                try:
+                    await item.channel.send(item.render())
+                    self.sent += 1
+                    self._wait_total += waited
+                except Exception as e:
+                    self.errors += 1
+                    print(f"[SEND QUEUE] Error sending message: {e}")
+                self._current = None
+        except asyncio.CancelledError:
+            pass
+
+    # --- Метрики ---
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            depth = {('responses' if p == PRIORITY_RESPONSE else 'notices'): len(lane)
+                     for p, lane in self._lanes.items()}
+        return {
+            'mode': self.mode,
+            'depth': depth,
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'expired': self.expired,
+            'errors': self.errors,
+            'avg_wait': self._wait_total / self.sent if self.sent else 0.0,
+            'throttled_seconds': round(self.throttled_seconds, 3),
+        }
@@ -0,0 +1,44 @@
+"""
+Startup timing for Command Editor.
+
+Import this module first: the clock starts at import time and every
+mark() records how long the previous startup stage took.
+"""
+
+import time
+
+
+class StartupTimer:
+    """Collects named checkpoints during application startup"""
+
+    def __init__(self, target_ms: float = 500):
+        self.target_ms = target_ms
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.stages = []
+        self.reported = False
+
+    def mark(self, stage: str):
+        """Record the time spent since the previous mark"""
+        now = time.perf_counter()
+        self.stages.append((stage, (now - self._last) * 1000))
+        self._last = now
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def report(self):
+        """Print the startup breakdown (only once)"""
+        if self.reported:
+            return
+        self.reported = True
+        self.mark("first paint")
+        total = self.total_ms()
+        print(f"[STARTUP] Main window shown in {total:.0f} ms (target {self.target_ms:.0f} ms)")
+        for stage, elapsed in self.stages:
+            print(f"[STARTUP]   {stage:<20} {elapsed:7.1f} ms")
+        if total > self.target_ms:
+            print(f"[STARTUP] Startup is {total - self.target_ms:.0f} ms over target")
+
+
+startup_timer = StartupTimer()
@@ -12,7 +12,7 @@ class SysCommandsTab(QWidget):
     def __init__(self, parent=None):
         super().__init__()
         self.parent = parent
-        self.config_manager = ConfigManager()
+        self.config_manager = getattr(parent, 'config_manager', None) or ConfigManager.instance()
         
         # Define original system commands with their default settings
         self.original_commands = [
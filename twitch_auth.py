@@ -13,8 +13,8 @@ class TwitchAuthDialog(QDialog):
         self.setWindowTitle("Twitch Authentication")
         self.setModal(True)
         
-        # Initialize config manager
-        self.config_manager = ConfigManager()
+        # Initialize config manager (shared with the parent window when possible)
+        self.config_manager = getattr(parent, 'config_manager', None) or ConfigManager.instance()
         
         # Load saved tokens
         twitch_config = self.config_manager.get_twitch_config()
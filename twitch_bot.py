@@ -2,8 +2,11 @@ import asyncio
 import json
 import os
 import time
-import pygame
-import concurrent.futures  # Добавляем необходимый импорт
+try:
+    import pygame
+except ImportError:  # Без pygame бот работает без звука (headless daemon)
+    pygame = None
+from contextlib import contextmanager
 from twitchio.ext import commands
 from twitchio.ext.commands import errors
 from config_manager import ConfigManager
@@ -11,15 +14,58 @@ from pathlib import Path
 import traceback
 import requests
 from currency_manager import CurrencyManager
+from channel_context import ChannelContext, current_channel
+from send_queue import SendQueue, PRIORITY_RESPONSE, PRIORITY_NOTICE
+from command_keys import normalize_command_key
+from command_trie import CommandIndex
+from connection_health import ConnectionHealth
+from response_templates import command_values, compile_lines, compile_template, precompile
 from typing import Union
 
+HELIX_BATCH = 100  # Максимум логинов/id в одном запросе Helix
+SUGGEST_INTERVAL = 30  # Подсказки "did you mean" в канале не чаще раза в 30 секунд
+
+
+def _channel_attr(attr):
+    """Bot attribute stored in the context of the channel being handled"""
+    def getter(self):
+        return getattr(self._context(), attr)
+
+    def setter(self, value):
+        setattr(self._context(), attr, value)
+    return property(getter, setter)
+
+
 class TwitchBot(commands.Bot):
+
+    # Состояние канала: у каждого канала свои команды, кулдауны и валюта
+    channel = _channel_attr('name')
+    _commands_list = _channel_attr('commands')
+    currency_manager = _channel_attr('currency_manager')
+    global_cooldowns = _channel_attr('global_cooldowns')
+    user_cooldowns = _channel_attr('user_cooldowns')
+    broadcaster_id = _channel_attr('broadcaster_id')
+    moderator_id = _channel_attr('moderator_id')
+    is_live = _channel_attr('is_live')
+    active_users = _channel_attr('active_users')
+    all_viewers = _channel_attr('all_viewers')
+    presence = _channel_attr('presence')
+    activity = _channel_attr('activity')
     
-    def __init__(self, channel, message_callback=None, commands_data=None, sound_channel=None, config_manager=None, currency_manager=None, **kwargs):
+    def __init__(self, channel, message_callback=None, commands_data=None, sound_channel=None, config_manager=None, currency_manager=None,
+                 channel_contexts=None, resolve_broadcaster=True, **kwargs):
+        # Каналы бота: один канал из GUI или несколько контекстов из MultiChannelRuntime
+        if channel_contexts:
+            contexts = list(channel_contexts)
+        else:
+            contexts = [ChannelContext(channel, commands_data, currency_manager)]
+        self._channel_contexts = {ctx.name: ctx for ctx in contexts}
+        self.primary_context = contexts[0]
+
         # Загружаем настройки Twitch
         if not config_manager:
             from config_manager import ConfigManager
-            config_manager = ConfigManager()
+            config_manager = ConfigManager.instance()
         self.config_manager = config_manager
         
         config = self.config_manager.get_twitch_config()
@@ -35,7 +81,7 @@ class TwitchBot(commands.Bot):
         super().__init__(
             token=token,
             prefix=prefix,
-            initial_channels=[channel],
+            initial_channels=list(self._channel_contexts),
             # Добавляем важные capabilities для получения рейдов и других событий
             reconnect=True,
             capabilities=['tags', 'commands', 'membership'],
@@ -50,7 +96,9 @@ class TwitchBot(commands.Bot):
             
             # Инициализация для проигрывания звуков
             self.loaded_sounds = {}
-            self.sound_channel = sound_channel or pygame.mixer.Channel(1)  # Канал 1, чтобы не конфликтовать с CommandEditor
+            if sound_channel is None and pygame is not None and pygame.mixer.get_init():
+                sound_channel = pygame.mixer.Channel(1)  # Канал 1, чтобы не конфликтовать с CommandEditor
+            self.sound_channel = sound_channel  # None - звук отключен
             
             # Отладочное сообщение
             print(f"TwitchBot initialized with sound channel and interruption settings: allow_sound_interruption={self.allow_sound_interruption}")
@@ -60,12 +108,10 @@ class TwitchBot(commands.Bot):
             
             self.prefix = prefix
             
-            # ⚠️ Важно использовать другое имя для списка команд, чтобы избежать конфликта
-            self._commands_list = commands_data or []  # Вместо self.commands
-            
+            # Все исходящие сообщения идут через очередь с лимитами Twitch
+            self.send_queue = SendQueue(self.config_manager.get_chat_rate_mode())
+
             # Основные настройки
-            self.channel = channel.lower()
-            self.is_live = False
             self.is_running = True
             self.volume = 0.5
             self.message_callback = message_callback
@@ -79,22 +125,19 @@ class TwitchBot(commands.Bot):
             self.reconnect_task = None
             self.connection_check_task = None
             self.reconnect_attempts = 0
-            self.max_reconnect_attempts = 5
-            
-            # Отслеживание пользователей
-            self.active_users = set([channel.lower()])  # Инициализируем с владельцем канала
+            self.max_reconnect_attempts = 10  # Задержки растут экспоненциально, до 5 минут
+            self.health = ConnectionHealth()
+            self.last_cooldown_cleanup = time.time()
             
             # Сигнал-хэндлер (будет установлен извне)
             self.signal_handler = None
             
             # ⚠️ Используем переданный currency_manager или создаем новый если не передан
-            self.currency_manager = currency_manager or CurrencyManager()
-            if hasattr(self.currency_manager, 'load_settings'):
-                self.currency_manager.load_settings()
-            
-            # Инициализируем словарь для отслеживания кулдаунов
-            self.global_cooldowns = {}  # {нормализованная_команда: время_последнего_использования}
-            self.user_cooldowns = {}    # {нормализованная_команда: {пользователь: время_последнего_использования}
+            for ctx in contexts:
+                if ctx.currency_manager is None:
+                    ctx.currency_manager = CurrencyManager()
+                if hasattr(ctx.currency_manager, 'load_settings'):
+                    ctx.currency_manager.load_settings()
             
             # Заголовки для Helix
             client_id = config.get("client_id")
@@ -104,26 +147,12 @@ class TwitchBot(commands.Bot):
                 "Authorization": f"Bearer {bare_token}"
             }
             
-            # Получаем broadcaster_id
-            try:
-                resp = requests.get(
-                    "https://api.twitch.tv/helix/users",
-                    headers=self._helix_headers,
-                    params={"login": channel}
-                )
-                data = resp.json()
-                self.broadcaster_id = data["data"][0]["id"]
-                self.moderator_id = self.broadcaster_id
-            except Exception as e:
-                print(f"Error fetching broadcaster ID: {e}")
-                self.broadcaster_id = None
-                self.moderator_id = None
-            
-            print(f"Bot initialized with channel: {channel}")
+            # Получаем broadcaster_id (одним запросом для всех каналов)
+            # resolve_broadcaster=False - без Helix вообще (офлайн-прогоны load_harness)
+            if resolve_broadcaster:
+                self.resolve_broadcaster_ids([ctx for ctx in contexts if not ctx.broadcaster_id])
             
-            # Для отслеживания кулдаунов команд
-            self.global_cooldowns = {}  # {команда: время_использования}
-            self.user_cooldowns = {}    # {команда: {пользователь: время_использования}}
+            print(f"Bot initialized with channels: {', '.join(self._channel_contexts)}")
         except Exception as e:
             print(f"CRITICAL ERROR in __init__: {e}")
             import traceback
@@ -137,11 +166,107 @@ class TwitchBot(commands.Bot):
     def update_commands(self, commands_list):
         """Вызывается из CommandEditor после каждой правки таблицы"""
         self._commands_list = commands_list or []
+        self._context().commands_version += 1  # Индекс команд перестроится при следующем сообщении
+        # Ответы разбираются сейчас, а не при каждом использовании команды
+        precompile(cmd.get("Response", "") for cmd in self._commands_list)
+
+    def command_index(self):
+        """Trie of the enabled commands of the current channel, rebuilt only when they change"""
+        ctx = self._context()
+        aliases = self.config_manager.get_command_aliases()
+        index_key = (ctx.commands_version, self.config_manager.system_commands_version(), aliases)
+        if ctx.command_index is None or ctx.command_index_key != index_key:
+            ctx.command_index = CommandIndex(self.config_manager.load_system_commands(), ctx.commands,
+                                             aliases, prefix=self.prefix)
+            ctx.command_index_key = index_key
+            print(f"Command index built for {ctx.name}: {len(ctx.command_index)} keys "
+                  f"({ctx.command_index.aliases} aliases)")
+        return ctx.command_index
+
+    def is_registered_command(self, *names):
+        """True if one of the names is a twitchio command from register_commands"""
+        return any(name and self.get_command(name) is not None for name in names)
+
+    async def suggest_command(self, channel, username, key, index):
+        """Reply "did you mean" to an unknown command, at most once per SUGGEST_INTERVAL"""
+        ctx = self._context()
+        now = time.time()
+        if now - ctx.last_suggestion < SUGGEST_INTERVAL:
+            return
+        suggestions = index.suggest(key)
+        if not suggestions:
+            return
+        ctx.last_suggestion = now
+        names = " or ".join(f"!{name}" for name in suggestions)
+        await self.notice(channel, username, f"unknown command !{key}, did you mean {names}?", key="suggestion")
+
+    def _context(self):
+        """Context of the channel handled by the current task, the first channel otherwise"""
+        ctx = current_channel.get()
+        if ctx is not None and self._channel_contexts.get(ctx.name) is ctx:
+            return ctx
+        return self.primary_context
+
+    @property
+    def channel_contexts(self):
+        """All channels served by this bot"""
+        return list(self._channel_contexts.values())
+
+    def context_for(self, channel_name):
+        """Context of a channel by login, None if the bot does not serve it"""
+        if not channel_name:
+            return None
+        return self._channel_contexts.get(channel_name.lower())
+
+    @contextmanager
+    def use_channel(self, ctx):
+        """Run code (or a task created inside) against the state of one channel"""
+        token = current_channel.set(ctx)
+        try:
+            yield ctx
+        finally:
+            current_channel.reset(token)
+
+    def _enter_channel(self, channel):
+        """Switch the current task to the context of a twitchio channel"""
+        ctx = self.context_for(getattr(channel, 'name', None)) or self.primary_context
+        current_channel.set(ctx)
+        return ctx
+
+    def _current_chat(self):
+        """twitchio channel object of the current context, None if not joined"""
+        chat = self.get_channel(self.channel)
+        if chat is None and len(self.connected_channels) > 0:
+            chat = self.connected_channels[0]
+        return chat
+
+    def resolve_broadcaster_ids(self, contexts):
+        """Fill broadcaster_id of the given channels via Helix, 100 logins per request"""
+        contexts = list(contexts)
+        for start in range(0, len(contexts), HELIX_BATCH):
+            batch = contexts[start:start + HELIX_BATCH]
+            try:
+                resp = requests.get(
+                    "https://api.twitch.tv/helix/users",
+                    headers=self._helix_headers,
+                    params=[("login", ctx.name) for ctx in batch],
+                    timeout=10
+                )
+                ids = {user["login"].lower(): user["id"] for user in resp.json().get("data", [])}
+            except Exception as e:
+                print(f"Error fetching broadcaster ID: {e}")
+                ids = {}
+            for ctx in batch:
+                ctx.broadcaster_id = ids.get(ctx.name)
+                ctx.moderator_id = ctx.broadcaster_id
+                if not ctx.broadcaster_id:
+                    print(f"Broadcaster ID not found for channel {ctx.name}")
 
     async def event_ready(self):
         print(f"Bot is ready! Connected to {self.channel}")
         # Ensure self.loop references the correct asyncio loop for run_coroutine_threadsafe
         self.loop = asyncio.get_event_loop()
+        self.health.on_connected()
         try:
             # Загрузка списка зрителей сразу при первом подключении
             viewers = await self.get_all_viewers()
@@ -157,9 +282,7 @@ class TwitchBot(commands.Bot):
                 self.signal_handler.all_viewers_signal.emit(viewers)
                 self.signal_handler.chat_signal.emit(f"Connected to {self.channel}. Loaded {len(viewers)} viewers.")
                 
-                # Также обновляем активных зрителей (первоначально это тот же список)
-                # self.active_users уже был инициализирован в __init__, обновляем его
-                self.active_users = set(viewers)
+                # Активные - только те, кто писал в чат за окно активности
                 self.signal_handler.active_viewers_signal.emit(list(self.active_users))
             
             # Проверка статуса стрима
@@ -176,42 +299,64 @@ class TwitchBot(commands.Bot):
             print(f"CRITICAL ERROR in event_ready: {e}")
             import traceback; traceback.print_exc()
 
-    async def send_multiline_response(self, channel, response_text, username):
+    async def say(self, channel, text, priority=PRIORITY_RESPONSE, coalesce_key=None, mention=None):
+        """Queue a chat message; the send queue paces it within the rate limit"""
+        self.send_queue.start()
+        return self.send_queue.enqueue(channel, text, priority, coalesce_key, mention)
+
+    async def notice(self, channel, username, text, key=None):
+        """Queue a low-priority notice to a user
+
+        Waiting notices with the same key are merged into one message that
+        mentions every user; without a key only exact repeats to the same user
+        are merged.
+        """
+        channel_name = getattr(channel, 'name', None)
+        coalesce_key = (channel_name, key) if key is not None else (channel_name, username, text)
+        return await self.say(channel, text, PRIORITY_NOTICE, coalesce_key=coalesce_key, mention=username)
+
+    async def send_multiline_response(self, channel, response_text, username, values=None):
         """
         Отправляет многострочный ответ, где каждая строка отправляется отдельным сообщением.
-        Строки, содержащие только пробелы, создают задержку в 1 секунду.
+        Строки, содержащие только пробелы, создают задержку в 0.2 секунды.
+        Переменные ответа (см. response_templates) берутся из values, {user} - имя пользователя.
         """
         if not response_text or not response_text.strip():
             return
-            
-        # Разбиваем ответ на строки
-        lines = response_text.split('\n')
-        
-        for line in lines:
-            # Проверяем, содержит ли строка только пробелы (задержка)
-            if line.isspace() or line == '':
-                # Создаем задержку в 0.2 секунды
-                await asyncio.sleep(0.2)
-                continue
 
-            # Заменяем {user} на имя пользователя
-            formatted_line = line.replace("{user}", username)
-            
-            # Отправляем непустую строку как отдельное сообщение
-            if formatted_line.strip():
-                await channel.send(formatted_line)
-                # Небольшая задержка между сообщениями для избежания rate limit
-                await asyncio.sleep(0.1)
+        # Шаблон разобран при загрузке команд, здесь только подстановка значений
+        response = compile_lines(response_text)
+        if values is None:
+            values = {'username': username}
+        # Каждая непустая строка - отдельное сообщение; пауза пустых строк выдерживается
+        # в задаче этой команды, общая очередь отправки других каналов не ждет
+        for delay, line in response.render(values):
+            if delay:
+                await asyncio.sleep(delay)
+            await self.say(channel, line)
+
+    def response_values(self, response_text, username, content='', cmd=None):
+        """Values of the variables used in a command response"""
+        return command_values(compile_lines(response_text).fields, username,
+                              currency_manager=self.currency_manager, content=content,
+                              count=cmd.get("Count", 0) if cmd else None,
+                              viewers=self.all_viewers)
 
     async def event_message(self, message):
         # When we receive a message, we know the connection is active
         # Reset the heartbeat and reconnection attempt counters
         self.last_heartbeat = time.time()
         self.reconnect_attempts = 0
+
+        # Дальше вся задача работает с командами, кулдаунами и валютой канала сообщения
+        ctx = self._enter_channel(message.channel)
         
         # Игнорируем эхо собственного бота
         if message.echo:
+            ctx.stats.record_sent()
             return
+        ctx.stats.record_message()
+        ctx.activity.record(message.author.name)
             
         # Выводим сообщение в UI
         if self.message_callback:
@@ -236,11 +381,18 @@ class TwitchBot(commands.Bot):
         if not key:  # Проверка на пустую команду после нормализации
             print("Empty command after normalization, ignoring")
             return
+        ctx.stats.record_command()
         
 
 
+        # Поиск команды по дереву ключей: системные, затем свои, затем псевдонимы
+        index = self.command_index()
+        match = index.get(key)
+        if match is not None:
+            key = match.key  # Псевдоним ведет на ключ самой команды
+
         # Check for system commands from the sys_commands tab
-        system_commands = self.config_manager.load_system_commands()
+        system_commands = [match.command] if match is not None and match.kind == 'system' else []
         for sys_cmd in system_commands:
             # Skip disabled commands
             if not sys_cmd.get("enabled", False):
@@ -257,10 +409,10 @@ class TwitchBot(commands.Bot):
                 user_is_mod = await self.is_user_moderator(username)
                 
                 if required_permission == "moderator" and not user_is_mod:
-                    await message.channel.send(f"@{username}: You don't have permission to use this command.")
+                    await self.notice(message.channel, username, "You don't have permission to use this command.", key="permission")
                     return
                 elif required_permission == "admin" and not user_is_mod:  # Simplified admin check
-                    await message.channel.send(f"@{username}: You don't have permission to use this command.")
+                    await self.notice(message.channel, username, "You don't have permission to use this command.", key="permission")
                     return
                 
                 # Check cooldowns
@@ -275,9 +427,7 @@ class TwitchBot(commands.Bot):
                     elapsed = current_time - last_used
                     if elapsed < cooldown_sec:
                         remaining = int(cooldown_sec - elapsed)
-                        await message.channel.send(
-                            f"@{username}: command is on cooldown. Try in {remaining} sec."
-                        )
+                        await self.notice(message.channel, username, f"command is on cooldown. Try in {remaining} sec.", key=("cooldown", cmd_key))
                         return
                 
                 # User cooldown check
@@ -286,33 +436,28 @@ class TwitchBot(commands.Bot):
                     elapsed = current_time - last_used
                     if elapsed < user_cooldown_sec:
                         remaining = int(user_cooldown_sec - elapsed)
-                        await message.channel.send(
-                            f"@{username}: you can use this command in {remaining} sec."
-                        )
+                        await self.notice(message.channel, username, f"you can use this command in {remaining} sec.")
                         return
                 
                 # Check command cost
                 cost = int(sys_cmd.get("cost", 0))
+                reservation = None
                 if cost > 0:
-                    # Check if user has enough points
-                    current_points = self.currency_manager.get_points(username)
-                    if current_points < cost:
+                    # Hold the points; they are written only after the command ran
+                    reservation = self.currency_manager.reserve(username, cost)
+                    if reservation is None:
+                        current_points = self.currency_manager.get_points(username)
                         formatted_points = f"{float(current_points):.2f}"
-                        await message.channel.send(
-                            f"@{username}: Not enough points. Cost: {cost} (you have {formatted_points})"
-                        )
-                        return
-                    
-                    # Deduct points
-                    if not self.currency_manager.pay_for_command(username, cost):
-                        formatted_points = f"{float(current_points):.2f}"
-                        await message.channel.send(
-                            f"@{username}: Payment error. Cost: {cost} (you have {formatted_points})"
-                        )
+                        await self.notice(message.channel, username, f"Not enough points. Cost: {cost} (you have {formatted_points})")
                         return
                 
                 # Execute the command based on its type
-                await self.execute_system_command(message, username, sys_cmd, content)
+                try:
+                    await self.execute_system_command(message, username, sys_cmd, content)
+                except Exception:
+                    self.currency_manager.rollback(reservation)
+                    raise
+                self.currency_manager.commit(reservation)
                 
                 # Update cooldowns after successful execution
                 if cooldown_sec > 0:
@@ -323,9 +468,8 @@ class TwitchBot(commands.Bot):
                 return  # Command processed, exit the event_message method
 
         # Далее обрабатываем кастомные команды как раньше
-
-        # Далее обрабатываем кастомные команды как раньше
-        for cmd in getattr(self, "_commands_list", []):
+        custom_commands = [match.command] if match is not None and match.kind == 'custom' else []
+        for cmd in custom_commands:
             if not cmd.get("Enabled", False):
                 continue
 
@@ -354,9 +498,7 @@ class TwitchBot(commands.Bot):
             
             if cooldown_sec > 0 and elapsed < cooldown_sec:
                 remaining = int((cooldown_sec - elapsed))
-                await message.channel.send(
-                    f"@{username}: command is on cooldown. Try in {remaining} sec."
-                )
+                await self.notice(message.channel, username, f"command is on cooldown. Try in {remaining} sec.", key=("cooldown", normalized_key))
                 return
 
             # UserCooldown тоже в минутах
@@ -368,40 +510,24 @@ class TwitchBot(commands.Bot):
                 u_elapsed = current_time - user_last
                 if u_elapsed < user_cd_sec:
                     u_rem = int(user_cd_sec - u_elapsed)
-                    await message.channel.send(
-                        f"@{username}: you can use this command in {u_rem} sec."
-                    )
+                    await self.notice(message.channel, username, f"you can use this command in {u_rem} sec.")
                     return
                 
             # Проверка стоимости ПЕРЕД фиксацией времени кулдауна
             cost = int(cmd.get("Cost", 0))
-            points_deducted = False
+            reservation = None
             
             if cost > 0:
-                # Проверяем баланс перед списанием
-                current_points = self.currency_manager.get_points(username)
-                print(f"User {username} has {current_points} points, command costs {cost}")
-                
-                if current_points < cost:
-                    formatted_points = f"{float(current_points):.2f}"
-                    await message.channel.send(
-                        f"@{username}: Not enough points. Cost: {cost} (you have {formatted_points})"
-                    )
-                    return
-
-                # Списываем поинты только если достаточно средств
-                if self.currency_manager.pay_for_command(username, cost):
-                    points_deducted = True
-                    print(f"Deducted {cost} points from {username}")
-                else:
-                    # Этого не должно происходить, но на всякий случай
-                    print(f"Failed to deduct points from {username}")
+                # Резервируем поинты в памяти: проверка баланса и списание - одна операция,
+                # запись на диск только после выполнения команды
+                reservation = self.currency_manager.reserve(username, cost)
+                if reservation is None:
                     current_points = self.currency_manager.get_points(username)
+                    print(f"User {username} has {current_points} points, command costs {cost}")
                     formatted_points = f"{float(current_points):.2f}"
-                    await message.channel.send(
-                        f"@{username}: Payment error. Cost: {cost} (you have {formatted_points})"
-                    )
+                    await self.notice(message.channel, username, f"Not enough points. Cost: {cost} (you have {formatted_points})")
                     return
+                print(f"Reserved {cost} points from {username}")
                 
             # Выполняем саму команду
             # Флаги для отслеживания выполнения частей команды
@@ -410,25 +536,34 @@ class TwitchBot(commands.Bot):
             has_sound = False
             sound_played = False
             
-            # Отправка текста-ответа (многострочного)
-            resp = cmd.get("Response", "")
-            if resp and resp.strip():
-                has_response = True
-                await self.send_multiline_response(message.channel, resp, message.author.name)
-                command_executed = True
-                print(f"Sent multiline response for command '{cmd_key}'")
-                
-            # Проигрывание звука
-            sf = cmd.get("SoundFile", "").strip()
-            if sf:
-                has_sound = True
-                volume = int(cmd.get("Volume", 100))
-                sound_played = self.play_sound(sf, volume)
-                if sound_played:
-                    print(f"Successfully played sound for command '{cmd_key}'")
+            try:
+                # Отправка текста-ответа (многострочного)
+                resp = cmd.get("Response", "")
+                if resp and resp.strip():
+                    has_response = True
+                    values = self.response_values(resp, message.author.name, content, cmd)
+                    await self.send_multiline_response(message.channel, resp, message.author.name, values)
                     command_executed = True
+                    print(f"Sent multiline response for command '{cmd_key}'")
+                    
+                # Проигрывание звука
+                sf = cmd.get("SoundFile", "").strip()
+                if sf:
+                    has_sound = True
+                    volume = int(cmd.get("Volume", 100))
+                    sound_played = self.play_sound(sf, volume)
+                    if sound_played:
+                        print(f"Successfully played sound for command '{cmd_key}'")
+                        command_executed = True
+                    else:
+                        print(f"Failed to play sound for command '{cmd_key}'")
+            except Exception:
+                # Ошибка до выполнения команды - поинты возвращаются как были
+                if not command_executed:
+                    self.currency_manager.rollback(reservation)
                 else:
-                    print(f"Failed to play sound for command '{cmd_key}'")
+                    self.currency_manager.commit(reservation)
+                raise
                     
             # Команда считается выполненной если либо был отправлен ответ,
             # либо успешно проигран звук, либо оба действия
@@ -436,6 +571,7 @@ class TwitchBot(commands.Bot):
             # Применяем кулдауны и увеличиваем счетчик ТОЛЬКО если команда была успешно выполнена
             if command_executed:
                 print(f"Command '{cmd_key}' was successfully executed by {username}")
+                self.currency_manager.commit(reservation)
                 # Фиксируем время кулдаунов, используя нормализованный ключ
                 normalized_key = self.normalize_command_key(cmd_key)
                 if cooldown_sec > 0:
@@ -457,7 +593,7 @@ class TwitchBot(commands.Bot):
                 
                 # Детализируем причину в зависимости от типа команды и ситуации
                 if has_sound and not sound_played:
-                    if self.sound_channel.get_busy():
+                    if self.sound_channel is not None and self.sound_channel.get_busy():
                         reason = "Sound blocked: another sound is already playing"
                     else:
                         reason = "Sound file could not be played"
@@ -466,27 +602,22 @@ class TwitchBot(commands.Bot):
                 if has_response and has_sound and not sound_played:
                     reason = "Text response sent, but sound was blocked"
                 
-                # Возвращаем стоимость команды пользователю, если она была списана
-                if points_deducted and cost > 0:
-                    self.currency_manager.add_points(username, cost)
+                # Возвращаем ровно зарезервированную сумму, без бонусов и без записи на диск
+                if self.currency_manager.rollback(reservation):
                     print(f"Refunded {cost} points to {username} because {reason.lower()}")
                     
-                    # Сохраняем изменения сразу после возврата
-                    self.currency_manager.save_users()
-                    print(f"Points refund saved to currency file for {username}")
-                    
                     # Подготовка сообщения пользователю
-                    response_message = f"@{username}: {reason}. {cost} points refunded."
+                    response_message = f"{reason}. {cost} points refunded."
                     
                     # Специальный случай для звуковых команд без текста
                     if has_sound and not has_response and not sound_played:
                         # Проверяем, нужно ли вообще показывать сообщение о блокировке
                         show_message = getattr(self, 'show_interruption_message', False)
                         if show_message:
-                            await message.channel.send(response_message)
+                            await self.notice(message.channel, username, response_message)
                     else:
                         # Для всех остальных случаев всегда показываем сообщение
-                        await message.channel.send(response_message)
+                        await self.notice(message.channel, username, response_message)
                 
             return  # Команда обработана
             
@@ -495,8 +626,12 @@ class TwitchBot(commands.Bot):
             await self.handle_commands(message)
         except errors.CommandNotFound:
             pass  # игнорируем, если и тут не найдено
+        # Подсказка только если команду не знает ни индекс, ни twitchio (!points_add и т.п.)
+        if not self.is_registered_command(raw_key, key):
+            await self.suggest_command(message.channel, username, key, index)
 
     async def event_command_error(self, ctx, error):
+        self._context().stats.record_error()
         if isinstance(error, errors.CommandNotFound):
             return
         # остальное бросаем дальше
@@ -528,6 +663,8 @@ class TwitchBot(commands.Bot):
         try:
             print("Stopping Twitch bot...")
             self.is_running = False
+            if hasattr(self, 'send_queue'):
+                self.send_queue.stop()
             
             # Отключаемся от канала
             if hasattr(self, 'loop') and self.loop:
@@ -546,7 +683,7 @@ class TwitchBot(commands.Bot):
                     print(f"Error during disconnect: {e}")
             
             # Останавливаем аудио
-            if pygame.mixer and pygame.mixer.get_init():
+            if pygame is not None and pygame.mixer and pygame.mixer.get_init():
                 pygame.mixer.stop()
                 
             print("Bot stopped successfully")
@@ -559,6 +696,10 @@ class TwitchBot(commands.Bot):
         """Проигрывание звукового файла с учетом настроек прерывания и громкости
         Возвращает True, если звук был успешно запущен, False в противном случае"""
         try:
+            if self.sound_channel is None:
+                print(f"Sound is disabled, not playing: {filepath}")
+                return False
+
             # Проверка существования файла
             if not os.path.exists(filepath):
                 print(f"Sound file not found: {filepath}")
@@ -604,17 +745,17 @@ class TwitchBot(commands.Bot):
             traceback.print_exc()
             return False  # В случае ошибки
 
-    async def get_all_viewers(self) -> list:
-        """Get chatters via Helix API /chat/chatters"""
+    def fetch_chatters(self, broadcaster_id, moderator_id) -> list:
+        """Chatters of a channel via Helix /chat/chatters (blocking)"""
         viewers = []
-        if self.broadcaster_id and self.moderator_id:
+        if broadcaster_id and moderator_id:
             try:
                 resp = requests.get(
                     "https://api.twitch.tv/helix/chat/chatters",
                     headers=self._helix_headers,
                     params={
-                        "broadcaster_id": self.broadcaster_id,
-                        "moderator_id": self.moderator_id
+                        "broadcaster_id": broadcaster_id,
+                        "moderator_id": moderator_id
                     },
                     timeout=5
                 )
@@ -623,10 +764,42 @@ class TwitchBot(commands.Bot):
                     viewers.append(user.get("user_login", "").lower())
             except Exception as e:
                 print(f"Error getting chatters via Helix: {e}")
-        # fallback на активных, если Helix не сработал
-        if not viewers:
+        return viewers
+
+    def fetch_live_status(self, broadcaster_ids) -> dict:
+        """{broadcaster_id: is_live} for many channels, 100 per Helix request (blocking)
+
+        Channels whose request failed are left out of the result.
+        """
+        broadcaster_ids = [bid for bid in broadcaster_ids if bid]
+        status = {}
+        for start in range(0, len(broadcaster_ids), HELIX_BATCH):
+            batch = broadcaster_ids[start:start + HELIX_BATCH]
+            try:
+                response = requests.get(
+                    "https://api.twitch.tv/helix/streams",
+                    headers=self._helix_headers,
+                    params=[("user_id", bid) for bid in batch] + [("first", HELIX_BATCH)],
+                    timeout=5
+                )
+                if response.status_code != 200:
+                    print(f"Error checking stream status: API returned {response.status_code}")
+                    continue
+                live = {stream.get("user_id") for stream in response.json().get("data", [])}
+                status.update({bid: bid in live for bid in batch})
+            except Exception as e:
+                print(f"Error checking stream status: {e}")
+        return status
+
+    async def get_all_viewers(self) -> list:
+        """Get chatters via Helix API /chat/chatters"""
+        viewers = self.fetch_chatters(self.broadcaster_id, self.moderator_id)
+        if viewers:
+            self._context().update_viewers(viewers)
+        else:
+            # fallback на активных, если Helix не сработал; сессии присутствия не трогаем
             viewers = list(getattr(self, "active_users", [self.channel.lower()]))
-        self.all_viewers = viewers
+            self.all_viewers = viewers
         return viewers
 
     async def check_if_live(self, *args) -> bool:
@@ -730,8 +903,7 @@ class TwitchBot(commands.Bot):
                         api_mods.append(mod_name)
                         
                         # Обновляем статус модератора в системе валюты
-                        if hasattr(self, 'currency_manager') and mod_name in self.currency_manager.users:
-                            self.currency_manager.users[mod_name]['is_mod'] = True
+                        if hasattr(self, 'currency_manager') and self.currency_manager.set_user_fields(mod_name, {'is_mod': True}):
                             print(f"User {mod_name} marked as moderator (API)")
                 else:
                     print(f"Error fetching moderators: API returned {response.status_code}")
@@ -749,19 +921,17 @@ class TwitchBot(commands.Bot):
             # Обновляем статус модераторов в системе валюты для всех
             if hasattr(self, 'currency_manager'):
                 for mod_name in mods:
-                    if mod_name in self.currency_manager.users:
-                        self.currency_manager.users[mod_name]['is_mod'] = True
+                    if self.currency_manager.set_user_fields(mod_name, {'is_mod': True}):
                         print(f"User {mod_name} marked as moderator")
                 
                 # Убираем статус модератора у исключенных пользователей
                 for excluded_mod in excluded_mods:
-                    if excluded_mod in self.currency_manager.users:
-                        self.currency_manager.users[excluded_mod]['is_mod'] = False
+                    if self.currency_manager.set_user_fields(excluded_mod, {'is_mod': False}):
                         print(f"User {excluded_mod} excluded from moderators")
                 
                 # Отмечаем владельца канала (если он не в исключенных)
-                if self.channel.lower() not in excluded_mods and self.channel.lower() in self.currency_manager.users:
-                    self.currency_manager.users[self.channel.lower()]['is_mod'] = True
+                if self.channel.lower() not in excluded_mods and \
+                        self.currency_manager.set_user_fields(self.channel.lower(), {'is_mod': True}):
                     print(f"Channel owner {self.channel} marked as moderator")
                 
                 # Сохраняем изменения в системе валюты
@@ -830,105 +1000,87 @@ class TwitchBot(commands.Bot):
             # По умолчанию не модератор при ошибке
             return False
             
+    def _irc_connection(self):
+        """twitchio websocket connection object, None if not connected"""
+        return getattr(self, '_connection', None) or getattr(self, '_ws', None)
+
+    def _socket_open(self):
+        connection = self._irc_connection()
+        socket = getattr(connection, '_websocket', None) or getattr(connection, 'socket', None)
+        return socket is not None and not socket.closed
+
+    async def event_raw_data(self, data):
+        """Every line from IRC: inbound traffic and PONGs feed the health monitor"""
+        if ' PONG ' in data or data.startswith('PONG'):
+            self.health.on_pong()
+        else:
+            self.health.on_inbound()
+
+    async def event_join(self, channel, user):
+        """IRC JOIN opens a presence session (Twitch sends them for channels under 1000 chatters)"""
+        ctx = self.context_for(getattr(channel, 'name', None))
+        if ctx is not None and getattr(user, 'name', None):
+            ctx.presence.join(user.name)
+
+    async def event_part(self, user):
+        """IRC PART closes the presence session"""
+        ctx = self.context_for(getattr(getattr(user, 'channel', None), 'name', None))
+        if ctx is not None and getattr(user, 'name', None):
+            ctx.presence.part(user.name)
+
+    def connection_metrics(self):
+        """RTT, reconnects, downtime and idle time of the IRC connection"""
+        return self.health.metrics()
+
     async def _check_connection(self):
-        """Check and maintain connection"""
+        """Watch the connection without polling
+
+        The task sleeps until the connection has been quiet for
+        health.idle_probe_after seconds. Chat traffic moves that deadline, so a
+        busy channel is never probed. A quiet connection gets one PING; if no
+        PONG (or other line) arrives within health.pong_timeout, it is
+        reconnected.
+        """
         try:
-            connection_check_failures = 0  # Счётчик неудачных проверок
-            last_successful_check = time.time()  # Время последней успешной проверки
-            
             while self.is_running:
                 try:
-                    await asyncio.sleep(10)  # Проверка каждые 10 секунд
-                    
-                    # Периодически очищаем кулдауны
-                    if time.time() % 300 < 10:  # Примерно каждые 5 минут
-                        self.cleanup_cooldowns()
-                    
-                    # Активная проверка соединения с Twitch IRC
-                    connection_alive = False
-                    
-                    # 1. Попытка активной проверки - отправка PING команды
-                    try:
-                        if hasattr(self, '_ws') and self._ws and self._ws.socket and not self._ws.socket.closed:
-                            # Если есть подключенные каналы, считаем что соединение активно
-                            if len(self.connected_channels) > 0:
-                                # Но проверяем это отправкой PING
-                                ping_future = asyncio.run_coroutine_threadsafe(
-                                    self._ws.send("PING :tmi.twitch.tv"),
-                                    self.loop
-                                )
-                                # Ожидаем завершения отправки PING в течение 3 секунд
-                                try:
-                                    ping_future.result(timeout=3)
-                                    # Если PING отправлен успешно, соединение живо
-                                    connection_alive = True
-                                    last_successful_check = time.time()
-                                    connection_check_failures = 0  # Сбрасываем счётчик неудач
-                                except (concurrent.futures.TimeoutError, RuntimeError) as e:
-                                    print(f"PING check failed: {e}")
-                                    connection_check_failures += 1
-                    except Exception as ws_error:
-                        print(f"WebSocket check error: {ws_error}")
-                        connection_check_failures += 1
-                    
-                    # 2. Проверка API Twitch (но не блокируем на ошибках API)
-                    try:
-                        if self._helix_headers:
-                            response = requests.get(
-                                "https://api.twitch.tv/helix/users",
-                                headers=self._helix_headers,
-                                params={"login": self.channel},
-                                timeout=3  # Короткий таймаут
-                            )
-                            
-                            # Если API доступен и ответ успешен, это хороший признак
-                            if response.status_code == 200:
-                                if not connection_alive:  # Если основная проверка не прошла
-                                    connection_alive = True
-                                    last_successful_check = time.time()
-                                    connection_check_failures = 0  # Сбрасываем счётчик неудач
-                            else:
-                                print(f"API check returned status code: {response.status_code}")
-                                connection_check_failures += 1
-                    except Exception as api_error:
-                        print(f"API check error: {api_error}")
-                        # Не считаем это критической ошибкой для IRC соединения
-                    
-                    # Проверяем время с момента последней успешной проверки
-                    time_since_last_success = time.time() - last_successful_check
-                    
-                    # Выводим информацию о состоянии
-                    print(f"Connection check: Connected={connection_alive}, " + 
-                          f"Failures={connection_check_failures}, " +
-                          f"Time since last success={time_since_last_success:.1f}s")
-                    
-                    # Принимаем решение о необходимости переподключения
-                    # - Если накопилось 3+ неудачных проверки подряд
-                    # - ИЛИ прошло больше 30 секунд с последней успешной проверки
-                    if connection_check_failures >= 3 or time_since_last_success > 30:
-                        print(f"Connection lost: failures={connection_check_failures}, " +
-                              f"last_success={time_since_last_success:.1f}s ago")
-                        
+                    await asyncio.sleep(self.health.next_check_in())
+
+                    # Периодически очищаем кулдауны (примерно каждые 5 минут)
+                    if time.time() - self.last_cooldown_cleanup > 300:
+                        self.last_cooldown_cleanup = time.time()
+                        for ctx in self.channel_contexts:
+                            with self.use_channel(ctx):
+                                self.cleanup_cooldowns()
+
+                    if self.health.is_dead() or not self._socket_open():
+                        metrics = self.health.metrics()
+                        print(f"Connection lost: idle={metrics['idle_seconds']}s, "
+                              f"missed_pongs={metrics['missed_pongs']}")
+                        self.health.on_disconnected()
+
                         # Уведомляем интерфейс о потере соединения
                         if hasattr(self, 'signal_handler') and self.signal_handler:
                             self.signal_handler.chat_signal.emit("Connection lost, attempting to reconnect...")
-                        
-                        # Инициируем переподключение
+
+                        # Инициируем переподключение; проверка продолжится после него
                         if not self.reconnect_task or self.reconnect_task.done():
                             self.reconnect_task = asyncio.create_task(self._reconnect())
-                        
-                        # Сбрасываем счётчики для следующей серии проверок после переподключения
-                        connection_check_failures = 0
+                        return
+
+                    if self.health.probe_due():
+                        # Соединение молчит - отправляем PING прямо из своего цикла
+                        connection = self._irc_connection()
+                        await connection.send("PING :tmi.twitch.tv")
+                        self.health.on_ping_sent()
                     else:
-                        # Обновляем время последнего хартбита, даже если текущая проверка не удалась
-                        # (но была успешная проверка недавно)
                         self.last_heartbeat = time.time()
-                        
+
                 except asyncio.CancelledError:
                     raise  # Пробрасываем отмену задачи дальше
                 except Exception as e:
                     print(f"Error in connection check: {e}")
-                    connection_check_failures += 1
+                    self.health.on_ping_sent()  # Ответа не будет - через pong_timeout соединение считается потерянным
                     await asyncio.sleep(3)  # Короткая пауза перед повторной попыткой
                     
         except asyncio.CancelledError:
@@ -937,6 +1089,7 @@ class TwitchBot(commands.Bot):
             print(f"CRITICAL ERROR in _check_connection: {e}")
             traceback.print_exc()
             # Пытаемся восстановить соединение при критической ошибке
+            self.health.on_disconnected()
             if not self.reconnect_task or self.reconnect_task.done():
                 self.reconnect_task = asyncio.create_task(self._reconnect())
             
@@ -961,8 +1114,7 @@ class TwitchBot(commands.Bot):
         """Attempt to reconnect"""
         try:
             # IMPROVED CHECK FOR ACTIVE CONNECTION: If we have a working WebSocket and channels, abort reconnect
-            if (hasattr(self, '_ws') and self._ws and hasattr(self._ws, 'socket') and 
-                    self._ws.socket and not self._ws.socket.closed and 
+            if (self._socket_open() and self.health.down_since is None and
                     len(getattr(self, 'connected_channels', [])) > 0):
                 print("Connection already established - canceling reconnect attempt")
                 self.reconnect_attempts = 0  # Reset counter
@@ -998,7 +1150,7 @@ class TwitchBot(commands.Bot):
             
             # Close existing connection if present
             try:
-                if hasattr(self, '_ws') and self._ws and hasattr(self._ws, 'socket') and self._ws.socket and not self._ws.socket.closed:
+                if self._socket_open():
                     await self.close()
                     await asyncio.sleep(1)  # Brief pause after closing connection
             except Exception as e:
@@ -1021,17 +1173,18 @@ class TwitchBot(commands.Bot):
                 await self.connect()
                 
                 # Check connection success
-                if hasattr(self, '_ws') and self._ws and hasattr(self._ws, 'socket') and self._ws.socket and not self._ws.socket.closed:
+                if self._socket_open():
                     print("Connection established, joining channel...")
-                    await self.join_channels([self.channel])
+                    await self.join_channels(list(self._channel_contexts))
                     
                     # Verify successful channel join
                     if len(self.connected_channels) > 0:
-                        print(f"Successfully joined channel {self.channel} - reconnection complete")
+                        print(f"Successfully joined channels {', '.join(self._channel_contexts)} - reconnection complete")
                         # Update last heartbeat
                         print("Join successful, updating heartbeat...")
                         self.last_heartbeat = time.time()
                         self.reconnect_attempts = 0  # Reset attempt counter
+                        self.health.on_connected(reconnect=True)
                         
                         # Signal to UI about successful reconnection
                         if hasattr(self, 'signal_handler') and self.signal_handler:
@@ -1084,7 +1237,8 @@ class TwitchBot(commands.Bot):
                 print(f"Error during reconnect: {e}")
                 # If connection failed, try again after delay
                 if self.is_running:
-                    retry_delay = min(10 * self.reconnect_attempts, 30)  # Increasing delay, max 30 seconds
+                    # Экспоненциальная задержка со случайной составляющей
+                    retry_delay = round(self.health.backoff(self.reconnect_attempts), 1)
                     print(f"Will retry in {retry_delay} seconds...")
                     
                     if hasattr(self, 'signal_handler') and self.signal_handler:
@@ -1102,7 +1256,7 @@ class TwitchBot(commands.Bot):
             # If critical error during reconnection, try again
             if self.is_running:
                 # Increased delay after critical error
-                retry_delay = 15
+                retry_delay = round(self.health.backoff(self.reconnect_attempts + 1), 1)
                 if hasattr(self, 'signal_handler') and self.signal_handler:
                     self.signal_handler.chat_signal.emit(f"Critical connection error. Retrying in {retry_delay} seconds...")
                 
@@ -1115,6 +1269,7 @@ class TwitchBot(commands.Bot):
         """Вызывается при рейде на канал"""
         try:
             print(f"RAID EVENT RECEIVED: {raider.name} with {raider.viewers} viewers")
+            self._enter_channel(getattr(raider, 'channel', None))
             
             # Проверяем наличие currency_manager
             if not hasattr(self, 'currency_manager'):
@@ -1141,10 +1296,10 @@ class TwitchBot(commands.Bot):
             # Отправляем сообщение в чат
             message = f"Спасибо за рейд, @{raider.name}! +{formatted_points} очков за рейд с {viewers} зрителями."
             
-            if len(self.connected_channels) > 0:
+            channel = self._current_chat()
+            if channel is not None:
                 try:
-                    channel = self.connected_channels[0]
-                    await channel.send(message)
+                    await self.say(channel, message)
                 except Exception as e:
                     print(f"Error sending raid message to chat: {e}")
             
@@ -1160,6 +1315,7 @@ class TwitchBot(commands.Bot):
     async def event_subscription(self, subscription):
         """Вызывается при подписке на канал"""
         try:
+            self._enter_channel(getattr(subscription, 'channel', None))
             sub_points = self.currency_manager.settings.get("sub_points", 20)
             tier_multiplier = 1  # Tier 1
             
@@ -1178,11 +1334,10 @@ class TwitchBot(commands.Bot):
             formatted_points = f"{float(points_to_award):.2f}"
             
             # Отмечаем пользователя как подписчика
-            if subscription.user.name in self.currency_manager.users:
-                self.currency_manager.users[subscription.user.name]['is_subscriber'] = True
+            self.currency_manager.set_user_fields(subscription.user.name, {'is_subscriber': True})
             
             # Сообщение в чат
-            await self.connected_channels[0].send(
+            await self.say(self._current_chat(),
                 f"Спасибо за подписку, {subscription.user.name}! Получено {formatted_points} очков."
             )
             
@@ -1196,6 +1351,7 @@ class TwitchBot(commands.Bot):
     async def event_follow(self, follower):
         """Вызывается при подписке пользователя на канал"""
         try:
+            self._enter_channel(getattr(follower, 'channel', None))
             # Получаем количество очков за подписку из настроек
             follow_points = self.currency_manager.settings.get("follow_points", 5)
             
@@ -1209,13 +1365,10 @@ class TwitchBot(commands.Bot):
             print(f"[Follow] {follower.name} получил {formatted_points} очков за подписку")
             
             # Сообщение в чат (опционально)
-            if len(self.connected_channels) > 0:
+            channel = self._current_chat()
+            if channel is not None:
                 try:
-                    channel = self.connected_channels[0]
-                    asyncio.run_coroutine_threadsafe(
-                        channel.send(f"Спасибо за подписку, {follower.name}! +{formatted_points} очков"),
-                        self.loop
-                    )
+                    await self.say(channel, f"Спасибо за подписку, {follower.name}! +{formatted_points} очков")
                 except Exception as e:
                     print(f"Error sending follow message to chat: {e}")
                     
@@ -1245,7 +1398,7 @@ class TwitchBot(commands.Bot):
                 formatted_hours = self.currency_manager.format_hours(hours)
                 
                 rank_text = f" [{rank}]" if rank else ""
-                await ctx.send(f"{ctx.author.name}{rank_text} - Hours: {formatted_hours} - {currency_name}: {formatted_points}")
+                await self.say(ctx.channel, f"{ctx.author.name}{rank_text} - Hours: {formatted_hours} - {currency_name}: {formatted_points}")
 
             @self.command(name="points_add")
             async def cmd_points_add(ctx, target: str = None, amount: int = None):
@@ -1258,13 +1411,13 @@ class TwitchBot(commands.Bot):
                 
                 if not is_mod:
                     print(f"DEBUG: DENYING command access to {username}")
-                    await ctx.send(f"@{ctx.author.name}: You don't have permission to use this command")
+                    await self.notice(ctx.channel, ctx.author.name, "You don't have permission to use this command", key="permission")
                     return
                 
                 print(f"DEBUG: GRANTING command access to {username}")
                 
                 if not target or not amount:
-                    await ctx.send("Usage: !points_add <username> <amount>")
+                    await self.say(ctx.channel, "Usage: !points_add <username> <amount>")
                     return
 
                 try:
@@ -1275,9 +1428,9 @@ class TwitchBot(commands.Bot):
 
                     amount = int(amount)
                     self.currency_manager.add_points(target, amount)
-                    await ctx.send(f"Successfully given {target} {amount} {self.currency_manager.get_currency_name()}")
+                    await self.say(ctx.channel, f"Successfully given {target} {amount} {self.currency_manager.get_currency_name()}")
                 except ValueError:
-                    await ctx.send("Amount must be a number")
+                    await self.say(ctx.channel, "Amount must be a number")
 
             @self.command(name="points_remove")
             async def cmd_points_remove(ctx, target: str = None, amount: int = None):
@@ -1290,13 +1443,13 @@ class TwitchBot(commands.Bot):
                 
                 if not is_mod:
                     print(f"DEBUG: DENYING command access to {username}")
-                    await ctx.send(f"@{ctx.author.name}: You don't have permission to use this command")
+                    await self.notice(ctx.channel, ctx.author.name, "You don't have permission to use this command", key="permission")
                     return
                 
                 print(f"DEBUG: GRANTING command access to {username}")
 
                 if not target or not amount:
-                    await ctx.send("Usage: !points_remove <username> <amount>")
+                    await self.say(ctx.channel, "Usage: !points_remove <username> <amount>")
                     return
 
                 try:
@@ -1307,9 +1460,9 @@ class TwitchBot(commands.Bot):
 
                     amount = int(amount)
                     self.currency_manager.add_points(target, -amount)
-                    await ctx.send(f"Successfully removed {amount} {self.currency_manager.get_currency_name()} from {target}")
+                    await self.say(ctx.channel, f"Successfully removed {amount} {self.currency_manager.get_currency_name()} from {target}")
                 except ValueError:
-                    await ctx.send("Amount must be a number")
+                    await self.say(ctx.channel, "Amount must be a number")
 
             print("Built-in bot commands registered successfully.")
         except Exception as e:
@@ -1317,28 +1470,8 @@ class TwitchBot(commands.Bot):
             traceback.print_exc()
 
     def normalize_command_key(self, key):
-        """Нормализует ключ команды, удаляя невидимые символы и пробелы"""
-        if not key:
-            return ""
-            
-        # Превращаем в нижний регистр
-        key = key.lower()
-        
-        # Сначала удаляем все невидимые символы (Unicode категории C)
-        # и символы-разделители пробельного типа
-        normalized = ''
-        for c in key:
-            if c.isprintable() and not c.isspace():
-                normalized += c
-                
-        # Для дополнительной безопасности обрабатываем вариации имен команд
-        normalized = normalized.replace('!', '')  # Удаляем префиксы команд если они остались
-        
-        # Логирование при обнаружении изменений
-        if normalized != key and key:
-            print(f"Command key normalized: '{key}' -> '{normalized}'")
-            
-        return normalized
+        """Нормализует ключ команды, удаляя невидимые символы и пробелы (см. command_keys)"""
+        return normalize_command_key(key)
     
     def cleanup_cooldowns(self):
         """Очищает кулдауны от устаревших записей и нормализует ключи команд"""
@@ -1414,14 +1547,12 @@ class TwitchBot(commands.Bot):
             
             if cooldown_sec > 0 and elapsed < cooldown_sec:
                 remaining = int(cooldown_sec - elapsed)
-                await message.channel.send(
-                    f"@{username}: command is on cooldown. Try in {remaining} sec."
-                )
+                await self.notice(message.channel, username, f"command is on cooldown. Try in {remaining} sec.")
                 return
             
             # Command executes - format and send response
             response = self.currency_manager.format_currency_message(username)
-            await message.channel.send(response)
+            await self.say(message.channel, response)
             
             # Update the last usage time only AFTER successful execution
             if cooldown_sec > 0:  # Check if cooldown is active
@@ -1431,13 +1562,13 @@ class TwitchBot(commands.Bot):
             # Check if user is moderator
             is_mod = await self.is_user_moderator(username)
             if not is_mod:
-                await message.channel.send(f"@{username}: You don't have permission to use this command.")
+                await self.notice(message.channel, username, "You don't have permission to use this command.", key="permission")
                 return
                 
             # Parse message for parameters (target user and amount)
             args = full_content.split(maxsplit=2)[1:]
             if len(args) < 2:
-                await message.channel.send(f"@{username}: Usage: !add_points @username amount")
+                await self.notice(message.channel, username, "Usage: !add_points @username amount")
                 return
                 
             # Get target user (remove @ if present)
@@ -1452,10 +1583,10 @@ class TwitchBot(commands.Bot):
                 # Round to two decimal places
                 points_amount = round(points_amount, 2)
                 if points_amount <= 0:
-                    await message.channel.send(f"@{username}: Amount must be greater than 0")
+                    await self.notice(message.channel, username, "Amount must be greater than 0")
                     return
             except ValueError:
-                await message.channel.send(f"@{username}: Invalid amount format. Use numbers only.")
+                await self.notice(message.channel, username, "Invalid amount format. Use numbers only.")
                 return
                 
             # Add points with validation
@@ -1465,7 +1596,7 @@ class TwitchBot(commands.Bot):
 
             # Если баланс не изменился, считаем, что валидация не прошла
             if new_points == old_points and points_amount > 0:
-                await message.channel.send(
+                await self.say(message.channel, 
                     f"@{username}: Failed to add points. Possible reasons: amount too large, "
                     f"would exceed maximum balance, or suspicious balance change detected."
                 )
@@ -1476,13 +1607,13 @@ class TwitchBot(commands.Bot):
             formatted_points = f"{float(new_points):.2f}"
 
             # Основное сообщение об успешном добавлении
-            await message.channel.send(
+            await self.say(message.channel, 
                 f"@{target_user} received {points_amount:.2f} points from @{username}. New balance: {formatted_points}"
             )
 
             # Дополнительное предупреждение, если баланс достиг или превысил максимум
             if new_points >= max_balance:
-                await message.channel.send(
+                await self.say(message.channel, 
                     f"@{username}: Warning: @{target_user} has reached or exceeded the maximum balance limit "
                     f"({max_balance:.0f} points). Further additions may be blocked by validation."
                 )
@@ -1491,13 +1622,13 @@ class TwitchBot(commands.Bot):
             # Check if user is moderator
             is_mod = await self.is_user_moderator(username)
             if not is_mod:
-                await message.channel.send(f"@{username}: You don't have permission to use this command.")
+                await self.notice(message.channel, username, "You don't have permission to use this command.", key="permission")
                 return
                 
             # Parse message for parameters (target user and amount)
             args = full_content.split(maxsplit=2)[1:]
             if len(args) < 2:
-                await message.channel.send(f"@{username}: Usage: !remove_points @username amount")
+                await self.notice(message.channel, username, "Usage: !remove_points @username amount")
                 return
                 
             # Get target user (remove @ if present)
@@ -1512,10 +1643,10 @@ class TwitchBot(commands.Bot):
                 # Round to two decimal places
                 points_amount = round(points_amount, 2)
                 if points_amount <= 0:
-                    await message.channel.send(f"@{username}: Amount must be greater than 0")
+                    await self.notice(message.channel, username, "Amount must be greater than 0")
                     return
             except ValueError:
-                await message.channel.send(f"@{username}: Invalid amount format. Use numbers only.")
+                await self.notice(message.channel, username, "Invalid amount format. Use numbers only.")
                 return
 
             # Get current points of the user BEFORE removal
@@ -1523,9 +1654,7 @@ class TwitchBot(commands.Bot):
 
             # Check if user has enough points
             if old_balance < points_amount:
-                await message.channel.send(
-                    f"@{username}: User @{target_user} only has {old_balance:.2f} points, cannot remove {points_amount:.2f}"
-                )
+                await self.notice(message.channel, username, f"User @{target_user} only has {old_balance:.2f} points, cannot remove {points_amount:.2f}")
                 return
 
             # Remove points with validation
@@ -1544,11 +1673,11 @@ class TwitchBot(commands.Bot):
                 else:
                     error_msg = "Validation error occurred"
 
-                await message.channel.send(f"@{username}: Failed to remove points. {error_msg}")
+                await self.notice(message.channel, username, f"Failed to remove points. {error_msg}")
                 return
 
             # Если мы здесь — операция прошла успешно, баланс изменился
-            await message.channel.send(
+            await self.say(message.channel, 
                 f"@{username} removed {points_amount:.2f} points from @{target_user}. New balance: {new_balance:.2f}"
             )
         else:
@@ -1556,8 +1685,11 @@ class TwitchBot(commands.Bot):
             response = sys_cmd.get("response", "")
             if response:
                 # Replace placeholders in the response
-                formatted_response = response.replace("{user}", username)
-                await message.channel.send(formatted_response)
+                template = compile_template(response)
+                formatted_response = template.render(
+                    command_values(template.fields, username, self.currency_manager, full_content,
+                                   viewers=self.all_viewers))
+                await self.say(message.channel, formatted_response)
 
     async def execute_random_command(self, message, username, sys_cmd, full_content):
         """Execute the random command functionality"""
@@ -1579,9 +1711,9 @@ class TwitchBot(commands.Bot):
 
         if not commands_in_group:
             if group_name == "ALL":
-                await message.channel.send(f"@{username}: No enabled commands found")
+                await self.notice(message.channel, username, "No enabled commands found")
             else:
-                await message.channel.send(f"@{username}: No commands found in group '{group_name}'")
+                await self.notice(message.channel, username, f"No commands found in group '{group_name}'")
             return
 
         # Select a random command from the group
@@ -1605,9 +1737,7 @@ class TwitchBot(commands.Bot):
             elapsed = current_time - last_used
             if elapsed < cooldown_sec:
                 remaining = int(cooldown_sec - elapsed)
-                await message.channel.send(
-                    f"@{username}: command is on cooldown. Try in {remaining} sec."
-                )
+                await self.notice(message.channel, username, f"command is on cooldown. Try in {remaining} sec.", key=("cooldown", cmd_key))
                 return
 
         # User cooldown check
@@ -1616,49 +1746,45 @@ class TwitchBot(commands.Bot):
             elapsed = current_time - last_used
             if elapsed < user_cooldown_sec:
                 remaining = int(user_cooldown_sec - elapsed)
-                await message.channel.send(
-                    f"@{username}: you can use this command in {remaining} sec."
-                )
+                await self.notice(message.channel, username, f"you can use this command in {remaining} sec.")
                 return
 
         # Check command cost
         cost = int(selected_cmd.get("Cost", 0))
+        reservation = None
         if cost > 0:
-            # Check if user has enough points
-            current_points = self.currency_manager.get_points(username)
-            if current_points < cost:
+            # Hold the points until the command has run
+            reservation = self.currency_manager.reserve(username, cost)
+            if reservation is None:
+                current_points = self.currency_manager.get_points(username)
                 formatted_points = f"{float(current_points):.2f}"
-                await message.channel.send(
-                    f"@{username}: Not enough points. Cost: {cost} (you have {formatted_points})"
-                )
+                await self.notice(message.channel, username, f"Not enough points. Cost: {cost} (you have {formatted_points})")
                 return
 
-            # Deduct points
-            if not self.currency_manager.pay_for_command(username, cost):
-                formatted_points = f"{float(current_points):.2f}"
-                await message.channel.send(
-                    f"@{username}: Payment error. Cost: {cost} (you have {formatted_points})"
-                )
-                return
+        try:
+            # Show picked command if enabled
+            if sys_cmd.get("show_picked_command", True):
+                response_template = sys_cmd.get("picked_command_response", "Picked {command}.")
+                formatted_response = response_template.replace("{command}", selected_cmd['Command'])
+                await self.say(message.channel, formatted_response)
+
+            # Execute the command's response
+            resp = selected_cmd.get("Response", "")
+            if resp and resp.strip():
+                values = self.response_values(resp, username, full_content, selected_cmd)
+                await self.send_multiline_response(message.channel, resp, username, values)
 
-        # Show picked command if enabled
-        if sys_cmd.get("show_picked_command", True):
-            response_template = sys_cmd.get("picked_command_response", "Picked {command}.")
-            formatted_response = response_template.replace("{command}", selected_cmd['Command'])
-            await message.channel.send(formatted_response)
-
-        # Execute the command's response
-        resp = selected_cmd.get("Response", "")
-        if resp and resp.strip():
-            await self.send_multiline_response(message.channel, resp, username)
-
-        # Execute the command's sound if any
-        sf = selected_cmd.get("SoundFile", "").strip()
-        if sf:
-            volume = int(selected_cmd.get("Volume", 100))
-            sound_played = self.play_sound(sf, volume)
-            if sound_played:
-                print(f"Successfully played sound for random command '{cmd_key}'")
+            # Execute the command's sound if any
+            sf = selected_cmd.get("SoundFile", "").strip()
+            if sf:
+                volume = int(selected_cmd.get("Volume", 100))
+                sound_played = self.play_sound(sf, volume)
+                if sound_played:
+                    print(f"Successfully played sound for random command '{cmd_key}'")
+        except Exception:
+            self.currency_manager.rollback(reservation)
+            raise
+        self.currency_manager.commit(reservation)
 
         # Update cooldowns after successful execution
         if cooldown_sec > 0:
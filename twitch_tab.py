@@ -22,6 +22,8 @@ from config_manager import ConfigManager
 # регистрируем QTextCursor для передачи в сигналах
 QMetaType.type("QTextCursor")
 
+PRESENCE_PAYOUT_INTERVAL = 300  # Начисление за присутствие, секунд (точность от частоты не зависит)
+
 class ChatSignalHandler(QObject):
     chat_signal = pyqtSignal(str)
     active_viewers_signal = pyqtSignal(list)
@@ -49,7 +51,8 @@ class TwitchTab(QWidget):
         self.signal_handler.currency_updated.connect(self.update_currency)
         self.signal_handler.moderators_signal.connect(self.update_moderators_list)  # Подключаем новый сигнал
 
-        self.config_manager = ConfigManager()
+        # Используем общий ConfigManager главного окна, если он есть
+        self.config_manager = getattr(parent, 'config_manager', None) or ConfigManager.instance()
         self.initUI()
         self.load_settings()
 
@@ -253,6 +256,10 @@ class TwitchTab(QWidget):
             self.show_auth_dialog()
             return False
 
+        # pygame mixer нужен боту для звуков команд
+        if self.parent and hasattr(self.parent, 'ensure_audio'):
+            self.parent.ensure_audio()
+
         # Store parameters for bot initialization in the run_bot thread
         self.bot_params = {
             'channel': channel,
@@ -286,6 +293,7 @@ class TwitchTab(QWidget):
             self.bot = TwitchBot(
                 channel=channel,
                 message_callback=self.bot_params['message_callback'],
+                config_manager=self.config_manager,
                 currency_manager=self.bot_params['currency_manager']
             )
             if self.bot_params['commands_data']:
@@ -337,6 +345,7 @@ class TwitchTab(QWidget):
 
     def disconnect(self):
         self.stop_viewer_updates()
+        self.settle_presence()
         if self.bot:
             try:
                 self.bot.stop()
@@ -530,12 +539,25 @@ class TwitchTab(QWidget):
             if hasattr(self, 'signal_handler'):
                 self.signal_handler.chat_signal.emit(f"[POINTS] {message}")
         
-        self.parent.currency_manager.process_currency_update(
-            is_live=self.currently_live,
-            active_viewers=self.active_users,
-            all_viewers=viewers,
-            chat_message_callback=show_service_message
-        )
+        # Присутствие копится в трекере бота, начисление - не чаще раза в PRESENCE_PAYOUT_INTERVAL
+        now = time.time()
+        if now - getattr(self, 'last_presence_payout', 0) >= PRESENCE_PAYOUT_INTERVAL:
+            self.last_presence_payout = now
+            active_users = self.bot.active_users
+            self.update_active_viewers(list(active_users))
+            self.parent.currency_manager.process_presence_update(
+                self.bot.presence, chat_message_callback=show_service_message,
+                active_users=active_users
+            )
+
+    def settle_presence(self):
+        """Pay out the presence collected since the last payout (before disconnecting)"""
+        if self.bot and hasattr(self.parent, 'currency_manager'):
+            try:
+                self.parent.currency_manager.process_presence_update(
+                    self.bot.presence, active_users=self.bot.active_users)
+            except Exception as e:
+                print(f"Error settling presence: {e}")
 
     @pyqtSlot(list)
     def update_active_viewers(self, viewers):
@@ -679,20 +701,19 @@ class TwitchTab(QWidget):
         # Обновляем в системе валюты
         if hasattr(self, 'parent') and self.parent and hasattr(self.parent, 'currency_manager'):
             currency_manager = self.parent.currency_manager
-            if username in currency_manager.users:
-                currency_manager.users[username]['is_mod'] = is_moderator
+            if currency_manager.set_user_fields(username, {'is_mod': is_moderator}):
                 currency_manager.save_users()
                 print(f"User {username} moderator status updated to: {is_moderator}")
         
         # Обновляем в боте
         if self.bot and hasattr(self.bot, 'currency_manager'):
-            if username in self.bot.currency_manager.users:
-                self.bot.currency_manager.users[username]['is_mod'] = is_moderator
+            if self.bot.currency_manager.set_user_fields(username, {'is_mod': is_moderator}):
                 self.bot.currency_manager.save_users()
                 print(f"Bot: User {username} moderator status updated to: {is_moderator}")
         
         # Критически важно: перезагружаем конфигурацию модераторов в боте
-        if self.bot and hasattr(self.bot, 'config_manager'):
+        # (не нужно, если бот использует тот же общий ConfigManager)
+        if self.bot and hasattr(self.bot, 'config_manager') and self.bot.config_manager is not self.config_manager:
             # Перезагружаем конфигурацию модераторов
             self.bot.config_manager.moderators_config = self.bot.config_manager.load_moderators_config()
             print(f"Bot moderators config reloaded")
@@ -292,7 +292,7 @@ class UserCurrencyTab(QWidget):
 
                 # Используем add_user, затем обновляем значения и сохраняем принудительно
                 self.currency_manager.add_user(username, points=points, hours=hours)
-                self.currency_manager.users[username]['last_seen'] = time.time()
+                self.currency_manager.set_user_fields(username, {'last_seen': time.time()})
                 # Явное сохранение, чтобы гарантировать запись в файл
                 self.currency_manager.save_users(force=True)
                 
@@ -363,10 +363,12 @@ class UserCurrencyTab(QWidget):
             is_regular = is_regular_check.isChecked()
             
             # Обновляем данные пользователя
-            self.currency_manager.users[username]['points'] = points
-            self.currency_manager.users[username]['hours'] = hours
-            self.currency_manager.users[username]['is_regular'] = is_regular
-            self.currency_manager.users[username]['last_seen'] = time.time()
+            self.currency_manager.set_user_fields(username, {
+                'points': points,
+                'hours': hours,
+                'is_regular': is_regular,
+                'last_seen': time.time()
+            })
 
             # Помечаем данные как изменённые и сохраняем принудительно
             if hasattr(self.currency_manager, "_save_pending"):
@@ -433,7 +435,7 @@ class UserCurrencyTab(QWidget):
         try:
             if self.currency_manager:
                 # Явное сохранение по запросу пользователя всегда должно писать файл
-                success = self.currency_manager.save_users(force=True)
+                success = self.currency_manager.save_users(force=True, export=True)
                 if success:
                     QMessageBox.information(self, "Сохранение", "Данные пользователей успешно сохранены!")
                     # Обновляем время последнего обновления
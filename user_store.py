@@ -0,0 +1,790 @@
+"""
+Tiered storage for currency users.
+
+Users touched during the current session are kept in memory (hot set),
+everyone else lives in a SQLite index next to users_currency.json and is
+loaded on demand. The store behaves like a dict, so existing code that
+works with CurrencyManager.users keeps working. Only assignments
+(users[name] = record) mark a user for the next flush; a record changed in
+place is written when it is evicted from the hot set at the latest, so
+changes should still be assigned back.
+
+The store also keeps an integrity digest: the XOR of a 128-bit hash of every
+users row. A flush only rehashes the rows it writes, so the digest is always
+current without re-serializing the whole user set. After a bulk update the
+digest is recomputed on a background snapshot instead of blocking the update.
+
+Inactive users with (almost) no points can be moved to a compressed cold
+archive (UserArchive). They are not part of the index, the JSON export or the
+digest any more, and are restored transparently the next time they are
+looked up.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Dict, Any, List, Optional
+
+
+# Поля, которые хранятся в отдельных колонках; все остальное уходит в extra
+_COLUMN_FIELDS = ('points', 'hours', 'last_seen', 'rank', 'is_regular', 'is_mod', 'is_subscriber')
+_FLAG_FIELDS = ('is_regular', 'is_mod', 'is_subscriber')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    points REAL,
+    hours REAL,
+    last_seen REAL,
+    rank TEXT,
+    is_regular INTEGER,
+    is_mod INTEGER,
+    is_subscriber INTEGER,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS bulk_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    description TEXT,
+    affected INTEGER NOT NULL
+);
+"""
+
+# Значение users_digest, пока дайджест пересчитывается после массового изменения
+DIGEST_STALE = "stale"
+
+_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    count INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archived (
+    username TEXT PRIMARY KEY,
+    batch_id INTEGER NOT NULL
+);
+"""
+
+ARCHIVE_BATCH_SIZE = 2000
+
+_SELECT_USERS = ("SELECT username, points, hours, last_seen, rank, is_regular, is_mod, is_subscriber, extra "
+                 "FROM users")
+
+
+def record_to_row(username: str, record: Dict[str, Any]) -> tuple:
+    """Convert a user record into a users table row"""
+    row = [username]
+    for field in _COLUMN_FIELDS:
+        value = record.get(field)
+        if field in _FLAG_FIELDS and value is not None:
+            value = 1 if value else 0
+        row.append(value)
+    extra = {k: v for k, v in record.items() if k not in _COLUMN_FIELDS}
+    row.append(json.dumps(extra, ensure_ascii=False) if extra else None)
+    return tuple(row)
+
+
+def row_hash(row) -> int:
+    """128-bit hash of a full users row (with username) as read from SQLite"""
+    data = "\x1f".join(repr(value) for value in row).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=16).digest(), 'big')
+
+
+def format_digest(digest: int) -> str:
+    return f"{digest:032x}"
+
+
+def row_to_record(row) -> Dict[str, Any]:
+    """Convert a users table row (without username) back into a user record"""
+    record = {}
+    for field, value in zip(_COLUMN_FIELDS, row):
+        if value is None:
+            continue
+        if field in _FLAG_FIELDS:
+            value = bool(value)
+        elif field in ('points', 'hours') and isinstance(value, float) and value.is_integer():
+            value = int(value)
+        record[field] = value
+    if row[len(_COLUMN_FIELDS)]:
+        record.update(json.loads(row[len(_COLUMN_FIELDS)]))
+    return record
+
+
+class UserStore(MutableMapping):
+    """Dict-like user storage with an in-memory hot set and a SQLite cold index"""
+
+    def __init__(self, db_path, idle_timeout: float = 1800, archive_path=None):
+        """
+        Args:
+            db_path: Path to the SQLite index file
+            idle_timeout (float): Seconds without access before a hot user is evicted
+            archive_path: Path to the cold archive of inactive users (None - no archive)
+        """
+        self.db_path = str(db_path)
+        self.idle_timeout = idle_timeout
+        self.archive = UserArchive(archive_path) if archive_path else None
+        self.rehydrated = 0
+
+        self._lock = threading.RLock()
+        self._hot: Dict[str, Dict[str, Any]] = {}
+        self._last_access: Dict[str, float] = {}
+        self._touched = set()  # Пользователи, записанные с последнего flush
+        self._deleted = set()
+        # Фоновый пересчет дайджеста после bulk-изменения: (поток, результат, отмена) и изменения за время пересчета
+        self._digest_job = None
+        self._digest_delta = 0
+
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+        stored = self.get_meta('users_digest')
+        if stored is None or stored == DIGEST_STALE:
+            # Индекс создан до появления контрольной суммы или пересчет не успел завершиться
+            self._digest = self._hash_all()
+            self.set_meta('users_digest', format_digest(self._digest))
+        else:
+            self._digest = int(stored, 16)
+
+    # === Mapping interface ===
+
+    def __getitem__(self, username: str) -> Dict[str, Any]:
+        with self._lock:
+            record = self._hot.get(username)
+            if record is None:
+                if username in self._deleted:
+                    raise KeyError(username)
+                record = self._fetch(username)
+                if record is None:
+                    record = self._rehydrate(username)
+                    if record is None:
+                        raise KeyError(username)
+                self._hot[username] = record
+            # Чтение не помечает запись: изменения сохраняются после users[name] = record
+            self._last_access[username] = time.time()
+            return record
+
+    def __setitem__(self, username: str, record: Dict[str, Any]):
+        with self._lock:
+            self._hot[username] = record
+            self._touched.add(username)
+            self._deleted.discard(username)
+            self._last_access[username] = time.time()
+
+    def __delitem__(self, username: str):
+        with self._lock:
+            if username not in self:
+                raise KeyError(username)
+            self._hot.pop(username, None)
+            self._last_access.pop(username, None)
+            self._touched.discard(username)
+            self._deleted.add(username)
+
+    def __contains__(self, username) -> bool:
+        with self._lock:
+            if username in self._hot:
+                return True
+            if username in self._deleted:
+                return False
+            row = self._conn.execute(
+                "SELECT 1 FROM users WHERE username = ?", (username,)
+            ).fetchone()
+            return row is not None or self._rehydrate(username) is not None
+
+    def __iter__(self):
+        with self._lock:
+            self.flush()
+            names = [row[0] for row in self._conn.execute("SELECT username FROM users")]
+        return iter(names)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self.flush()
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def __bool__(self) -> bool:
+        with self._lock:
+            if self._hot:
+                return True
+            self.flush()
+            return self._conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is not None
+
+    def items(self):
+        """Iterate over all users without pulling cold users into the hot set"""
+        with self._lock:
+            self.flush()
+            rows = self._conn.execute(_SELECT_USERS).fetchall()
+            hot = dict(self._hot)
+        for row in rows:
+            username = row[0]
+            record = hot.get(username)
+            yield username, (record if record is not None else row_to_record(row[1:]))
+
+    def values(self):
+        for _, record in self.items():
+            yield record
+
+    def copy(self) -> Dict[str, Dict[str, Any]]:
+        """Plain dict snapshot of every user"""
+        return {username: dict(record) for username, record in self.items()}
+
+    def snapshot(self) -> "UserSnapshot":
+        """Consistent read-only view of all users for background readers
+
+        Pending changes are flushed under the lock and a read transaction is
+        opened on a separate connection. Thanks to WAL the snapshot keeps
+        seeing this exact state while the store continues to be written.
+        A background digest rehash is waited for first, so the snapshot's
+        digest is never the DIGEST_STALE placeholder.
+        """
+        with self._lock:
+            self.flush()
+            self._settle_digest(wait=True)
+            return UserSnapshot(self.db_path)
+
+    def _fetch(self, username: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT points, hours, last_seen, rank, is_regular, is_mod, is_subscriber, extra "
+            "FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        return row_to_record(row) if row else None
+
+    # === Hot set management ===
+
+    @property
+    def hot_count(self) -> int:
+        return len(self._hot)
+
+    def flush(self) -> int:
+        """Write changed hot users and pending deletions to the index"""
+        with self._lock:
+            if not self._touched and not self._deleted:
+                return 0
+            return self._write(set(self._touched), set(self._deleted))
+
+    def flush_keys(self, usernames) -> int:
+        """Write only the given users (one small transaction), other changes stay pending"""
+        with self._lock:
+            usernames = set(usernames)
+            touched = usernames & self._touched
+            deleted = usernames & self._deleted
+            if not touched and not deleted:
+                return 0
+            return self._write(touched, deleted)
+
+    def _write(self, touched: set, deleted: set) -> int:
+        """Upsert touched users and delete deleted ones in one transaction (call under the lock)"""
+        with self._lock:
+            self._settle_digest()
+            rows = [record_to_row(name, self._hot[name]) for name in touched if name in self._hot]
+            names = [row[0] for row in rows] + list(deleted)
+            with self._conn:
+                # Дайджест обновляется только по записываемым строкам: старый хеш выходит, новый входит
+                delta = self._hash_rows(names)
+                if rows:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+                    )
+                if deleted:
+                    self._conn.executemany(
+                        "DELETE FROM users WHERE username = ?", [(name,) for name in deleted]
+                    )
+                delta ^= self._hash_rows(names)
+                self._store_digest_delta(delta)
+            self._apply_digest_delta(delta)
+            if self.archive is not None and self.archive.count:
+                # Записанный или удаленный пользователь больше не должен подниматься из архива
+                self.archive.discard(names)
+            self._touched -= touched
+            self._deleted -= deleted
+            return len(rows) + len(deleted)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Drop users that were not accessed for idle_timeout seconds from memory"""
+        now = now or time.time()
+        with self._lock:
+            idle = [name for name, accessed in self._last_access.items()
+                    if now - accessed >= self.idle_timeout]
+            # Запись могли изменить на месте без users[name] = record - не теряем эти изменения
+            self._touched.update(self._changed_in_place(idle))
+            self.flush()
+            for name in idle:
+                self._hot.pop(name, None)
+                self._last_access.pop(name, None)
+            return len(idle)
+
+    def _changed_in_place(self, names) -> List[str]:
+        """Hot users whose record differs from their indexed row (call under the lock)"""
+        names = [name for name in names if name in self._hot and name not in self._touched]
+        changed = []
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            stored = {row[0]: tuple(row) for row in
+                      self._conn.execute(f"{_SELECT_USERS} WHERE username IN ({placeholders})", chunk)}
+            changed.extend(name for name in chunk
+                           if stored.get(name) != record_to_row(name, self._hot[name]))
+        return changed
+
+    def replace_all(self, users: Dict[str, Dict[str, Any]]):
+        """Replace the whole store content"""
+        with self._lock:
+            self._cancel_rehash()
+            if self.archive is not None and self.archive.count:
+                # Восстановленные из бэкапа пользователи важнее архивных копий
+                self.archive.discard(list(users))
+            self._hot.clear()
+            self._last_access.clear()
+            self._touched.clear()
+            self._deleted.clear()
+            with self._conn:
+                self._conn.execute("DELETE FROM users")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (record_to_row(name, record) for name, record in users.items()
+                     if isinstance(record, dict))
+                )
+                self._digest = self._hash_all()
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('users_digest', ?)",
+                                   (format_digest(self._digest),))
+
+    # === Cold archive ===
+
+    def _rehydrate(self, username: str) -> Optional[Dict[str, Any]]:
+        """Move an archived user back into the index (call under the lock)"""
+        if self.archive is None or not self.archive.count:
+            return None
+        record = self.archive.get(username)
+        if record is None:
+            return None
+        self._hot[username] = record
+        self._last_access[username] = time.time()
+        self._touched.add(username)
+        # Сразу пишем в индекс: после этого запись в архиве удаляется в _write
+        self._write({username}, set())
+        self.rehydrated += 1
+        return record
+
+    def archive_where(self, where: str, params=(), description: str = "") -> int:
+        """Move users matching a SQL condition to the cold archive
+
+        Users in the hot set are skipped, they are active in this session.
+        Every chunk is first written to the archive and then removed from the
+        index, so an interruption leaves a user in both places at worst (the
+        index copy wins).
+
+        Returns:
+            int: Number of archived users
+        """
+        with self._lock:
+            if self.archive is None:
+                return 0
+            self.flush()
+            self._settle_digest()
+            archived = 0
+            last = ""
+            while True:
+                rows = self._conn.execute(
+                    f"{_SELECT_USERS} WHERE username > ? AND ({where}) ORDER BY username LIMIT ?",
+                    [last] + list(params) + [ARCHIVE_BATCH_SIZE]
+                ).fetchall()
+                if not rows:
+                    break
+                last = rows[-1][0]
+                rows = [row for row in rows if row[0] not in self._hot]
+                if not rows:
+                    continue
+
+                self.archive.add({row[0]: row_to_record(row[1:]) for row in rows})
+                delta = 0
+                for row in rows:
+                    delta ^= row_hash(row)
+                with self._conn:
+                    self._conn.executemany("DELETE FROM users WHERE username = ?", [(row[0],) for row in rows])
+                    self._store_digest_delta(delta)
+                self._apply_digest_delta(delta)
+                archived += len(rows)
+
+            with self._conn:
+                self._conn.execute("INSERT INTO bulk_log (created, description, affected) VALUES (?, ?, ?)",
+                                   (time.time(), description or "archive", archived))
+            if archived:
+                self.archive.compact()
+            return archived
+
+    # === Bulk operations ===
+
+    def register_function(self, name: str, num_params: int, func):
+        """Make a Python function available to SQL expressions of bulk updates"""
+        with self._lock:
+            self._conn.create_function(name, num_params, func, deterministic=True)
+
+    def count_where(self, where: str, params=()) -> Dict[str, float]:
+        """Number of users matching a SQL condition and the sum of their points"""
+        with self._lock:
+            self.flush()
+            count, points = self._conn.execute(
+                f"SELECT COUNT(*), TOTAL(points) FROM users WHERE {where}", list(params)
+            ).fetchone()
+        return {'matched': count, 'total_points': points}
+
+    def update_where(self, where: str, params, set_clause: str, set_params=(), description: str = "") -> int:
+        """Update every user matching a SQL condition with one UPDATE statement
+
+        Args:
+            where: Condition over the users columns with ? placeholders
+            params: Parameters of the condition
+            set_clause: SET part of the statement, evaluated on the old row values
+            set_params: Parameters of the SET part
+            description: What was done, stored in bulk_log with the user count
+
+        Returns:
+            int: Number of updated users
+        """
+        with self._lock:
+            self.flush()
+            # Горячие записи, которые изменятся: после обновления их перечитаем из индекса
+            hot_targets = []
+            hot_names = list(self._hot)
+            for start in range(0, len(hot_names), 500):
+                chunk = hot_names[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                hot_targets += [row[0] for row in self._conn.execute(
+                    f"SELECT username FROM users WHERE username IN ({placeholders}) AND ({where})",
+                    chunk + list(params))]
+
+            with self._conn:
+                count = self._conn.execute(
+                    f"UPDATE users SET {set_clause} WHERE {where}", list(set_params) + list(params)
+                ).rowcount
+                if count:
+                    self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('users_digest', ?)", (DIGEST_STALE,))
+                self._conn.execute("INSERT INTO bulk_log (created, description, affected) VALUES (?, ?, ?)",
+                                   (time.time(), description, count))
+            if count:
+                for name in hot_targets:
+                    self._hot.pop(name, None)
+                    self._last_access.pop(name, None)
+                self._start_rehash()
+            return count
+
+    def bulk_log(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Latest bulk operations, newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, created, description, affected FROM bulk_log ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [{'id': row[0], 'created': row[1], 'description': row[2], 'affected': row[3]} for row in rows]
+
+    # === Integrity digest ===
+
+    def _start_rehash(self):
+        """Recompute the digest from a snapshot of the current state in a thread (call under the lock)"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM users").fetchone()  # Фиксируем снимок
+        result = {}
+        cancelled = threading.Event()
+
+        def rehash():
+            try:
+                digest = 0
+                cursor = conn.execute(_SELECT_USERS)
+                while not cancelled.is_set():
+                    rows = cursor.fetchmany(5000)
+                    if not rows:
+                        result['digest'] = digest
+                        break
+                    for row in rows:
+                        digest ^= row_hash(row)
+            finally:
+                conn.close()
+
+        # Более ранний пересчет больше не нужен: новый снимок включает все изменения
+        self._cancel_rehash()
+        job = threading.Thread(target=rehash, name="user-store-rehash", daemon=True)
+        self._digest_job = (job, result, cancelled)
+        job.start()
+
+    def _store_digest_delta(self, delta: int):
+        """Write the digest changed by `delta` to meta (call inside the write transaction)"""
+        if self._digest_job is None:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('users_digest', ?)",
+                               (format_digest(self._digest ^ delta),))
+
+    def _apply_digest_delta(self, delta: int):
+        """Fold `delta` into the digest after the transaction committed"""
+        if self._digest_job is None:
+            self._digest ^= delta
+        else:
+            # Снимок фонового пересчета этих изменений не видит - доложим их после
+            self._digest_delta ^= delta
+
+    def _cancel_rehash(self):
+        if self._digest_job is not None:
+            self._digest_job[2].set()
+        self._digest_job = None
+        self._digest_delta = 0
+
+    def _settle_digest(self, wait: bool = False):
+        """Take over the result of a finished background rehash (call under the lock)"""
+        if self._digest_job is None:
+            return
+        job, result, _ = self._digest_job
+        if wait:
+            job.join()
+        elif job.is_alive():
+            return
+        self._digest_job = None
+        if 'digest' not in result:
+            # Пересчет упал - считаем синхронно
+            self._digest = self._hash_all()
+        else:
+            self._digest = result['digest'] ^ self._digest_delta
+        self._digest_delta = 0
+        self.set_meta('users_digest', format_digest(self._digest))
+
+    def _hash_rows(self, names: List[str]) -> int:
+        """XOR of the row hashes of the given users (missing users count as 0)"""
+        digest = 0
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for row in self._conn.execute(f"{_SELECT_USERS} WHERE username IN ({placeholders})", chunk):
+                digest ^= row_hash(row)
+        return digest
+
+    def _hash_all(self) -> int:
+        """Digest of the whole table in one streaming pass"""
+        digest = 0
+        for row in self._conn.execute(_SELECT_USERS):
+            digest ^= row_hash(row)
+        return digest
+
+    def digest(self) -> str:
+        """Current integrity digest (pending changes are flushed first)"""
+        with self._lock:
+            self.flush()
+            self._settle_digest(wait=True)
+            return format_digest(self._digest)
+
+    def verify_digest(self) -> bool:
+        """Recompute the digest from every row and compare it with the tracked one"""
+        with self._lock:
+            self.flush()
+            self._settle_digest(wait=True)
+            return self._hash_all() == self._digest
+
+    def totals(self) -> Dict[str, float]:
+        """User count and point/hour sums, computed by SQLite"""
+        with self._lock:
+            self.flush()
+            count, points, hours = self._conn.execute(
+                "SELECT COUNT(*), TOTAL(points), TOTAL(hours) FROM users"
+            ).fetchone()
+        return {'user_count': count, 'total_points': points, 'total_hours': hours}
+
+    # === JSON compatibility ===
+
+    def get_meta(self, key: str, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def _json_signature(self, json_path) -> str:
+        stat = os.stat(json_path)
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def needs_import(self, json_path) -> bool:
+        """Check whether users_currency.json was changed outside of the store"""
+        if not os.path.exists(json_path):
+            return False
+        return self.get_meta('json_signature') != self._json_signature(json_path)
+
+    def import_json(self, json_path) -> int:
+        """Load users_currency.json into the index (first start or external change)"""
+        with open(json_path, 'r', encoding='utf-8') as f:
+            users = json.load(f)
+        if not isinstance(users, dict):
+            raise ValueError("Currency data is not a valid dictionary")
+        self.replace_all(users)
+        self.set_meta('json_signature', self._json_signature(json_path))
+        return len(users)
+
+    def export_json(self, json_path) -> int:
+        """Write every user to users_currency.json, one record at a time"""
+        tmp_path = f"{json_path}.tmp"
+        count = 0
+        with self._lock:
+            self.flush()
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write("{")
+                for username, record in self.items():
+                    body = json.dumps(record, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+                    f.write(("," if count else "") + "\n    " + json.dumps(username, ensure_ascii=False) + ": " + body)
+                    count += 1
+                f.write("\n}" if count else "}")
+            os.replace(tmp_path, json_path)
+            self.set_meta('json_signature', self._json_signature(json_path))
+            self._settle_digest(wait=True)
+            # Дайджест содержимого файла - для метаданных бэкапов
+            self.set_meta('json_digest', format_digest(self._digest))
+        return count
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._settle_digest(wait=True)
+            self._conn.close()
+            if self.archive is not None:
+                self.archive.close()
+
+
+class UserSnapshot:
+    """Point-in-time view of the users table, see UserStore.snapshot"""
+
+    def __init__(self, db_path: str, batch_size: int = 500):
+        self.batch_size = batch_size
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("BEGIN")
+        # Снимок фиксируется первым чтением внутри транзакции
+        self.count = self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'users_digest'").fetchone()
+        self.digest = row[0] if row else None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def items(self):
+        """Stream (username, record) pairs in batches of batch_size rows"""
+        cursor = self._conn.execute(f"{_SELECT_USERS} ORDER BY username")
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row[0], row_to_record(row[1:])
+
+    def close(self):
+        try:
+            self._conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            pass
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class UserArchive:
+    """Compressed cold storage of inactive users
+
+    Users are stored in zlib-compressed JSON batches; a small index maps each
+    username to its batch. Restoring a user only removes the index entry, the
+    batch is dropped by compact() once nobody in it is archived any more.
+    """
+
+    def __init__(self, db_path, cache_batches: int = 4):
+        self.db_path = str(db_path)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_ARCHIVE_SCHEMA)
+        self._conn.commit()
+        self._cache = OrderedDict()  # batch_id -> распакованные записи
+        self._cache_batches = cache_batches
+        self.count = self._conn.execute("SELECT COUNT(*) FROM archived").fetchone()[0]
+
+    def __contains__(self, username) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM archived WHERE username = ?", (username,)
+            ).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, records: Dict[str, Dict[str, Any]]):
+        """Archive users in batches of ARCHIVE_BATCH_SIZE"""
+        items = list(records.items())
+        with self._lock, self._conn:
+            for start in range(0, len(items), ARCHIVE_BATCH_SIZE):
+                chunk = dict(items[start:start + ARCHIVE_BATCH_SIZE])
+                data = zlib.compress(json.dumps(chunk, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 6)
+                batch_id = self._conn.execute(
+                    "INSERT INTO batches (created, count, data) VALUES (?, ?, ?)", (time.time(), len(chunk), data)
+                ).lastrowid
+                self._conn.executemany("INSERT OR REPLACE INTO archived VALUES (?, ?)",
+                                       [(name, batch_id) for name in chunk])
+            self.count = self._conn.execute("SELECT COUNT(*) FROM archived").fetchone()[0]
+
+    def get(self, username: str) -> Optional[Dict[str, Any]]:
+        """Archived record of a user (the user stays archived until discard)"""
+        with self._lock:
+            row = self._conn.execute("SELECT batch_id FROM archived WHERE username = ?", (username,)).fetchone()
+            if row is None:
+                return None
+            batch = self._batch(row[0])
+            record = batch.get(username) if batch else None
+            return dict(record) if record is not None else None
+
+    def _batch(self, batch_id: int) -> Optional[Dict[str, Any]]:
+        batch = self._cache.get(batch_id)
+        if batch is not None:
+            self._cache.move_to_end(batch_id)
+            return batch
+        row = self._conn.execute("SELECT data FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if row is None:
+            return None
+        batch = json.loads(zlib.decompress(row[0]).decode('utf-8'))
+        self._cache[batch_id] = batch
+        while len(self._cache) > self._cache_batches:
+            self._cache.popitem(last=False)
+        return batch
+
+    def discard(self, usernames):
+        """Forget archived copies of users that are back in the index"""
+        usernames = list(usernames)
+        with self._lock, self._conn:
+            for start in range(0, len(usernames), 500):
+                chunk = usernames[start:start + 500]
+                self.count -= self._conn.execute(
+                    f"DELETE FROM archived WHERE username IN ({','.join('?' * len(chunk))})", chunk
+                ).rowcount
+
+    def compact(self) -> int:
+        """Drop batches without archived users, returns the number of dropped batches"""
+        with self._lock, self._conn:
+            dropped = self._conn.execute(
+                "DELETE FROM batches WHERE id NOT IN (SELECT DISTINCT batch_id FROM archived)"
+            ).rowcount
+            self._cache.clear()
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            batches, size = self._conn.execute("SELECT COUNT(*), TOTAL(LENGTH(data)) FROM batches").fetchone()
+        return {'archived_users': self.count, 'batches': batches, 'compressed_bytes': int(size)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()